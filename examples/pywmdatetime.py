@@ -138,9 +138,14 @@ class Application(wmoo.Application):
         self.weekFmt = options.weekformat
         self.antialiased = options.antialiased
         self.debug = options.debug
+        # a clock has nothing to catch up with while hidden.
+        self.setPauseWhenHidden()
+        # the time shows seconds at most: wake up once a second, on the
+        # second, and not at every default refresh.
+        self.setRefreshInterval(1)
 
         self.recalcWeek = self.weekFmt.find('%q') + 1  # True if we found %q.
-        self.counter = -1
+        self.lastDay = None
         self.lastStrs = [''] * 4
 
         pass
@@ -173,16 +178,13 @@ class Application(wmoo.Application):
             self['time'].setText(s)
 
     def update(self):
-        self.counter += 1
         lt = time.localtime()
         timeStr = time.strftime(self.timeFmt, lt)
         self.updateTimeString(timeStr)
         self.lastStrs[0] = timeStr
-        if self.counter % 100 == 0:
-            # We only perform the date/week checks/updates once every 100th
-            # iteration. We will maybe lag behind a couple of seconds when
-            # switching, but switching occurs seldom and it will be alot of
-            # unnecessary checks :).
+        if lt[:3] != self.lastDay:
+            # The date, day and week only change with the day.
+            self.lastDay = lt[:3]
             dateStr = time.strftime(self.dateFmt, lt)
             newWeekFmt = self.weekFmt
             if self.recalcWeek:
@@ -35,30 +35,25 @@ Available options are:
 
 import sys
 import os
-import time
 import string
 import ConfigParser
 import getopt
-import popen2
+import subprocess
+import signal
+import fcntl
+import errno
 
 import wmdocklib
-
-prevStat = {'user':0,
-            'nice':0,
-            'sys':0,
-            'idle':0,
-            'total':0,
-            }
-import re
-cpuinfo = re.compile(r'^cpu[^ ]* +(?P<user>[0-9]+) +(?P<nice>[0-9]+)'
-                     r'+(?P<sys>[0-9]+) +(?P<idle>[0-9]+)')
+from wmdocklib import eventloop, procfs
 
 class UserMethods:
     """Put methods that should be called when the action is method=... here.
 
     The action methods should return a function, which in turn returns
     the string to be displayed (if no 'display =' exists) and stored
-    for later retreival.
+    for later retreival.  The method is called at start, every
+    update_delay and when the 'update' mouse action is used, the function
+    it returned every second.
 
     The mouse action methods gets the entry instance as an argument. Return
     value doesn't matter.
@@ -72,45 +67,39 @@ class UserMethods:
 
     userTicks = sysTicks = niceTicks = idleTicks = 0
     
+    # kept between the calls of getCpuTemp, the first call shows the
+    # averages since boot.
+    statFile = None
+    prevStat = procfs.CpuTimes(*[0] * 8)
+
     def getCpuTemp(self):
-        def result():
-            global prevStat
+        if self.statFile is None:
             try:
-                f = file('/proc/stat', 'r')
-            except IOError:
-                return 'error'
-
-            currStat = dict(
-                [(k, int(v))
-                 for (k,v) in cpuinfo.match(f.readline()).groupdict().items()]
-                )
-            f.close()
-
-            total = 0
-            for k,v in currStat.items():
-                total += v
-            currStat['total'] = total
-            totalTicks = (currStat['total'] - prevStat['total'])
+                UserMethods.statFile = procfs.StatFile()
+            except OSError:
+                return lambda: 'error'
 
-            result = {}
+        def result():
+            currStat = self.statFile.cpu()
+            totalTicks = currStat.total() - self.prevStat.total()
             if (totalTicks <= 0):
                 return '00/00/00'
 
-            for k in prevStat:
-                result[k] = (100. * (currStat[k] - prevStat[k])) / totalTicks
-            prevStat = currStat
+            result = {}
+            for k in ('user', 'system', 'idle'):
+                result[k] = (100. * (getattr(currStat, k) -
+                                     getattr(self.prevStat, k))) / totalTicks
+            UserMethods.prevStat = currStat
 
-            return '%(user)02.f/%(sys)02.f/%(idle)02.f' % result
+            return '%(user)02.f/%(system)02.f/%(idle)02.f' % result
         return result
 
     def getSysTemp(self):
         try:
-            f = file('/proc/sys/dev/sensors/w83697hf-isa-0290/temp1', 'r')
-        except IOError:
+            f = procfs.ProcFile('/proc/sys/dev/sensors/w83697hf-isa-0290/temp1')
+        except OSError:
             return lambda: 'error'
-        temp = f.readline().split()[2]
-        f.close()
-        return lambda: 'sys: %s' % temp
+        return lambda: 'sys: %s' % f.read().split()[2]
 
     def ls(self):
         return lambda: 'boh'
@@ -143,6 +132,16 @@ yOffset = 4
 
 maxChars = 13
 
+# seconds between two steps of a scrolling line.
+scrollDelay = 2
+
+# seconds between two calls of the function returned by a method action.
+pollDelay = 1
+
+# processes started by the mouse actions of one entry that may run at the
+# same time.
+defaultMaxProcs = 3
+
 defaultConfigFile = '~/.pywmgenericrc'
 defaultRGBFiles = ('/usr/share/X11/rgb.txt', '/usr/X11R6/lib/X11/rgb.txt')
 
@@ -181,9 +180,147 @@ def isTrue(s):
     raise ValueError
 
 
+class ChildProcess:
+    """An external command started by a ProcessPool."""
+    def __init__(self, popen, onOutput, onExit):
+        self.popen = popen
+        self.pid = popen.pid
+        self.onOutput = onOutput
+        self.onExit = onExit
+        self.timer = None
+
+    def running(self):
+        return self.popen.returncode is None
+
+    def signal(self, signum):
+        """Send signum to the process and to whatever it started."""
+        if self.running():
+            try:
+                os.killpg(self.pid, signum)
+            except OSError:
+                pass
+
+class ProcessPool:
+    """Run external commands in the background.
+
+    The output of a command is read from a non-blocking pipe whenever the
+    event loop sees it readable and handed over as it comes, so a child
+    never blocks on a full pipe.  Children are reaped as soon as they exit:
+    SIGCHLD wakes up the event loop through signal.set_wakeup_fd.
+    """
+    def __init__(self, loop):
+        self._loop = loop
+        # pid -> ChildProcess, of the processes not reaped yet.
+        self._children = {}
+        # pipe file descriptor -> ChildProcess.
+        self._pipes = {}
+        self._wakeup, notify = os.pipe()
+        for fd in (self._wakeup, notify):
+            fcntl.fcntl(fd, fcntl.F_SETFL,
+                        fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        signal.set_wakeup_fd(notify)
+        # the handler does nothing, but python only writes to the wakeup
+        # file descriptor for signals it handles.
+        signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+        signal.siginterrupt(signal.SIGCHLD, False)
+        loop.addReader(self._wakeup, self._reap)
+
+    def spawn(self, command, onOutput=None, onExit=None, timeout=None):
+        """Run command with the shell.
+
+        onOutput(child, data) is called with every piece of output, if
+        onOutput is None the output is thrown away.  onExit(child) is
+        called once the process exited and its output was read.  After
+        timeout seconds the process is terminated.
+
+        Return the ChildProcess.
+        """
+        devnull = file(os.devnull, 'r+')
+        stdout = devnull
+        if onOutput is not None:
+            stdout = subprocess.PIPE
+        try:
+            # in a process group of its own, so that a timeout stops the
+            # whole pipeline and not just the shell.
+            popen = subprocess.Popen(command, shell=True, stdin=devnull,
+                                     stdout=stdout, close_fds=True,
+                                     preexec_fn=os.setpgrp)
+        finally:
+            devnull.close()
+        child = ChildProcess(popen, onOutput, onExit)
+        self._children[child.pid] = child
+        if onOutput is not None:
+            fd = popen.stdout.fileno()
+            fcntl.fcntl(fd, fcntl.F_SETFL,
+                        fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+            self._pipes[fd] = child
+            self._loop.addReader(fd, self._read)
+        if timeout is not None:
+            child.timer = self._loop.addTimer(
+                timeout, lambda: self._timedOut(child))
+        return child
+
+    def _timedOut(self, child):
+        # ask first, insist a second later.
+        child.signal(signal.SIGTERM)
+        child.timer = self._loop.addTimer(
+            1, lambda: child.signal(signal.SIGKILL))
+
+    def _read(self, fd):
+        child = self._pipes[fd]
+        while 1:
+            try:
+                data = os.read(fd, 65536)
+            except OSError, e:
+                if e.errno == errno.EAGAIN:
+                    return
+                data = ''
+            if not data:
+                # end of file.
+                self._closePipe(fd)
+                return
+            child.onOutput(child, data)
+
+    def _closePipe(self, fd):
+        child = self._pipes.pop(fd)
+        self._loop.removeReader(fd)
+        child.popen.stdout.close()
+
+    def _reap(self, fd):
+        try:
+            while os.read(fd, 512):
+                pass
+        except OSError:
+            pass
+        for child in self._children.values():
+            if child.popen.poll() is None:
+                continue
+            del self._children[child.pid]
+            if child.timer is not None:
+                child.timer.cancel()
+            # what the child wrote just before exiting.
+            if not child.popen.stdout is None and \
+                    not child.popen.stdout.closed:
+                fd = child.popen.stdout.fileno()
+                self._read(fd)
+                # something it started in the background still holds the
+                # pipe: whatever comes later must not be taken for the
+                # output of the next run.
+                if fd in self._pipes:
+                    self._closePipe(fd)
+            if child.onExit is not None:
+                child.onExit(child)
+
 class Entry:
     def __init__(self, line, updateDelay, action, mouseActions,
-                 userMethods, display=None, scrollText=1):
+                 userMethods, loop, pool, display=None, scrollText=1,
+                 timeout=None, maxProcs=defaultMaxProcs):
+        """The entry wakes up every updateDelay seconds to do its action
+        again, every pollDelay seconds to ask the function of a method
+        action for its text, and every scrollDelay seconds while its line
+        scrolls, and otherwise only when its action process has something
+        to say.
+        """
         self._updateDelay = updateDelay
         self._line = line
         self._action = self._parseAction(action)
@@ -191,20 +328,29 @@ class Entry:
         self._userMethods = userMethods
         self._display = display
         self._scrollText = scrollText
+        self._loop = loop
+        self._pool = pool
+        self._timeout = timeout
+        self._maxProcs = maxProcs
 
         self._glue = ' ... '
         self._scrollPos = 0
-        self._tickCount = 0L
+        self._scrollTimer = None
+        self._pollTimer = None
 
+        # the processes started by the mouse actions.
         self._runningProcs = []
         self._actionProc = None
+        self._actionOutput = []
         self._getTextMethod = None
         self._allText = ''
         self._displayLine = ''
         # Do one action when we start, so we are sure that one gets done even
         # if we do not want any other updates.
         self._doAction()
-        self._lastActionAt = time.time()
+        self._setText('')
+        if not updateDelay is None:
+            loop.addTimer(updateDelay, self._doAction, updateDelay)
 
     def _parseAction(self, action):
         """Parse an action string, return (<action>, <argument string>).
@@ -217,12 +363,32 @@ class Entry:
         return None
 
     def _execExternal(self, command):
-        """Exec an external command in the background.
-        
-        Return the running process as created by Popen3()."""
-        proc = popen2.Popen3(command)
-        self._runningProcs.append(proc)
-        return proc
+        """Exec an external command in the background, ignoring its output.
+
+        Do nothing if maxProcs of them are still running.
+        """
+        if len(self._runningProcs) >= self._maxProcs:
+            err("Warning: %d processes still running, not starting %s.\n"
+                % (len(self._runningProcs), command))
+            return
+        self._runningProcs.append(
+            self._pool.spawn(command, onExit=self._runningProcs.remove))
+
+    def _actionRead(self, child, data):
+        """Show the first line of the output of the action process as it
+        comes.  The whole text is stored when the process exits.
+        """
+        if not self._actionOutput or '\n' not in self._actionOutput[0]:
+            # still reading the first line.
+            data = ''.join(self._actionOutput) + data
+            self._actionOutput = [data]
+            self._setText(data)
+        else:
+            self._actionOutput.append(data)
+
+    def _actionExited(self, child):
+        self._actionProc = None
+        self._setText(''.join(self._actionOutput))
 
     def _doMouseAction(self, button):
         """Perform the mouse action associated with a button."""
@@ -257,55 +423,46 @@ class Entry:
             return
         action, arg = self._action
         if action == 'exec':
-            if self._actionProc is None :
-                self._actionProc = self._execExternal(arg)
-            else:
-                if not self._actionProc in self._runningProcs:
-                    # The action process since the last time is finished, we
-                    # can start another one without risking that we get
-                    # flooded by processes.
-                    self._actionProc = self._execExternal(arg)
-            self._getTextMethod = self._readFromActionProc
+            if self._actionProc is None:
+                # Only one action process at a time, so that we do not get
+                # flooded by processes.
+                self._actionOutput = []
+                self._actionProc = self._pool.spawn(
+                    arg, self._actionRead, self._actionExited, self._timeout)
         elif action == 'method':
             try:
                 method = getattr(self._userMethods, arg)
             except AttributeError:
                 method = None
             if method:
+                # the function is polled, see _pollText; at start it gives
+                # the first text right away.
                 self._getTextMethod = method()
+                if self._pollTimer is None:
+                    self._setText(self._getTextMethod())
+                    self._pollTimer = self._loop.addTimer(
+                        pollDelay, self._pollText, pollDelay)
             else:
                 err('Warning: method %s does not exist. Ignoring.\n' % arg)
         else:
             err("Warning: Unknown action: %s, ignoring.\n" % action)
-            
-    def _readFromActionProc(self):
-        """If our action process is ready, return the output. Otherwise None.
-        """
-        if self._actionProc.poll() == -1:
-            # Wait until the process is ready before we really read the text.
-            return None
-        # fromchild.read() will return '' if we allready have read the output
-        # so there will be no harm in calling this method more times.
-        return self._actionProc.fromchild.read()
-
-    def _reapZombies(self):
-        """Poll all running childs. This will reap all zombies."""
-        i = 0
-        for p in self._runningProcs:
-            val = p.poll()
-            if val != -1:
-                self._runningProcs.pop(i)
-            i += 1
-
-    def _updateText(self):
-        """Get the text, update the display if it has changed.
+
+    def _pollText(self):
+        """Ask the function returned by the method for fresh text.
+
+        The text of an exec action arrives by itself, see _actionRead.
         """
-        text = ''
         if self._getTextMethod:
-            text = self._getTextMethod()
-            # Only change the text if we get anything from the getTextMethod()
-            if text:
-                self._allText = text
+            self._setText(self._getTextMethod())
+
+    def _setText(self, text):
+        """Store text, display its first line if it has changed.
+
+        Return whether the display changed.
+        """
+        # Only change the text if we get anything.
+        if text:
+            self._allText = text
         if self._display is None:
             # We have no display = in the config file, we want to
             # display the first line of the output of the action.
@@ -320,12 +477,21 @@ class Entry:
             self._displayLine = displayLine
             self._scrollPos = 0
             self.displayText(displayLine)
-        elif len(self._displayLine) > maxChars and self._scrollText:
-            # Line is the same and is longer than the display and we
-            # want to scroll it.
-            if self._tickCount % 2 == 0:
-                # Only scroll every third tick.
-                self._scrollAndDisplay()
+            self._scheduleScroll()
+            return True
+        return False
+
+    def _scheduleScroll(self):
+        """Scroll the line if it's longer than the display and we want to
+        scroll it.
+        """
+        scroll = len(self._displayLine) > maxChars and self._scrollText
+        if scroll and self._scrollTimer is None:
+            self._scrollTimer = self._loop.addTimer(
+                scrollDelay, self._scrollAndDisplay, scrollDelay)
+        elif not scroll and self._scrollTimer is not None:
+            self._scrollTimer.cancel()
+            self._scrollTimer = None
 
     def _scrollAndDisplay(self):
         """Scroll the text one step to the left and redisplay it.
@@ -344,25 +510,6 @@ class Entry:
         disp = disp[self._scrollPos:]
         self.displayText(disp)
 
-    def tick1(self):
-        """Do things that should be done often.
-        """
-        self._tickCount += 1
-        self._reapZombies()
-        self._updateText()
-        currTime = time.time()
-        if not self._updateDelay is None and \
-                currTime - self._lastActionAt > self._updateDelay:
-            # We want to do this last in the tick so the command gets the time
-            # to finish before the next tick (if it's a fast one).
-            self._lastActionAt = currTime
-            self._doAction()
-
-    def tick2(self):
-        """Do things that should be done a bit less often.
-        """
-        pass
-
     def translateText(self, text):
         """Translate chars that can't be painted in the app to something nicer.
         
@@ -420,6 +567,8 @@ class Entry:
 class PywmGeneric:
     def __init__(self, config):
         self._entrys = []
+        self._loop = eventloop.EventLoop()
+        self._pool = ProcessPool(self._loop)
         line = 0
         um = UserMethods()
         for c in config:
@@ -439,6 +588,20 @@ class PywmGeneric:
                     self._entrys.append(None)
                     line += 1
                     continue
+            timeout = c.get('timeout')
+            if not timeout is None:
+                try:
+                    timeout = self.parseTimeStr(timeout)
+                except ValueError:
+                    err("Malformed timeout in section %d, ignoring it.\n"
+                        % line)
+                    timeout = None
+            try:
+                maxProcs = int(c.get('max_procs', defaultMaxProcs))
+            except ValueError:
+                err("Malformed max_procs in section %d, using %d.\n"
+                    % (line, defaultMaxProcs))
+                maxProcs = defaultMaxProcs
             action = c.get('action')
             display = c.get('display')
             if action is None and display is None:
@@ -455,7 +618,8 @@ class PywmGeneric:
                     opt = 'on_mouse' + but
                     mouseActions.append(c.get(opt))
                 self._entrys.append(Entry(line, delay, action,
-                        mouseActions, um, display, scroll))
+                        mouseActions, um, self._loop, self._pool, display,
+                        scroll, timeout, maxProcs))
             line += 1
         self._setupMouseRegions()
 
@@ -483,32 +647,24 @@ class PywmGeneric:
         raise ValueError, 'Invalid literal'
 
     def _checkForEvents(self):
-        event = wmdocklib.getEvent()
-        while not event is None:
-            if event['type'] == 'destroynotify':
+        for event in wmdocklib.getEvents():
+            if event.type == 'destroynotify':
                 sys.exit(0)
-            elif event['type'] == 'buttonrelease':
-                region = wmdocklib.checkMouseRegion(event['x'], event['y'])
-                button = event['button']
+            elif event.type == 'buttonrelease':
+                region = wmdocklib.checkMouseRegion(event.x, event.y)
+                button = event.button
                 if region != -1:
                     if not self._entrys[region] is None:
                         self._entrys[region].mouseClicked(button)
-            event = wmdocklib.getEvent()
 
     def mainLoop(self):
-        counter = -1
-        while 1:
-            counter += 1
-            self._checkForEvents()
-            if counter % 2 == 0:
-                [e.tick1() for e in self._entrys if not e is None]
-            if counter % 20 == 0:
-                [e.tick2() for e in self._entrys if not e is None]
-
-            if counter == 999999:
-                counter = -1
-            wmdocklib.redraw()
-            time.sleep(0.5)
+        """Sleep until the next entry is due, or an X event arrives.
+
+        The entries have their own timers, see Entry.
+        """
+        self._loop.addXHandler(self._checkForEvents)
+        self._loop.addIdleCallback(wmdocklib.redraw)
+        self._loop.run()
 
 def parseCommandLine(argv):
     """Parse the commandline. Return a dictionary with options and values."""
@@ -671,7 +827,7 @@ def main():
                                                    bg='_', fg='%',
                                                    palette=palette)
 
-    wmdocklib.openXwindow(sys.argv, width, height)
+    wmdocklib.openXwindow(sys.argv, width, height, events=['buttonrelease'])
     pywmgeneric = PywmGeneric(config)
     pywmgeneric.mainLoop()
 
@@ -47,7 +47,8 @@ Available options are:
 -F, --font <file>               set the font name
 -r, --rgbfile <file>            set the rgb file to get color codes from
 -c, --configfile <file>         set the config file to use
--p, --procstat <file>           set the location of /proc/stat
+-p, --procstat <file>           set the location of /proc/diskstats
+-i, --interval <seconds>        how often to check the free space
 -s, --skipconf <num>            determines how many configuration items to skip
 """
 
@@ -55,8 +56,11 @@ import sys
 import time
 import getopt
 import os
+import threading
+import Queue
 
 import wmdocklib
+from wmdocklib import eventloop, procfs
 
 width = 64
 height = 64
@@ -75,25 +79,110 @@ graphLineStartX = 2
 graphLineStartY = 58+64
 
 defaultConfigFile = os.environ['HOME']+'/.pywmhdmonrc'
-defaultProcStat = '/proc/stat'
+defaultProcStat = '/proc/diskstats'
 displayModes = ('bar', 'percent', 'free', 'used')
 defaultMode = 'bar'
+# seconds between two checks of the free space.
+defaultInterval = 10
+# seconds after which a filesystem not answering is shown as empty.
+defaultTimeout = 5
 
 hdmon = None
 
-class NotMounted(OSError):
-    pass
+class StatvfsPoller:
+    """Run os.statvfs in background threads.
+
+    statvfs on a network filesystem whose server does not answer blocks
+    until it does, possibly forever.  Every statvfs runs in a thread of its
+    own, and a path is not asked again before its previous statvfs
+    returned, so that a hung filesystem only stalls its own line and never
+    the main loop, which only sees the results.
+    """
+    def __init__(self, loop, callback):
+        """callback(path, result) is called in the main thread, result is
+        the result of os.statvfs or the OSError it raised.
+        """
+        self._callback = callback
+        self._started = {}
+        self._results = Queue.Queue()
+        # the threads write a byte on the pipe to wake up the loop.
+        self._wakeup, self._notify = os.pipe()
+        loop.addReader(self._wakeup, self._collect)
+
+    def request(self, path):
+        """statvfs path, unless the previous statvfs of path is still
+        running.
+        """
+        if path in self._started:
+            return
+        self._started[path] = time.time()
+        thread = threading.Thread(target=self._work, args=(path,))
+        # a hung filesystem must not keep us from exiting.
+        thread.setDaemon(True)
+        thread.start()
+
+    def waiting(self, path):
+        """Return for how many seconds the statvfs of path has been
+        running, 0 if it is not running.
+        """
+        started = self._started.get(path)
+        if started is None:
+            return 0
+        return time.time() - started
+
+    def _work(self, path):
+        try:
+            result = os.statvfs(path)
+        except OSError, e:
+            result = e
+        self._results.put((path, result))
+        os.write(self._notify, 'x')
+
+    def _collect(self, fd):
+        os.read(fd, 512)
+        while 1:
+            try:
+                path, result = self._results.get_nowait()
+            except Queue.Empty:
+                break
+            del self._started[path]
+            self._callback(path, result)
 
 class PywmHDMon:
-    def __init__(self, pathsToMonitor, procStat='/proc/stat', actMonEnabled=1, skipping=0):
+    def __init__(self, pathsToMonitor, procStat='/proc/diskstats', actMonEnabled=1, skipping=0,
+                 interval=defaultInterval, timeout=defaultTimeout):
         self._pathsToMonitor = pathsToMonitor
         self._actMonEnabled = actMonEnabled
         self._skipping = skipping
+        self._interval = interval
+        self._timeout = timeout
         self._lineCount = (height - yOffset*2 - 2) / (char_height+1)
 
-        self._statFile = procStat
-        self._maxIODiff = 0
-        self._lastIO = -1
+        self._loop = eventloop.EventLoop()
+        self._statvfs = StatvfsPoller(self._loop, self._statvfsDone)
+        # paths whose filesystem did not answer in time.
+        self._hung = set()
+        # the mount table is only read again when the kernel says it
+        # changed, see _mountsChanged.  without it, fall back to stat'ing
+        # the paths.
+        try:
+            self._mountinfo = procfs.MountinfoFile()
+            self._mounts = self._mountinfo.mounts()
+        except OSError:
+            self._mountinfo = None
+            self._mounts = None
+
+        # line on screen -> block device of its path, see
+        # updateMonitoredPaths.
+        self._devices = {}
+        self._diskSampler = None
+        if actMonEnabled:
+            try:
+                self._diskSampler = procfs.DiskSampler(procStat)
+            except OSError, e:
+                sys.stderr.write("Can't open %s: %s, disabling the HD "
+                                 "activity bar.\n" % (procStat, str(e)))
+                self._actMonEnabled = 0
         for i in range(max(self._lineCount, len(pathsToMonitor)-skipping)):
             wmdocklib.addMouseRegion(i+1, 8, self.getY(i+1)+yOffset,
                                      58, self.getY(i+1)+char_height+yOffset)
@@ -106,32 +195,36 @@ class PywmHDMon:
             sys.stderr.write('Error when painting string:\n' + str(e) + '\n')
             sys.exit(3)
 
-    def getHdInfo(self, path):
-        """Get the free and total space of the filesystem which path is on.
+    def isMounted(self, path):
+        """Return whether a filesystem is mounted on path.
 
-        Return a tuple with (<total space>, <free space>) in bytes. Raise
-        OSError if we can't stat the path.  Raise NotMounted if not mounted.
-        These operations are quite costly, not adviced to perform these checks
-        more than once every 10 seconds.
+        Look it up in the mount table if we have one, else compare the
+        device of path with that of its parent.  Raise OSError if we can't
+        stat the path.
+        """
+        if self._mounts is not None:
+            return os.path.normpath(path) in self._mounts
+        if path == '/':
+            return True
+        # check if is mounted <- st_dev(/mount/point) != st_dev(/mount)
+        statOwn = os.stat(path)
+        # the following is a bit ugly: it removes the trailing
+        # dirname from the mount point.  split by '/', leave the
+        # last string, join back, check for empty string.
+        statCnt = os.stat('/'.join(path.split('/')[:-1]) or '/')
+        return statOwn[2] != statCnt[2]
+
+    def getDevice(self, path):
+        """Return the block device of the filesystem mounted on path, None
+        if it is not on a block device.
         """
-        
-        # check if is mounted <- st_dev(/mount/point) == st_dev(/mount)
-        if path is not '/':
-            statOwn = os.stat(path)
-
-            # the following is a bit ugly: it removes the trailing
-            # dirname from the mount point.  split by '/', leave the
-            # last string, join back, check for empty string.
-            statCnt = os.stat('/'.join(path.split('/')[:-1]) or '/')
-            if statOwn[2] == statCnt[2]:
-                raise NotMounted
-        stat = os.statvfs(path)
-        blockSize = stat.f_bsize
-        availableBlocks = stat.f_bavail
-        totalBlocks = stat.f_blocks
-        free = blockSize * availableBlocks
-        total = blockSize * totalBlocks
-        return (total, free)
+        if self._mounts is not None:
+            mount = self._mounts[os.path.normpath(path)]
+            return procfs.deviceName(mount.device, mount.source)
+        try:
+            return procfs.blockDevice(path)
+        except OSError:
+            return None
 
     def paintGraph(self, percentFilled, x, y, w, thin=None):
         """Paint a graph with percentFilled percent filled.
@@ -188,75 +281,46 @@ class PywmHDMon:
             sys.stderr.write('Unknown display mode: %s, ignoring data.\n'
                               % mode)
     def getHdActivity(self):
-        """Return the current hd activity in percent.
-        
-        Return how many percent of the max achieved activity during the
-        program's lifetime the current activity is. However, every time
-        this method is called we decrease the max achieved activity a
-        little bit to get a bit less affected by spikes. I think the
-        interesting thing is to see if the hard drive is active, not
-        really exactly how active.
+        """Return the utilisation in percent of the monitored devices.
+
+        Return a dictionary line -> percentage of the time the block device
+        of that line had I/O in progress since the previous call.  Lines
+        without a block device are left out.
         """
-        
-        statFile = file(self._statFile, 'r')
-        diskIoStartTag = 'disk_io: '
-        ioLine = None
-        for line in statFile:
-            if line.startswith(diskIoStartTag):
-                ioLine = line
-        statFile.close()
-        if ioLine is None:
-            # Can't get HD activity
-            sys.stderr.write("Can't get hd activity from %s\n" %
-                self._statFile)
-            return 0.0
-        ioLine = ioLine[len(diskIoStartTag):]
-        disks = ioLine.split()
-        currIO = 0
-        for disk in disks:
-            dataPart = disk.split(':')[1].strip(')(')
-            infos = dataPart.split(',')
-            blocksRead = long(infos[2])
-            blocksWritten = long(infos[4])
-            currIO += blocksRead + blocksWritten
-        if self._lastIO == -1:
-            self._lastIO = currIO
-        currDiff = currIO - self._lastIO
-        self._lastIO = currIO
-        if currDiff > self._maxIODiff:
-            self._maxIODiff = currDiff
-        if self._maxIODiff <= 0:
-            self._maxIODiff = 0
-            return 0.0
-        currAct = (float(currDiff) / float(self._maxIODiff)) * 100.0
-        self._maxIODiff -= 1  # So spikes won't affect us too much.
-        return currAct
+        rates = self._diskSampler.sample(set(self._devices.values()))
+        result = {}
+        for line, device in self._devices.items():
+            if device in rates:
+                result[line] = rates[device].utilisation
+        return result
 
     def updateHdActivity(self):
-        currentAct = self.getHdActivity()
-        self.paintGraph(currentAct, 3, height - yOffset*2 - 3 - graphHeight, 
+        """Paint the activity of every line below its label, and that of
+        the busiest device in the bottom bar.
+        """
+        activity = self.getHdActivity()
+        for line, percent in activity.items():
+            self.paintGraph(percent, 1, self.getY(line) + char_height,
+                            (width*2)/5 - 3, thin=1)
+        self.paintGraph(max(activity.values() or [0.0]), 3,
+                        height - yOffset*2 - 3 - graphHeight,
                         width - 2 * xOffset - 6)
 
     def _checkEvents(self):
-        event = wmdocklib.getEvent()
-        while event is not None:
-            if event['type'] == 'destroynotify':
+        for event in wmdocklib.getEvents():
+            if event.type == 'destroynotify':
                 sys.exit(0)
-            elif event['type'] == 'buttonrelease':
-                area = wmdocklib.checkMouseRegion(event['x'],event['y'])
+            elif event.type == 'buttonrelease':
+                area = wmdocklib.checkMouseRegion(event.x, event.y)
                 if area is not -1:
                     self.toggleMount(area-1+self._skipping)
-            event = wmdocklib.getEvent()
 
     def toggleMount(self, line):
         label, path, mode, action = self._pathsToMonitor[line]
         if action is None:
             return
         try:
-            self.getHdInfo(path)
-            mounted = True
-        except NotMounted:
-            mounted = False
+            mounted = self.isMounted(path)
         except OSError, e:
             return
         if mounted:
@@ -268,49 +332,97 @@ class PywmHDMon:
         else:
             os.spawnvp(os.P_NOWAIT, 'mount', ['mount', path])
 
+    def visibleLines(self):
+        """Return a list of (line on screen, configuration item)."""
+        items = self._pathsToMonitor[self._skipping:
+                                     self._skipping + self._lineCount]
+        return [(i + 1, item) for i, item in enumerate(items)
+                if item is not None]
+
     def updateMonitoredPaths(self):
-        index = 0
-        pageoffset = self._skipping
-        for i in self._pathsToMonitor:
-            index += 1
-            if index < pageoffset+1:
-                continue
-            if i is not None:
-                label, path, mode, action = i
-                self.paintLabel(index-pageoffset, label)
-                try:
-                    hdData = self.getHdInfo(path)
-                except NotMounted:
-                    hdData = (0, 0)
-                except OSError, e:
-                    sys.stderr.write(
+        """Paint the labels, and ask for the free space of the mounted
+        paths.  The data is painted by _statvfsDone when it comes.
+        """
+        for line, (label, path, mode, action) in self.visibleLines():
+            self.paintLabel(line, label)
+            self._devices.pop(line, None)
+            try:
+                mounted = self.isMounted(path)
+            except OSError, e:
+                sys.stderr.write(
                     "Can't get hd data from %s: %s\n" % (path, str(e)))
-                    hdData = (0, 0)
-                self.paintHdData(index-pageoffset, hdData, mode)
-            if index - pageoffset == self._lineCount:
-                break
+                mounted = False
+            if not mounted:
+                self.paintHdData(line, (0, 0), mode)
+                continue
+            device = self.getDevice(path)
+            if device is not None:
+                self._devices[line] = device
+            if self._statvfs.waiting(path) > self._timeout:
+                if path not in self._hung:
+                    sys.stderr.write("%s does not answer\n" % path)
+                    self._hung.add(path)
+                self.paintHdData(line, (0, 0), mode)
+            self._statvfs.request(path)
+
+    def _statvfsDone(self, path, result):
+        self._hung.discard(path)
+        if isinstance(result, OSError):
+            sys.stderr.write(
+                "Can't get hd data from %s: %s\n" % (path, str(result)))
+            hdData = (0, 0)
+        else:
+            hdData = (result.f_bsize * result.f_blocks,
+                      result.f_bsize * result.f_bavail)
+        for line, (label, itemPath, mode, action) in self.visibleLines():
+            if itemPath != path:
+                continue
+            try:
+                if not self.isMounted(path):
+                    # unmounted while we were waiting.
+                    continue
+            except OSError:
+                continue
+            self.paintHdData(line, hdData, mode)
 
-    def mainLoop(self):
+    def _mountsChanged(self, fd):
+        # the kernel reports a change once per poll, in its poll handler,
+        # read or not: the table is read here for the new mounts, not to
+        # acknowledge the notification.
+        self._mounts = self._mountinfo.mounts()
         self.updateMonitoredPaths()
-        while 1:
-            self._checkEvents()
-            if self._actMonEnabled:
-                self.updateHdActivity()
-            wmdocklib.redraw()
-            time.sleep(0.1)
 
+    def _reapChildren(self):
+        # the mount, umount and eject started by toggleMount.
+        try:
+            while os.waitpid(-1, os.WNOHANG)[0]:
+                pass
+        except OSError:
+            pass
+
+    def _refresh(self):
+        self._reapChildren()
+        self.updateMonitoredPaths()
+
+    def mainLoop(self):
+        self._loop.addXHandler(self._checkEvents)
+        if self._mountinfo is not None:
+            self._loop.addPriorityReader(self._mountinfo.fileno(),
+                                         self._mountsChanged)
+        self._loop.addTimer(self._interval, self._refresh, self._interval)
+        if self._actMonEnabled:
+            self._loop.addTimer(0.1, self.updateHdActivity, 0.1)
+        self._loop.addIdleCallback(wmdocklib.redraw)
+        self.updateMonitoredPaths()
+        self._loop.run()
 
-import signal
-def handler(num, frame):
-    hdmon.updateMonitoredPaths()
-    signal.alarm(10)
 
 def parseCommandLine(argv):
     """Parse the commandline. Return a dictionary with options and values."""
-    shorts = 'ht:f:g:b:r:c:p:s:F:'
+    shorts = 'ht:f:g:b:r:c:p:s:F:i:'
     longs = ['help', 'textcolor=', 'background=', 'barfgcolor=',
              'rgbfile=', 'configfile=', 'barbgcolor=', 'procstat=',
-             'skipconf=','font=', 'debug']
+             'skipconf=','font=', 'interval=', 'debug']
     try:
         opts, nonOptArgs = getopt.getopt(argv[1:], shorts, longs)
     except getopt.GetoptError, e:
@@ -340,6 +452,8 @@ def parseCommandLine(argv):
             d['procstat'] = a
         if o in ('-s', '--skipconf'):
             d['skipconf'] = a
+        if o in ('-i', '--interval'):
+            d['interval'] = a
         if o in ('--debug'):
             d['debug'] = True
     return d
@@ -450,9 +564,11 @@ def main():
     procStat = config.get('procstat', defaultProcStat)
     skipping = int(config.get('skipconf', 0))
     actMonEnabled = int(config.get('monitoring',0))
-    if not os.access(procStat, os.R_OK):
+    interval = float(config.get('interval', defaultInterval))
+    timeout = float(config.get('timeout', defaultTimeout))
+    if actMonEnabled and not os.access(procStat, os.R_OK):
         sys.stderr.write(
-            "Can't read your procstat file, try setting it with -p. ")
+            "Can't read your diskstats file, try setting it with -p. ")
         sys.stderr.write("Disabling the HD activity bar.\n")
         actMonEnabled = 0
     try:
@@ -460,14 +576,11 @@ def main():
     except IndexError:
         programName = ''
     sys.argv[0] = programName
-    wmdocklib.openXwindow(sys.argv, width, height)
-
-    signal.signal(signal.SIGCHLD, handler)
-    signal.signal(signal.SIGALRM, handler)
-    signal.alarm(10)
+    wmdocklib.openXwindow(sys.argv, width, height, events=['buttonrelease'])
 
     global hdmon
-    hdmon = PywmHDMon(pathsToMonitor, procStat, actMonEnabled, skipping)
+    hdmon = PywmHDMon(pathsToMonitor, procStat, actMonEnabled, skipping,
+                      interval, timeout)
     hdmon.mainLoop()
 
 patterns = \
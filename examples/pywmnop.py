@@ -9,25 +9,24 @@ Copyright (C) 2006 Mario Frasca
 Licensed under the GNU General Public License.
 """
 
-import sys, time
+import sys
 import wmdocklib
 
 def checkForEvents():
-    event = wmdocklib.getEvent()
-    while not event is None:
-        if event['type'] == 'destroynotify':
+    for event in wmdocklib.getEvents():
+        if event.type == 'destroynotify':
             sys.exit(0)
-        event = wmdocklib.getEvent()
 
 def mainLoop():
     while 1:
         checkForEvents()
         wmdocklib.redraw()
-        time.sleep(0.5)
+        # nothing changes but on events: sleep until one arrives.
+        wmdocklib.waitForEvent()
 
 def main():
     wmdocklib.initPixmap()
-    wmdocklib.openXwindow(sys.argv, 64, 64)
+    wmdocklib.openXwindow(sys.argv, 64, 64, events=[])
 
     mainLoop()
 
@@ -11,6 +11,8 @@ Licensed under the GNU General Public License.
 
 from wmdocklib import wmoo
 thisapp = wmoo.Application()
+# nothing ever changes, only redraw on expose.
+thisapp.setRefreshInterval(None)
 
 if __name__ == '__main__':
     thisapp.run()
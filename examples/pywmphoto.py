@@ -35,6 +35,8 @@ def main():
     app = wmoo.Application(background = options.filename,
                            margin = 3,
                            debug = options.debug)
+    # a static picture needs no periodic refresh.
+    app.setRefreshInterval(None)
 
     app.run()
 
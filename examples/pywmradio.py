@@ -142,15 +142,16 @@ class Application(wmoo.Application):
             self._muting = 1 - self._muting
 
     def showCacheLevel(self):
+        areas = []
         if self._buffering:
             self._cacheLevel += 1
             if self._cacheLevel >= 25:
                 self._cacheLevel -= 25
             for i in range(-1, 25):
                 if abs(i - self._cacheLevel) <= 1:
-                    self.putPattern(54, self._buffering, 5, 1, 54, 58-i)
+                    areas.append((54, self._buffering, 5, 1, 54, 58-i))
                 else:
-                    self.putPattern(54, 0, 5, 1, 54, 58-i)
+                    areas.append((54, 0, 5, 1, 54, 58-i))
         else:
             if self._flash:
                 colour = self._colour = 3 - self._colour
@@ -159,9 +160,10 @@ class Application(wmoo.Application):
                 colour = 2
             for i in range(-1, 25):
                 if (i*4 < self._cacheLevel) or self._flash:
-                    self.putPattern(54, colour, 5, 1, 54, 58-i)
+                    areas.append((54, colour, 5, 1, 54, 58-i))
                 else:
-                    self.putPattern(54, 0, 5, 1, 54, 58-i)
+                    areas.append((54, 0, 5, 1, 54, 58-i))
+        self.putPatterns(areas)
 
     def update(self):
         self._count += 1
@@ -273,15 +273,12 @@ class PywmSeti:
 
     def _checkForEvents(self):
         """Check for, and handle, X events."""
-        event = wmdocklib.getEvent()
-        while not event is None:
-            if event['type'] == 'buttonrelease':
-                region = wmdocklib.checkMouseRegion(event['x'],
-                                                      event['y'])
+        for event in wmdocklib.getEvents():
+            if event.type == 'buttonrelease':
+                region = wmdocklib.checkMouseRegion(event.x, event.y)
                 self.handleMouseClick(region)
-            elif event['type'] == 'destroynotify':
+            elif event.type == 'destroynotify':
                 sys.exit(0)
-            event = wmdocklib.getEvent()
 
     def mainLoop(self):
         counter = -1
@@ -491,7 +488,7 @@ def main():
     sys.argv[0] = programName
     wmdocklib.initPixmap(background,
                          palette=palette)
-    wmdocklib.openXwindow(sys.argv, width, height)
+    wmdocklib.openXwindow(sys.argv, width, height, events=['buttonrelease'])
     wmdocklib.addMouseRegion(0, xOffset, yOffset, width - 2 * xOffset,
                                height - 2 * yOffset)
     pwms = PywmSeti(statePath, uinfoPath, pidPath, execCmd)
@@ -29,14 +29,17 @@ Available options are:
 -m, --procmeminfo <file>        set the location of /proc/meminfo
 -i, --ignorenice                ignore nice valued cpu usage
 -u, --updatedelay <value>       delay (in seconds) between cpu graph updates
+-c, --cpumode <mode>            cpu graph: total (default), states, cores
 """
 
 import sys
 import time
 import getopt
 import os
+import array
 
 import wmdocklib
+from wmdocklib import procfs
 
 width = 64
 height = 64
@@ -49,22 +52,40 @@ hGraphStartY = 53
 hGraphHeight = 4
 hGraphWidth = width - xOffset * 2 - 6
 
-hGraphBgStartX = 72
-hGraphBgStartY = 53
+# the sources are in the patterns, below the 64 rows of the window.
+hGraphBgStartX = 8
+hGraphBgStartY = 64 + 53
 
-hGraphLineStartX = 66
-hGraphLineStartY = 58
+hGraphLineStartX = 2
+hGraphLineStartY = 64 + 58
 
 vGraphStartX = 7
 vGraphStartY = 7
 vGraphHeight = 43
 vGraphWidth = 50
 
-vGraphLineStartX = 95
-vGraphLineStartY = 1
+vGraphLineStartX = 31
+vGraphLineStartY = 64 + 1
 
-vGraphBgStartX = 97
-vGraphBgStartY = 1
+vGraphBgStartX = 33
+vGraphBgStartY = 64 + 1
+
+# how the cpu graph is split in the 'states' mode: the states, their
+# /proc/stat fields and the x of their color in the patterns, user time
+# being the usual graph color.  idle time is left as background.
+cpuStates = [('user', ('user',), vGraphLineStartX),
+             ('nice', ('nice',), 35),
+             ('system', ('system',), 37),
+             ('iowait', ('iowait',), 39),
+             ('irq', ('irq', 'softirq'), 41),
+             ('steal', ('steal',), 43),
+             ]
+
+# in the 'cores' mode, the colors of the load levels from idle to busy.
+heatStartX = 45
+heatLevels = 8
+
+cpuModes = ('total', 'states', 'cores')
 
 defaultConfigFile = '~/.pywmhdmonrc'
 defaultRGBFiles = ('/usr/lib/X11/rgb.txt', '/usr/X11R6/lib/X11/rgb.txt')
@@ -72,22 +93,43 @@ defaultProcStat = '/proc/stat'
 defaultProcMeminfo = '/proc/meminfo'
 
 class PywmSysMon:
-    def __init__(self, procMeminfo, procStat, ignoreNice=0, updateDelay=10):
+    def __init__(self, procMeminfo, procStat, ignoreNice=0, updateDelay=10,
+                 cpuMode='total'):
         self._procStat = procStat
         self._procMeminfo = procMeminfo
         self._ignoreNice = ignoreNice
+        try:
+            self._statFile = procfs.StatFile(procStat)
+            self._meminfoFile = procfs.MeminfoFile(procMeminfo)
+        except OSError, e:
+            sys.stderr.write("Can't open proc file: %s.\n" % str(e))
+            sys.exit(2)
 
         self._lastUsed = 0
         self._lastTotal = 0
 
-        self._usageHistory = [0.0] * vGraphWidth
+        # the histories are ring buffers, _histPos is the index of the
+        # oldest sample, where the next one goes.
+        # 'total': the percentages in _usageHistory.
+        # 'states': one history of percentages per entry in cpuStates.
+        # 'cores': one history of heat levels per row of the graph, created
+        # at the first sample, when the number of cpus is known.
+        self._usageHistory = array.array('f', [0.0] * vGraphWidth)
+        self._histPos = 0
+        # once the graph is complete on screen, it is scrolled and only its
+        # newest column is drawn.
+        self._graphDrawn = False
+        self._cpuMode = cpuMode
+        self._lastCpus = None
+        self._stateHistory = [array.array('f', [0.0] * vGraphWidth)
+                              for state in cpuStates]
+        self._coreHistory = None
 
         self._cpuUpdateDelay = updateDelay
         self._memUpdateDelay = 30
 
     def addUsageToHist(self, cpuUsage):
-        self._usageHistory = self._usageHistory[1:]
-        self._usageHistory.append(cpuUsage)
+        self._usageHistory[self._histPos] = cpuUsage
 
     def getMemInfo(self):
         """Get memory information.
@@ -95,33 +137,13 @@ class PywmSysMon:
         Return a tuple with (total_mem, used_mem, buffered_mem, cached_mem).
         """
         try:
-            meminfoFile = file(self._procMeminfo, 'r')
-        except IOError, e:
-            sys.stderr.write("Can't open meminfo file: %s.\n" % str(e))
-            sys.exit(2)
-        total = used = free = shared = buffers = cached = theLine = None
-        for line in meminfoFile:
-            if line.startswith('Mem:'):
-                theLine = line
-                break
-            if line.startswith('MemTotal:'):
-                total = long(line.split()[1])
-            if line.startswith('MemFree:'):
-                free = long(line.split()[1])
-            if line.startswith('Buffers:'):
-                buffers = long(line.split()[1])
-            if line.startswith('Cached:'):
-                cached = long(line.split()[1])
-        if free and total:
-            used = total - free
-        if theLine is not None:
-            parts = [long(x) for x in theLine.split()[1]]
-            total, used, free, shared, buffers, cached = parts[:6]
-        if None in [total, used, buffers, cached]:
+            memInfo = self._meminfoFile.memory()
+        except ValueError:
             sys.stderr.write("Can't find memory information in %s.\n" % 
                 self._procMeminfo)
             sys.exit(4)
-        return (total, used, buffers, cached)
+        used = memInfo.total - memInfo.free
+        return (memInfo.total, used, memInfo.buffers, memInfo.cached)
 
     def freeMem(self, memData):
         """Take a tuple as returned from getMemInfo and return the free mem.
@@ -137,14 +159,7 @@ class PywmSysMon:
         Only works for systems where this can be found in a /proc/stat like
         file. Return the usage in percent.
         """
-        try:
-            statFile = file(self._procStat, 'r')
-        except IOError, e:
-            sys.stderr.write("Can't open statfile: %s.\n" % str(e))
-            sys.exit(2)
-        line = statFile.readline()
-        statFile.close()
-        cpu, nice, system, idle = [long(x) for x in line.split()[1:]][:4]
+        cpu, nice, system, idle = self._statFile.cpu()[:4]
         used = cpu + system
         if not self._ignoreNice:
             used += nice
@@ -158,6 +173,48 @@ class PywmSysMon:
         self._lastTotal = total
         return cpuUsage
 
+    def getCPUStates(self):
+        """Get the share of time spent in each of cpuStates.
+
+        Return a list of percentages, in the order of cpuStates.
+        """
+        current = self._statFile.cpu()
+        last, self._lastCpus = self._lastCpus, [current]
+        if last is None:
+            return [0.0] * len(cpuStates)
+        total = float(current.total() - last[0].total())
+        if total <= 0:
+            return [0.0] * len(cpuStates)
+        result = []
+        for name, fields, sourceX in cpuStates:
+            ticks = 0
+            for field in fields:
+                ticks += getattr(current, field) - getattr(last[0], field)
+            result.append(100.0 * ticks / total)
+        return result
+
+    def getCoreUsages(self):
+        """Get the usage of every cpu, from one read of the stat file.
+
+        Return a list of percentages, one per cpu.  Time waiting for I/O
+        does not count as usage.
+        """
+        current = self._statFile.sample()[1]
+        last, self._lastCpus = self._lastCpus, current
+        if last is None or len(last) != len(current):
+            return [0.0] * len(current)
+        result = []
+        for now, before in zip(current, last):
+            total = now.total() - before.total()
+            idle = now.idle + now.iowait - before.idle - before.iowait
+            if self._ignoreNice:
+                idle += now.nice - before.nice
+            if total <= 0:
+                result.append(0.0)
+            else:
+                result.append(100.0 * (total - idle) / total)
+        return result
+
     def addString(self, s, x, y):
         try:
             wmdocklib.addString(s, x, y, digits, xOffset, yOffset, width, height)
@@ -186,25 +243,103 @@ class PywmSysMon:
         if length > 0:
             wmdocklib.copyXPMArea(sourceX, sourceY, 1, length, targX, targY)
 
+    def totalColumn(self, areas, x, index):
+        """Add to areas what draws the sample at index in the total graph
+        as column x."""
+        usage = min(max(self._usageHistory[index], 0.0), 100.0)
+        lengthFilled = int(round(vGraphHeight * (usage / 100.0)))
+        lengthNotFilled = vGraphHeight - lengthFilled
+        areas.extend((vGraphBgStartX, vGraphBgStartY, 1, lengthNotFilled,
+                      x, vGraphStartY))
+        areas.extend((vGraphLineStartX, vGraphLineStartY, 1, lengthFilled,
+                      x, vGraphStartY + lengthNotFilled))
+
+    def statesColumn(self, areas, x, index):
+        """Same as totalColumn, for the stacked graph of the cpu states.
+
+        The states are piled from the bottom in the order of cpuStates,
+        their heights rounded on the running total so they add up.
+        """
+        bottom = vGraphStartY + vGraphHeight
+        share = 0.0
+        for history, (name, fields, sourceX) in zip(self._stateHistory,
+                                                    cpuStates):
+            share += history[index]
+            top = vGraphStartY + vGraphHeight - \
+                  int(round(vGraphHeight * min(share, 100.0) / 100.0))
+            if top < bottom:
+                areas.extend((sourceX, vGraphLineStartY, 1, bottom - top,
+                              x, top))
+                bottom = top
+        if bottom > vGraphStartY:
+            areas.extend((vGraphBgStartX, vGraphBgStartY,
+                          1, bottom - vGraphStartY, x, vGraphStartY))
+
+    def coresColumn(self, areas, x, index):
+        """Same as totalColumn, for the heatmap of the cpus.
+
+        Every row band is a cpu, or a group of cpus showing its busiest one
+        when there are more cpus than pixels.  Neighbouring bands at the
+        same level are painted as one area.
+        """
+        history = self._coreHistory
+        rows = len(history)
+        start = 0
+        for row in range(1, rows + 1):
+            level = history[start][index]
+            if row < rows and history[row][index] == level:
+                continue
+            top = vGraphStartY + vGraphHeight * start / rows
+            areas.extend((heatStartX + 2 * level, vGraphLineStartY, 1,
+                          vGraphStartY + vGraphHeight * row / rows - top,
+                          x, top))
+            start = row
+
     def drawCPUUsageHistory(self):
-        """Draw the complete CPU usage graph according to what's in the history.
+        """Draw the CPU usage graph according to what's in the history.
+
+        The first time the whole graph is drawn.  Afterwards the graph on
+        screen is moved one pixel to the left and only the newest sample
+        is drawn.  Everything is painted in one call to copyXPMAreas.
         """
-        count = 0
-        for histItem in self._usageHistory:
-            lengthFilled = int(round(vGraphHeight * (histItem/100.0)))
-            lengthNotFilled = vGraphHeight - lengthFilled
-            self.drawVertLine(vGraphBgStartX, vGraphBgStartY,
-                              vGraphStartX + count, vGraphStartY,
-                              lengthNotFilled)
-            self.drawVertLine(vGraphLineStartX, vGraphLineStartY,
-                              vGraphStartX + count,
-                              vGraphStartY + lengthNotFilled, lengthFilled)
-            count += 1
+        column = {'states': self.statesColumn,
+                  'cores': self.coresColumn,
+                  }.get(self._cpuMode, self.totalColumn)
+        areas = array.array('i')
+        if self._graphDrawn:
+            areas.extend((vGraphStartX + 1, vGraphStartY,
+                          vGraphWidth - 1, vGraphHeight,
+                          vGraphStartX, vGraphStartY))
+            counts = [vGraphWidth - 1]
+        else:
+            counts = range(vGraphWidth)
+            self._graphDrawn = True
+        for count in counts:
+            column(areas, vGraphStartX + count,
+                   (self._histPos + count) % vGraphWidth)
+        wmdocklib.copyXPMAreas(areas)
 
     def updateCPUInfo(self):
         """Update the current cpu usage graph."""
-        currentUsage = self.getCPUUsage()
-        self.addUsageToHist(currentUsage)
+        if self._cpuMode == 'states':
+            for history, share in zip(self._stateHistory,
+                                      self.getCPUStates()):
+                history[self._histPos] = share
+        elif self._cpuMode == 'cores':
+            usages = self.getCoreUsages()
+            rows = min(len(usages), vGraphHeight)
+            if self._coreHistory is None or len(self._coreHistory) != rows:
+                self._coreHistory = [array.array('B', [0] * vGraphWidth)
+                                     for i in range(rows)]
+                self._graphDrawn = False
+            for i, history in enumerate(self._coreHistory):
+                group = usages[len(usages) * i / rows:
+                               len(usages) * (i + 1) / rows]
+                level = int(max(group) * heatLevels / 100.0)
+                history[self._histPos] = min(max(level, 0), heatLevels - 1)
+        else:
+            self.addUsageToHist(self.getCPUUsage())
+        self._histPos = (self._histPos + 1) % vGraphWidth
         self.drawCPUUsageHistory()
 
     def updateMemInfo(self):
@@ -216,11 +351,9 @@ class PywmSysMon:
         self.paintGraph(percentUsed, hGraphStartX, hGraphStartY, hGraphWidth)
 
     def _checkForEvents(self):
-        event = wmdocklib.getEvent()
-        while not event is None:
-            if event['type'] == 'destroynotify':
+        for event in wmdocklib.getEvents():
+            if event.type == 'destroynotify':
                 sys.exit(0)
-            event = wmdocklib.getEvent()
 
     def mainLoop(self):
         counter = -1
@@ -238,10 +371,10 @@ class PywmSysMon:
 
 def parseCommandLine(argv):
     """Parse the commandline. Return a dictionary with options and values."""
-    shorts = 'hf:g:b:p:a:r:s:m:iu:'
+    shorts = 'hf:g:b:p:a:r:s:m:iu:c:'
     longs = ['help=', 'barbgcolor=', 'barfgcolor=', 'background=',
              'graphforeground=', 'graphbackground=', 'rgbfile=', 'procstat=',
-             'procmeminfo=', 'ignorenice', 'updatedelay=']
+             'procmeminfo=', 'ignorenice', 'updatedelay=', 'cpumode=']
     try:
         opts, nonOptArgs = getopt.getopt(argv[1:], shorts, longs)
     except getopt.GetoptError, e:
@@ -278,61 +411,67 @@ def parseCommandLine(argv):
                 sys.stderr.write(
                     "Value for updatedelay has to be an integer.\n")
                 sys.exit(2)
+        if o in ('-c', '--cpumode'):
+            if a not in cpuModes:
+                sys.stderr.write("Value for cpumode has to be one of %s.\n" %
+                                 ', '.join(cpuModes))
+                sys.exit(2)
+            d['cpumode'] = a
     return d
 
-background = \
+patterns = \
 [' ...............................................................................................',
- ' .///..___..ooo..___..___......|.I..............................................................',
- ' .///..___..ooo..___..___......|.I..............................................................',
- ' .///..___..ooo..___..___......|.I..............................................................',
- ' .///..___..___..___..___......|.I..............................................................',
- ' .///..___..___..___..___......|.I..............................................................',
- ' .///..___..___..___..___......|.I..............................................................',
- ' .///..___..___..ooo..___......|.I..............................................................',
- ' .///..___..___..ooo..___......|.I..............................................................',
- ' .///..___..___..ooo..___......|.I..............................................................',
- ' .///..___..___..___..___......|.I..............................................................',
- ' .///..___..___..___..___......|.I..............................................................',
- ' .///..___..___..___..___......|.I..............................................................',
- ' .///..___..___..___..ooo......|.I..............................................................',
- ' .///..___..___..___..ooo......|.I..............................................................',
- ' .///..___..___..___..ooo......|.I..............................................................',
- ' .///..........................|.I..............................................................',
- ' .///..........................|.I..............................................................',
- ' .///..........................|.I..............................................................',
- ' .///..........................|.I..............................................................',
- ' .///..........................|.I..............................................................',
- ' .///..........................|.I..............................................................',
- ' .///..........................|.I..............................................................',
- ' .///..........................|.I..............................................................',
- ' .///..........................|.I..............................................................',
- ' .///..........................|.I..............................................................',
- ' .///..........................|.I..............................................................',
- ' .///..........................|.I..............................................................',
- ' .///..........................|.I..............................................................',
- ' .///..........................|.I..............................................................',
- ' .///..........................|.I..............................................................',
- ' .///..........................|.I..............................................................',
- ' .///..........................|.I..............................................................',
- ' .///..........................|.I..............................................................',
- ' .///..........................|.I..............................................................',
- ' .///..........................|.I..............................................................',
- ' .///..........................|.I..............................................................',
- ' .///..........................|.I..............................................................',
- ' .///..........................|.I..............................................................',
- ' .///..........................|.I..............................................................',
- ' .///..........................|.I..............................................................',
- ' .///..........................|.I..............................................................',
- ' .///..........................|.I..............................................................',
- ' .///..........................|.I..............................................................',
- ' .///..........................|.I..............................................................',
- ' .///..........................|.I..............................................................',
- ' .///..........................|.I..............................................................',
- ' .///..........................|.I..............................................................',
- ' .///..........................|.I..............................................................',
- ' .///..........................|.I..............................................................',
- ' .///..........................|.I..............................................................',
- ' .///..........................|.I..............................................................',
+ ' .///..___..ooo..___..___......|.I.n.s.w.q.t.A.B.C.D.E.F.G.H....................................',
+ ' .///..___..ooo..___..___......|.I.n.s.w.q.t.A.B.C.D.E.F.G.H....................................',
+ ' .///..___..ooo..___..___......|.I.n.s.w.q.t.A.B.C.D.E.F.G.H....................................',
+ ' .///..___..___..___..___......|.I.n.s.w.q.t.A.B.C.D.E.F.G.H....................................',
+ ' .///..___..___..___..___......|.I.n.s.w.q.t.A.B.C.D.E.F.G.H....................................',
+ ' .///..___..___..___..___......|.I.n.s.w.q.t.A.B.C.D.E.F.G.H....................................',
+ ' .///..___..___..ooo..___......|.I.n.s.w.q.t.A.B.C.D.E.F.G.H....................................',
+ ' .///..___..___..ooo..___......|.I.n.s.w.q.t.A.B.C.D.E.F.G.H....................................',
+ ' .///..___..___..ooo..___......|.I.n.s.w.q.t.A.B.C.D.E.F.G.H....................................',
+ ' .///..___..___..___..___......|.I.n.s.w.q.t.A.B.C.D.E.F.G.H....................................',
+ ' .///..___..___..___..___......|.I.n.s.w.q.t.A.B.C.D.E.F.G.H....................................',
+ ' .///..___..___..___..___......|.I.n.s.w.q.t.A.B.C.D.E.F.G.H....................................',
+ ' .///..___..___..___..ooo......|.I.n.s.w.q.t.A.B.C.D.E.F.G.H....................................',
+ ' .///..___..___..___..ooo......|.I.n.s.w.q.t.A.B.C.D.E.F.G.H....................................',
+ ' .///..___..___..___..ooo......|.I.n.s.w.q.t.A.B.C.D.E.F.G.H....................................',
+ ' .///..........................|.I.n.s.w.q.t.A.B.C.D.E.F.G.H....................................',
+ ' .///..........................|.I.n.s.w.q.t.A.B.C.D.E.F.G.H....................................',
+ ' .///..........................|.I.n.s.w.q.t.A.B.C.D.E.F.G.H....................................',
+ ' .///..........................|.I.n.s.w.q.t.A.B.C.D.E.F.G.H....................................',
+ ' .///..........................|.I.n.s.w.q.t.A.B.C.D.E.F.G.H....................................',
+ ' .///..........................|.I.n.s.w.q.t.A.B.C.D.E.F.G.H....................................',
+ ' .///..........................|.I.n.s.w.q.t.A.B.C.D.E.F.G.H....................................',
+ ' .///..........................|.I.n.s.w.q.t.A.B.C.D.E.F.G.H....................................',
+ ' .///..........................|.I.n.s.w.q.t.A.B.C.D.E.F.G.H....................................',
+ ' .///..........................|.I.n.s.w.q.t.A.B.C.D.E.F.G.H....................................',
+ ' .///..........................|.I.n.s.w.q.t.A.B.C.D.E.F.G.H....................................',
+ ' .///..........................|.I.n.s.w.q.t.A.B.C.D.E.F.G.H....................................',
+ ' .///..........................|.I.n.s.w.q.t.A.B.C.D.E.F.G.H....................................',
+ ' .///..........................|.I.n.s.w.q.t.A.B.C.D.E.F.G.H....................................',
+ ' .///..........................|.I.n.s.w.q.t.A.B.C.D.E.F.G.H....................................',
+ ' .///..........................|.I.n.s.w.q.t.A.B.C.D.E.F.G.H....................................',
+ ' .///..........................|.I.n.s.w.q.t.A.B.C.D.E.F.G.H....................................',
+ ' .///..........................|.I.n.s.w.q.t.A.B.C.D.E.F.G.H....................................',
+ ' .///..........................|.I.n.s.w.q.t.A.B.C.D.E.F.G.H....................................',
+ ' .///..........................|.I.n.s.w.q.t.A.B.C.D.E.F.G.H....................................',
+ ' .///..........................|.I.n.s.w.q.t.A.B.C.D.E.F.G.H....................................',
+ ' .///..........................|.I.n.s.w.q.t.A.B.C.D.E.F.G.H....................................',
+ ' .///..........................|.I.n.s.w.q.t.A.B.C.D.E.F.G.H....................................',
+ ' .///..........................|.I.n.s.w.q.t.A.B.C.D.E.F.G.H....................................',
+ ' .///..........................|.I.n.s.w.q.t.A.B.C.D.E.F.G.H....................................',
+ ' .///..........................|.I.n.s.w.q.t.A.B.C.D.E.F.G.H....................................',
+ ' .///..........................|.I.n.s.w.q.t.A.B.C.D.E.F.G.H....................................',
+ ' .///..........................|.I.n.s.w.q.t.A.B.C.D.E.F.G.H....................................',
+ ' .///..........................|.I.n.s.w.q.t.A.B.C.D.E.F.G.H....................................',
+ ' .///..........................|.I.n.s.w.q.t.A.B.C.D.E.F.G.H....................................',
+ ' .///..........................|.I.n.s.w.q.t.A.B.C.D.E.F.G.H....................................',
+ ' .///..........................|.I.n.s.w.q.t.A.B.C.D.E.F.G.H....................................',
+ ' .///..........................|.I.n.s.w.q.t.A.B.C.D.E.F.G.H....................................',
+ ' .///..........................|.I.n.s.w.q.t.A.B.C.D.E.F.G.H....................................',
+ ' .///..........................|.I.n.s.w.q.t.A.B.C.D.E.F.G.H....................................',
+ ' .///..........................|.I.n.s.w.q.t.A.B.C.D.E.F.G.H....................................',
  ' .///...........................................................................................',
  ' .///...-------------------------------------------------------------------------------------...',
  ' .///...-------------------------------------------------------------------------------------...',
@@ -361,6 +500,7 @@ def main():
         sys.exit(4)
     ignoreNice = config.get('ignorenice', 0)
     updateDelay = config.get('updatedelay', 30)
+    cpuMode = config.get('cpumode', 'total')
     try:
         programName = sys.argv[0].split(os.sep)[-1]
     except IndexError:
@@ -385,10 +525,20 @@ def main():
     palette['I'] = config.get('graphbackground', '#707070707070')
     palette['_'] = config.get('background', '#000000000000')
     palette['%'] = config.get('foreground', '#2081B2CAAEBA')
-
-    wmdocklib.initPixmap(background, palette=palette)
-    wmdocklib.openXwindow(sys.argv, width, height)
-    pywmsysmon = PywmSysMon(procMeminfo, procStat, ignoreNice, updateDelay)
+    # the cpu states, and the load levels from cold to hot.
+    palette.update({
+        'n': '#6b8e23', 's': '#cd5c5c', 'w': '#ffd700',
+        'q': '#9370db', 't': '#ff8c00',
+        })
+    for code, colour in zip('ABCDEFGH', [
+        '#1a1a4d', '#1f3f8f', '#2080b0', '#20b2aa',
+        '#7fc040', '#e0d020', '#f08020', '#ff2020']):
+        palette[code] = colour
+
+    wmdocklib.initPixmap(patterns=patterns, bg='_', palette=palette)
+    wmdocklib.openXwindow(sys.argv, width, height, events=[])
+    pywmsysmon = PywmSysMon(procMeminfo, procStat, ignoreNice, updateDelay,
+                            cpuMode)
     pywmsysmon.mainLoop()
 
 
@@ -13,13 +13,21 @@ Changes:
 First attempt
 """
 
-import sys, getopt, os
+import sys, getopt, os, re
 import socket
+import threading, Queue
+import collections
 import wmdocklib
-import time, datetime
+from wmdocklib import eventloop
+import time
 
 DEFAULT_PORT = 27960
 DEFAULT_INTERVAL = 60 #seconds
+DEFAULT_CYCLE = 5 #seconds each server stays on display
+QUERY_TIMEOUT = 1.0 #seconds before the first retry, doubled at each retry
+QUERY_RETRIES = 2
+MAX_BACKOFF = 16 #at most this many intervals between polls of a dead server
+SCROLL_SPEED = 0.04 #seconds per pixel for a map name that does not fit
 WIDTH = 64
 HEIGHT = 64
 XOFFSET = 4
@@ -31,15 +39,17 @@ usage = '''\
 pywmwet.py [options]
 Available options are:
 -h, --help                          Print this help text
--s, --server <server address>       Server to track
+-s, --server <address[:port]>       Server to track, repeat it to track
+                                    more servers, shown in turn
 -p, --port <port>                   Server port [default: 27960]
 -u, --update-interval <seconds>     Delay between updates [default: 60 sec]
+-c, --cycle <seconds>               Time each server is shown [default: 5 sec]
 '''
 
 
 def parse_command_line(argv):
-    shorts = 'hs:p:u:'
-    longs = ['help', 'server=', 'port=', 'update-interval=']
+    shorts = 'hs:p:u:c:'
+    longs = ['help', 'server=', 'port=', 'update-interval=', 'cycle=']
 
     try:
         opts, nonOptArgs = getopt.getopt(argv[1:], shorts, longs)
@@ -47,136 +57,262 @@ def parse_command_line(argv):
         print 'Error parsing commandline: ' + str(e)
         print usage
         sys.exit(2)
-    d = {}
+    d = {'port': DEFAULT_PORT, 'update-interval': DEFAULT_INTERVAL,
+         'cycle': DEFAULT_CYCLE}
     for o, a in opts:
         if o in ('-h', '--help'):
             print usage
             sys.exit(0)
         if o in ('-s', '--server'):
-            d['server'] = a
+            d.setdefault('server', []).append(a)
         if o in ('-p', '--port'):
             d['port'] = int(a)
-        else:
-            d['port'] = DEFAULT_PORT
         if o in ('-u', '--update-interval'):
             d['update-interval'] = int(a)
-        else:
-            d['update-interval'] = DEFAULT_INTERVAL
+        if o in ('-c', '--cycle'):
+            d['cycle'] = int(a)
     return d
 
-def query_server(server, port):
-    try:
-        query = '\xFF\xFF\xFF\xFF\x02getstatus\x0a\x00'
-        addr = (server, port)
-        sockobj = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        sockobj.settimeout(4.0)
-        sockobj.connect(addr)
-        sockobj.send(query)
-        data = sockobj.recv(4096)
-        data = data[18:]
-        sockobj.shutdown(0)
-        sockobj.close()
-        #print 'query success'
-        #print data
-        return data
-    except socket.error:
-        #print 'query failure'
-        return False
-
-def get_map(data):
-    data = data.split('\\')
-    i = data.index('mapname')
-    return ' '.join(data[i+1].split('_')).title()
-
-def get_num_allies(data):
-    data = data.split('\\')
-    try: #servers using older cvar
-        i = data.index('Players_Allies')
-        allies = data[i+1]
-        return len(allies.split())
-    except ValueError: #possibly newer server using 'P' cvar
+STATUS_QUERY = '\xFF\xFF\xFF\xFF\x02getstatus\x0a\x00'
+STATUS_RESPONSE = '\xFF\xFF\xFF\xFFstatusResponse'
+
+class Server:
+    """a server to track and what we know about it.
+
+    status is the Status from the last getstatus response, None if the
+    server did not answer the last time it was asked.  response is the
+    response itself, so that an unchanged one is not parsed again.
+    """
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.addr = None
+        # a thread is looking up host.
+        self.resolving = False
+        self.status = None
+        self.response = None
+        self.failures = 0
+        self.next_poll = 0
+        # the query in progress: how many times it was sent, and the timer
+        # sending it again.
+        self.attempts = 0
+        self.timer = None
+
+class StatusQuery:
+    """asks the status of many servers at once.
+
+    all queries go through one non-blocking UDP socket, kept open for the
+    life of the dockapp, and the answers are read when the event loop sees
+    the socket readable, so a dead server never keeps the dockapp waiting.
+    a query is sent again after QUERY_TIMEOUT seconds, doubled at every
+    retry, up to QUERY_RETRIES times; a server that did not answer is then
+    polled less and less often, up to MAX_BACKOFF intervals apart.
+
+    host names are looked up in threads, the name server may take longer
+    than any of these timeouts to answer, or not answer at all.  a name
+    that can't be resolved counts as a server that did not answer.
+    """
+    def __init__(self, loop, servers, interval, callback):
+        """callback(server) is called whenever the status of a server
+        arrived, or it did not answer.
+        """
+        self.loop = loop
+        self.servers = servers
+        self.interval = interval
+        self.callback = callback
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setblocking(0)
+        loop.addReader(self.sock.fileno(), self.on_readable)
+        # (ip, port) -> the servers there, the same one can be given twice
+        # under different names.
+        self.by_addr = {}
+        # the lookup threads write a byte on the pipe to wake up the loop.
+        self.resolved = Queue.Queue()
+        self.wakeup, self.notify = os.pipe()
+        loop.addReader(self.wakeup, self.on_resolved)
+
+    def poll(self):
+        """query the servers that are due and not being queried already.
+        """
+        now = time.time()
+        for server in self.servers:
+            if server.timer is not None or server.resolving or \
+                    now < server.next_poll:
+                continue
+            if server.addr is None:
+                server.resolving = True
+                thread = threading.Thread(target=self.resolve,
+                                          args=(server,))
+                # a hung lookup must not keep us from exiting.
+                thread.setDaemon(True)
+                thread.start()
+                continue
+            server.attempts = 0
+            self.send(server)
+
+    def resolve(self, server):
+        # in a thread of its own.
         try:
-            #3 - Spectator, 2 - Allies, 1 - Axis
-            i = data.index('P')
-            slots = data[i+1]
-            allies = 0
-            for slot in slots:
-                if slot == '2':
-                    allies += 1
-            return allies
-        except ValueError: #no players connected?
-            return 0
-
-def get_num_axis(data):
-    data = data.split('\\')
-    try: #server using old cvar
-        i = data.index('Players_Axis')
-        axis = data[i+1]
-        return len(axis.split())
-    except ValueError: #possible new cvar
+            ip = socket.gethostbyname(server.host)
+        except socket.error:
+            ip = None
+        self.resolved.put((server, ip))
+        os.write(self.notify, 'x')
+
+    def on_resolved(self, fd):
+        os.read(fd, 512)
+        while 1:
+            try:
+                server, ip = self.resolved.get_nowait()
+            except Queue.Empty:
+                break
+            server.resolving = False
+            if ip is None:
+                self.failed(server)
+                continue
+            server.addr = (ip, server.port)
+            self.by_addr.setdefault(server.addr, []).append(server)
+            server.attempts = 0
+            self.send(server)
+
+    def send(self, server):
+        server.attempts += 1
         try:
-            #3 - Spectator, 2 - Allies, 1 - Axis
-            i = data.index('P')
-            slots = data[i+1]
-            axis = 0
-            for slot in slots:
-                if slot == '1':
-                    axis += 1
-            return axis
-        except ValueError: #no players
-            return 0
-
-def get_num_spectators(data):
-    #This will only work with servers that use the newer 'P' cvar
-    data = data.split('\\')
-    try:
-        #3 - Spectator, 2 - Allies, 1 - Axis
-        i = data.index('P')
-        slots = data[i+1]
-        spec = 0
-        for slot in slots:
-            if slot == '3':
-                spec += 1
-        return spec
-    except ValueError: #check if old cvars in use
-        if 'Players_Axis' in data or 'Players_Allies' in data:
-            #old cvars in use, so we don't know how many spectators there are
-            return '??'
-        else: #no players
-            return 0
-
-def get_players(data):
-    players = []
-    player_data = data.strip().split('\n')[1:]
-    for player_line in player_data:
-        player = strip_name(player_line.split('"')[1])
-        players.append(player)
-    return players
+            self.sock.sendto(STATUS_QUERY, server.addr)
+        except socket.error:
+            pass
+        delay = QUERY_TIMEOUT * 2 ** (server.attempts - 1)
+        server.timer = self.loop.addTimer(delay,
+                                          lambda: self.on_timeout(server))
+
+    def on_timeout(self, server):
+        if server.attempts <= QUERY_RETRIES:
+            self.send(server)
+        else:
+            server.timer = None
+            self.failed(server)
+
+    def failed(self, server):
+        server.status = None
+        server.response = None
+        server.failures += 1
+        backoff = min(2 ** (server.failures - 1), MAX_BACKOFF)
+        server.next_poll = time.time() + backoff * self.interval
+        self.callback(server)
+
+    def on_readable(self, fd):
+        while 1:
+            try:
+                data, addr = self.sock.recvfrom(4096)
+            except socket.error, e:
+                # EAGAIN, nothing more to read.
+                return
+            if not data.startswith(STATUS_RESPONSE):
+                continue
+            for server in self.by_addr.get(addr, []):
+                if server.timer is None:
+                    # a late duplicate answer.
+                    continue
+                server.timer.cancel()
+                server.timer = None
+                if data != server.response:
+                    server.response = data
+                    server.status = Status(data[len(STATUS_RESPONSE):])
+                server.failures = 0
+                server.next_poll = time.time() + self.interval
+                self.callback(server)
+
+Player = collections.namedtuple('Player', 'score ping name')
+
+class Status:
+    """the status of a server, parsed from its getstatus response.
+
+    cvars is a dictionary name -> value, players a list of Player with the
+    colour codes stripped from their names.  allies, axis and spectators
+    count the players in each team.  servers using the older
+    Players_Allies and Players_Axis cvars do not tell the spectators, then
+    spectators is '??'.
+    """
+    def __init__(self, data):
+        # '\n\\name\\value\\name\\value...\n' then one line per player:
+        # 'score ping "name"'
+        lines = data.strip('\n').split('\n')
+        fields = lines[0].split('\\')
+        # the leading '\\' leaves an empty field, some servers omit it.
+        if not fields[0]:
+            fields = fields[1:]
+        self.cvars = dict(zip(fields[0::2], fields[1::2]))
+        self.players = []
+        for line in lines[1:]:
+            # one bad line from a server must not take the dockapp down.
+            try:
+                score, ping, name = line.split(' ', 2)
+                player = Player(int(score), int(ping),
+                                strip_name(name.split('"')[1]))
+            except (ValueError, IndexError):
+                continue
+            self.players.append(player)
+
+        self.mapname = ' '.join(
+            self.cvars.get('mapname', '').split('_')).title()
+        #'P' has one digit per slot: 3 - Spectator, 2 - Allies, 1 - Axis
+        slots = self.cvars.get('P')
+        if slots is not None:
+            self.allies = slots.count('2')
+            self.axis = slots.count('1')
+            self.spectators = slots.count('3')
+        else:
+            self.allies = self.axis = self.spectators = 0
+        old = False
+        if 'Players_Allies' in self.cvars:
+            self.allies = len(self.cvars['Players_Allies'].split())
+            old = True
+        if 'Players_Axis' in self.cvars:
+            self.axis = len(self.cvars['Players_Axis'].split())
+            old = True
+        if old and slots is None:
+            self.spectators = '??'
 
 def scroll_players(players):
     pass
 
+color_code = re.compile(r'\^+.?')
+
 def strip_name(name):
-    stripped_name = ''
-    skip_next = False
-    for x in range(len(name)):
-        if name[x] != '^' and skip_next != True:
-            stripped_name += name[x]
-        elif name[x] == '^':
-            skip_next = True
-            continue
-        skip_next = False
-    return stripped_name
-            
-
-def scroll_text(s, y, speed):
-    #not sure if this is the best way to do this...
-    cen_pos = get_center(s)
-    end_pos = (cen_pos *2) - (MARGIN * 2) - 64
-    for x in range(WIDTH, end_pos, -1):
-        add_string(s, x, y)
-        wmdocklib.redraw()
-        time.sleep(speed)
+    return color_code.sub('', name)
+
+class Marquee:
+    """a line of text too long for the window, scrolling to the left one
+    pixel per frame.
+
+    the text is rendered once in an offscreen Drawable, twice, with a gap
+    as wide as the viewport in between.  whatever the position, a frame is
+    then one single blit of a viewport wide slice of the Drawable.
+    """
+    def __init__(self, text, x, y, width):
+        self.text = text
+        self.x = x + XOFFSET
+        self.y = y + YOFFSET
+        self.width = width
+        text_width = char_width * len(text)
+        # pixels before the picture repeats.
+        self.period = text_width + width
+        self.pixmap = wmdocklib.Drawable(self.period + width, char_height)
+        # the gap gets the background, from the patterns.
+        areas = []
+        for dx in range(0, self.period + width, 64):
+            areas.extend((0, 64, min(64, self.period + width - dx),
+                          char_height, dx, 0))
+        self.pixmap.xCopyAreasFromWindow(areas)
+        wmdocklib.addString(text, 0, 0, drawable=self.pixmap)
+        wmdocklib.addString(text, self.period, 0, drawable=self.pixmap)
+        # enter from the right.
+        self.offset = text_width
+
+    def step(self):
+        self.pixmap.xCopyAreaToWindow(self.offset, 0, self.width, char_height,
+                                      self.x, self.y)
+        self.offset = (self.offset + 1) % self.period
 
 def get_center(s):
     return wmdocklib.getCenterStartPos(s, WIDTH, XOFFSET)
@@ -192,47 +328,81 @@ def get_spacing(line_no):
         return MARGIN + (char_height * (line_no - 1)) + LINE_SPACING * (line_no - 1)
 
 def check_for_events():
-    event = wmdocklib.getEvent()
-    while not event is None:
-        if event['type'] == 'destroynotify':
+    for event in wmdocklib.getEvents():
+        if event.type == 'destroynotify':
             sys.exit(0)
-        event = wmdocklib.getEvent()
-
-def main_loop(server, port, update_interval):
-    dif = datetime.timedelta(seconds=update_interval)
-    last_updated = datetime.datetime.now()
-    just_started = True
-    while 1:
-        check_for_events()
-        now = datetime.datetime.now()
-        if now > (last_updated + dif) or just_started == True:
-            data = query_server(server, port)
-            if not data:
-                add_string('Server', get_center('Server'), get_spacing(1))
-                add_string('Not', get_center('Not'), get_spacing(2))
-                add_string('Found', get_center('Found'), get_spacing(3))
-                just_started = False
-            else:
-                mapname = get_map(data)
-                num_allies = get_num_allies(data)
-                num_axis = get_num_axis(data)
-                num_specs = get_num_spectators(data)
-                last_updated = datetime.datetime.now()
-                just_started = False
-            
-        if data:
-            add_string(('Allies:%s' % str(num_allies)), MARGIN, get_spacing(2) + 5)
-            add_string(('Axis:%s' % str(num_axis)), MARGIN, get_spacing(3) + 5)
-            add_string(('Spec:%s' % str(num_specs)), MARGIN, get_spacing(4) + 5)
-            
-            #mapname last in case it has to scroll
-            if get_center(mapname) < MARGIN:
-                scroll_text(mapname, get_spacing(1), 0.04)
-            else:
-                add_string(mapname, get_center(mapname), get_spacing(1))
-
-        wmdocklib.redraw()
-        time.sleep(0.1)
+
+def clear_screen():
+    wmdocklib.copyXPMArea(0, 64, WIDTH - 2 * XOFFSET, HEIGHT - 2 * YOFFSET,
+                          XOFFSET, YOFFSET)
+
+def draw_status(server):
+    """paint the status of server.
+
+    return the map name if it is too long for the window and must scroll,
+    else None.
+    """
+    if server is None:
+        return None
+    status = server.status
+    if status is None:
+        add_string('Server', get_center('Server'), get_spacing(1))
+        add_string('Not', get_center('Not'), get_spacing(2))
+        add_string('Found', get_center('Found'), get_spacing(3))
+        return None
+    mapname = status.mapname
+    add_string(('Allies:%s' % str(status.allies)), MARGIN, get_spacing(2) + 5)
+    add_string(('Axis:%s' % str(status.axis)), MARGIN, get_spacing(3) + 5)
+    add_string(('Spec:%s' % str(status.spectators)), MARGIN, get_spacing(4) + 5)
+
+    if get_center(mapname) < MARGIN:
+        return mapname
+    add_string(mapname, get_center(mapname), get_spacing(1))
+    return None
+
+def main_loop(servers, update_interval, cycle):
+    loop = eventloop.EventLoop()
+    # the server on display, None until the first one answered or failed,
+    # and the Marquee of its map name with the Timer moving it.
+    shown = [None]
+    marquee = [None, None]
+
+    def show(server):
+        shown[0] = server
+        clear_screen()
+        mapname = draw_status(server)
+        if marquee[0] is not None and marquee[0].text == mapname:
+            # the same name keeps scrolling from where it was.
+            return
+        if marquee[1] is not None:
+            marquee[1].cancel()
+            marquee[:] = [None, None]
+        if mapname is not None:
+            scroller = Marquee(mapname, 0, get_spacing(1),
+                               WIDTH - 2 * XOFFSET)
+            marquee[:] = [scroller,
+                          loop.addTimer(0, scroller.step, SCROLL_SPEED)]
+
+    def status_changed(server):
+        if shown[0] is None or shown[0] is server:
+            show(server)
+
+    def next_server():
+        known = [server for server in servers
+                 if server.status is not None or server.failures]
+        if shown[0] in known:
+            i = (known.index(shown[0]) + 1) % len(known)
+            if known[i] is not shown[0]:
+                show(known[i])
+
+    query = StatusQuery(loop, servers, update_interval, status_changed)
+    loop.addXHandler(check_for_events)
+    # poll only queries the servers that are due.
+    loop.addTimer(0, query.poll, 1)
+    if len(servers) > 1:
+        loop.addTimer(cycle, next_server, cycle)
+    loop.addIdleCallback(wmdocklib.redraw)
+    loop.run()
 
 def main():
     clConfig = parse_command_line(sys.argv)
@@ -248,10 +418,18 @@ def main():
 
     global char_width, char_height
     char_width, char_height = wmdocklib.initPixmap(font_name='5x7', fg=3)
-    wmdocklib.openXwindow(sys.argv, 64, 64)
+    wmdocklib.openXwindow(sys.argv, 64, 64, events=[])
+
+    servers = []
+    for address in clConfig['server']:
+        host, port = address, clConfig['port']
+        if ':' in address:
+            host, port = address.split(':', 1)
+            port = int(port)
+        servers.append(Server(host, port))
 
     try:
-        main_loop(clConfig['server'], clConfig['port'], clConfig['update-interval'])
+        main_loop(servers, clConfig['update-interval'], clConfig['cycle'])
     except KeyboardInterrupt:
         print 'Goodbye.'
         sys.exit(0)
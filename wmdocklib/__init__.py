@@ -6,7 +6,11 @@ wmgeneral.c, but some new functions are added too.
 to get help about a contained package, try:
 help(wmdocklib.<name>)
 """
-from pywmgeneral import *
+# same as 'from pywmgeneral import *', for whichever backend is in use.
+import pywmhelpers as _helpers
+for _name in getattr(_helpers.pywmgeneral, '__all__',
+                     [n for n in dir(_helpers.pywmgeneral) if n[0] != '_']):
+    globals()[_name] = getattr(_helpers.pywmgeneral, _name)
 from pywmhelpers import *
 
-__all__ = ['wmoo']
+__all__ = ['wmoo', 'eventloop', 'benchmark', 'procfs']
@@ -0,0 +1,202 @@
+"""benchmark.py
+
+startup time benchmark for wmdocklib.
+
+times every phase of initPixmap, and optionally openXwindow, for every
+character set shipped with the library combined with the palette,
+background and patterns of every example application.  results are written
+one JSON object per line, so that runs can be collected and compared.
+
+with --backend headless nothing needs a display, and openXwindow and
+string rendering are timed in-process too.
+
+each phase is measured twice: 'cold', as on the very first launch, without
+any disk cache, and 'warm', with the disk cache filled by a previous run.
+
+usage: python -m wmdocklib.benchmark [options]
+
+Licensed under the GNU General Public License.
+"""
+
+import sys, os, glob, time, ast, tempfile, shutil, subprocess
+import json
+from optparse import OptionParser
+
+import pywmhelpers
+
+libraryDir = os.path.dirname(os.path.abspath(__file__))
+defaultExamplesDir = os.path.join(os.path.dirname(libraryDir), 'examples')
+
+def fontNames():
+    """return the names of all character sets shipped with the library."""
+    return sorted([os.path.basename(name)[:-4]
+                   for name in glob.glob(os.path.join(libraryDir, '*.xpm'))])
+
+def exampleConfigurations(directory):
+    """return a list of (name, kwargs) for initPixmap.
+
+    the first item is the library default, the others are taken from the
+    module level palette, background and patterns of the example
+    applications in directory.  the examples are parsed, not imported, since
+    some of them open their window at import time.
+    """
+    result = [('default', {})]
+    for fileName in sorted(glob.glob(os.path.join(directory, 'pywm*.py'))):
+        try:
+            tree = ast.parse(file(fileName).read(), fileName)
+        except (IOError, SyntaxError), e:
+            sys.stderr.write("can't parse %s: %s\n" % (fileName, e))
+            continue
+        kwargs = {}
+        for node in tree.body:
+            if not isinstance(node, ast.Assign) or len(node.targets) != 1:
+                continue
+            target = node.targets[0]
+            if not isinstance(target, ast.Name):
+                continue
+            if target.id in ('palette', 'background', 'patterns'):
+                try:
+                    kwargs[target.id] = ast.literal_eval(node.value)
+                except ValueError:
+                    pass
+        if kwargs:
+            result.append((os.path.basename(fileName)[:-3], kwargs))
+    return result
+
+# what the 'render' phase draws, with the headless backend only.
+renderText = ''.join([chr(i) for i in range(32, 127)])
+renderFrames = 100
+
+def measure(fontName, kwargs, runs):
+    """run makePixmap and includePixmap runs times.
+
+    with the headless backend also time openXwindow, and painting
+    renderText renderFrames times, redrawing the window after each.
+
+    return a dictionary phase -> list of seconds, one per run.
+    """
+    samples = {}
+    for i in range(runs):
+        # forget whatever this process already parsed.
+        pywmhelpers._rgbTables.clear()
+        timings = {}
+        start = time.time()
+        xpm, font = pywmhelpers.makePixmap(font_name=fontName,
+                                           timings=timings, **kwargs)
+        timings['makePixmap'] = time.time() - start
+        # a fresh dock each time, a dock opens its window only once.
+        dock = pywmhelpers.newDock()
+        start = time.time()
+        dock.includePixmap(xpm)
+        timings['includePixmap'] = time.time() - start
+        if pywmhelpers.pywmgeneral.__name__.endswith('pywmheadless'):
+            # the in-memory backend needs no display.
+            start = time.time()
+            dock.openXwindow(1, ['benchmark'], 64, 64)
+            timings['openXwindow'] = time.time() - start
+            previous = pywmhelpers.useDock(dock)
+            start = time.time()
+            for frame in range(renderFrames):
+                font.render(renderText, 0, frame % 64)
+                dock.redrawWindow()
+            timings['render'] = time.time() - start
+            pywmhelpers.useDock(previous)
+            dock.close()
+        for phase, seconds in timings.items():
+            samples.setdefault(phase, []).append(seconds)
+    return samples
+
+def summary(values):
+    values = sorted(values)
+    return {'best': values[0],
+            'median': values[len(values) / 2],
+            'runs': len(values)}
+
+def measureXwindow(fontName, appName, examplesDir, runs):
+    """time openXwindow in fresh processes, it can only run once in each.
+    """
+    values = []
+    for i in range(runs):
+        child = subprocess.Popen([sys.executable, '-m', 'wmdocklib.benchmark',
+                                  '--child', fontName, appName,
+                                  '--examples', examplesDir],
+                                 stdout=subprocess.PIPE,
+                                 cwd=os.path.dirname(libraryDir))
+        output = child.communicate()[0]
+        if child.returncode != 0:
+            sys.stderr.write("openXwindow failed for %s/%s\n"
+                             % (fontName, appName))
+            return None
+        values.append(float(output))
+    return values
+
+def child(fontName, appName, examplesDir):
+    """initialize a dockapp, print the seconds spent in openXwindow."""
+    kwargs = dict(exampleConfigurations(examplesDir))[appName]
+    pywmhelpers.initPixmap(font_name=fontName, **kwargs)
+    start = time.time()
+    pywmhelpers.openXwindow([appName], 64, 64)
+    print time.time() - start
+
+def main():
+    parser = OptionParser(usage='python -m wmdocklib.benchmark [options]')
+    parser.add_option('-r', '--runs', type='int', default=5,
+                      help='measurements per phase')
+    parser.add_option('-f', '--font', action='append', dest='fonts',
+                      help='only measure this character set (repeatable)')
+    parser.add_option('-e', '--examples', default=defaultExamplesDir,
+                      help='directory holding the example applications')
+    parser.add_option('-x', '--xwindow', action='store_true', default=False,
+                      help='also time openXwindow (needs a display, e.g. Xvfb)')
+    parser.add_option('-o', '--output', help='write results to this file')
+    parser.add_option('-b', '--backend',
+                      help="'x11' or 'headless', see pywmhelpers.setBackend")
+    parser.add_option('--child', nargs=2, help='internal')
+    (options, args) = parser.parse_args()
+    if options.backend:
+        pywmhelpers.setBackend(options.backend)
+        # for the children measuring openXwindow.
+        os.environ['WMDOCKLIB_BACKEND'] = options.backend
+
+    if options.child:
+        child(options.child[0], options.child[1], options.examples)
+        return
+
+    out = sys.stdout
+    if options.output:
+        out = file(options.output, 'w')
+
+    def emit(record):
+        out.write(json.dumps(record, sort_keys=True) + '\n')
+        out.flush()
+
+    configurations = exampleConfigurations(options.examples)
+    savedCacheDir = pywmhelpers.cacheDir
+    warmCacheDir = tempfile.mkdtemp(prefix='wmdocklib-benchmark-')
+    try:
+        for fontName in options.fonts or fontNames():
+            for appName, kwargs in configurations:
+                record = {'font': fontName, 'app': appName}
+                for mode, cacheDir in [('cold', None), ('warm', warmCacheDir)]:
+                    pywmhelpers.cacheDir = cacheDir
+                    # one unmeasured run fills the warm cache.
+                    measure(fontName, kwargs, 1)
+                    for phase, values in measure(fontName, kwargs,
+                                                 options.runs).items():
+                        record.update(summary(values))
+                        record.update({'mode': mode, 'phase': phase})
+                        emit(record)
+                if options.xwindow:
+                    values = measureXwindow(fontName, appName,
+                                            options.examples, options.runs)
+                    if values is not None:
+                        record.update(summary(values))
+                        record.update({'mode': 'process',
+                                       'phase': 'openXwindow'})
+                        emit(record)
+    finally:
+        pywmhelpers.cacheDir = savedCacheDir
+        shutil.rmtree(warmCacheDir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
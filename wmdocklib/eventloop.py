@@ -0,0 +1,181 @@
+"""eventloop.py
+
+a select() based main loop for dockapps.
+
+instead of waking up at a fixed rate to look for X events and redraw the
+window, the loop sleeps on the X connection, on any other registered file
+descriptor and on the nearest timer.  an idle dockapp does not wake up at
+all, and a mouse click is handled as soon as it arrives.
+
+Licensed under the GNU General Public License.
+"""
+
+import heapq, select, time, errno
+import pywmhelpers
+
+class Timer:
+    """a timer as returned by EventLoop.addTimer.
+
+    the only useful thing you can do with it is cancelling it.
+    """
+    def __init__(self, deadline, interval, callback):
+        self.deadline = deadline
+        self.interval = interval
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+class EventLoop:
+    def __init__(self):
+        """initializes the object
+
+        _timers is a heap of tuples (deadline, sequence, timer), the
+          sequence number keeps timers with the same deadline in order.
+        _readers is a dictionary file descriptor -> callback.
+        _priorityReaders is a dictionary file descriptor -> callback, for
+          the descriptors watched for exceptional conditions.
+        _xHandlers is a list of callbacks to invoke when X events might be
+          pending.
+        _idleCallbacks is a list of callbacks invoked once per iteration,
+          after all events and timers have been handled.
+        """
+        self._timers = []
+        self._sequence = 0
+        self._readers = {}
+        self._priorityReaders = {}
+        self._xHandlers = []
+        self._idleCallbacks = []
+        self._stopped = False
+
+    def addTimer(self, delay, callback, interval=None):
+        """call callback() after delay seconds.
+
+        if interval is not None, the timer is repeated every interval
+        seconds until it is cancelled.  return the Timer object.
+        """
+        timer = Timer(time.time() + delay, interval, callback)
+        self._pushTimer(timer)
+        return timer
+
+    def _pushTimer(self, timer):
+        self._sequence += 1
+        heapq.heappush(self._timers, (timer.deadline, self._sequence, timer))
+
+    def addReader(self, fd, callback):
+        """call callback(fd) whenever fd becomes readable.
+
+        fd may be an integer or any object with a fileno() method.
+        """
+        self._readers[fd] = callback
+
+    def removeReader(self, fd):
+        self._readers.pop(fd, None)
+
+    def addPriorityReader(self, fd, callback):
+        """call callback(fd) whenever fd has an exceptional condition.
+
+        that is POLLPRI in poll() terms: out of band data on a socket, or a
+        change in a /proc file that supports it, like /proc/self/mountinfo.
+        """
+        self._priorityReaders[fd] = callback
+
+    def removePriorityReader(self, fd):
+        self._priorityReaders.pop(fd, None)
+
+    def addXHandler(self, callback):
+        """call callback() whenever there may be X events to process.
+
+        the callback is expected to drain the events with getEvents().
+        """
+        if callback not in self._xHandlers:
+            self._xHandlers.append(callback)
+
+    def removeXHandler(self, callback):
+        if callback in self._xHandlers:
+            self._xHandlers.remove(callback)
+
+    def addIdleCallback(self, callback):
+        """call callback() once per iteration, before going to sleep.
+        """
+        if callback not in self._idleCallbacks:
+            self._idleCallbacks.append(callback)
+
+    def removeIdleCallback(self, callback):
+        if callback in self._idleCallbacks:
+            self._idleCallbacks.remove(callback)
+
+    def _runTimers(self):
+        now = time.time()
+        while self._timers and self._timers[0][0] <= now:
+            deadline, sequence, timer = heapq.heappop(self._timers)
+            if timer.cancelled:
+                continue
+            if timer.interval is not None:
+                timer.deadline += timer.interval
+                if timer.deadline <= now:
+                    # we are late: do not try to catch up.
+                    timer.deadline = now + timer.interval
+                self._pushTimer(timer)
+            timer.callback()
+
+    def _nextTimeout(self):
+        """seconds until the nearest timer, None if there is no timer."""
+        while self._timers and self._timers[0][2].cancelled:
+            heapq.heappop(self._timers)
+        if not self._timers:
+            return None
+        return max(0, self._timers[0][0] - time.time())
+
+    def iterate(self, block=True):
+        """handle whatever is ready, then wait for something to happen.
+        """
+        for handler in self._xHandlers[:]:
+            handler()
+        self._runTimers()
+        for callback in self._idleCallbacks[:]:
+            callback()
+        if self._stopped:
+            return
+
+        timeout = None
+        if block:
+            timeout = self._nextTimeout()
+        else:
+            timeout = 0
+        fds = self._readers.keys()
+        priorityFds = self._priorityReaders.keys()
+        if self._xHandlers:
+            if pywmhelpers.pendingEvents():
+                timeout = 0
+            fds.append(pywmhelpers.getConnectionNumber())
+        if not fds and not priorityFds and timeout is None:
+            # nothing could ever wake us up.
+            raise RuntimeError('event loop has nothing to wait for')
+
+        try:
+            ready, dummy, exceptional = select.select(fds, [], priorityFds,
+                                                      timeout)
+        except select.error, e:
+            if e.args[0] == errno.EINTR:
+                return
+            raise
+        for fd in exceptional:
+            callback = self._priorityReaders.get(fd)
+            if callback is not None:
+                callback(fd)
+        for fd in ready:
+            callback = self._readers.get(fd)
+            if callback is not None:
+                callback(fd)
+
+    def stop(self):
+        self._stopped = True
+
+    def run(self):
+        """iterate until stop is called.
+        """
+        self._stopped = False
+        while not self._stopped:
+            self.iterate()
@@ -0,0 +1,289 @@
+"""procfs.py
+
+cheap periodic sampling of the linux /proc files.
+
+a dockapp samples the same few files several times per second.  instead of
+opening, reading line by line and closing them every time, a ProcFile keeps
+the file open and reads it again from the start, and the samplers only look
+at the fields they are asked for.  the results are named tuples, shared by
+all dockapps.
+
+Licensed under the GNU General Public License.
+"""
+
+import os, time, select, collections
+
+class ProcFile:
+    """a /proc file kept open between reads.
+
+    the kernel generates the contents again at every read from offset 0.
+    """
+    def __init__(self, path, size=4096):
+        self.path = path
+        self._fd = os.open(path, os.O_RDONLY)
+        self._size = size
+
+    def read(self):
+        """return the current contents of the file."""
+        # there is no os.pread in python 2: seek back, then read.  a short
+        # read does not mean the end of the file, some files come one page
+        # at a time.
+        os.lseek(self._fd, 0, os.SEEK_SET)
+        chunks = []
+        data = os.read(self._fd, self._size)
+        while data:
+            chunks.append(data)
+            data = os.read(self._fd, self._size)
+        data = ''.join(chunks)
+        if len(data) >= self._size:
+            # next time ask for it all at once.
+            self._size = len(data) + 1024
+        return data
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __del__(self):
+        self.close()
+
+class CpuTimes(collections.namedtuple('CpuTimes',
+                                      'user nice system idle iowait irq '
+                                      'softirq steal')):
+    """time spent by a cpu in each state since boot, in clock ticks.
+
+    guest time is already part of user time and is not repeated.  kernels
+    that do not know a state report it as 0.
+    """
+    __slots__ = ()
+
+    def total(self):
+        return sum(self)
+
+def _cpuTimes(line):
+    values = [long(x) for x in line.split()[1:9]]
+    return CpuTimes(*(values + [0] * (8 - len(values))))
+
+class StatFile(ProcFile):
+    """/proc/stat"""
+    def __init__(self, path='/proc/stat'):
+        ProcFile.__init__(self, path)
+
+    def cpu(self):
+        """return the CpuTimes of all cpus together."""
+        data = self.read()
+        return _cpuTimes(data[:data.index('\n')])
+
+    def cpus(self):
+        """return the CpuTimes of every single cpu, in order."""
+        return self.sample()[1]
+
+    def sample(self):
+        """return the CpuTimes of all cpus together and the list of the
+        CpuTimes of every single cpu, from one single read.
+        """
+        lines = self.read().split('\n')
+        cpus = []
+        for line in lines[1:]:
+            if not line.startswith('cpu'):
+                break
+            cpus.append(_cpuTimes(line))
+        return _cpuTimes(lines[0]), cpus
+
+# memory sizes, in kB.
+MemInfo = collections.namedtuple('MemInfo', 'total free buffers cached')
+
+class MeminfoFile(ProcFile):
+    """/proc/meminfo"""
+    fields = ('MemTotal', 'MemFree', 'Buffers', 'Cached')
+
+    def __init__(self, path='/proc/meminfo'):
+        ProcFile.__init__(self, path)
+        self._keys = ['\n%s:' % name for name in self.fields]
+
+    def memory(self):
+        """return the MemInfo.
+
+        raise ValueError if the file lacks one of the fields.
+        """
+        data = '\n' + self.read()
+        values = []
+        for key in self._keys:
+            start = data.find(key)
+            if start == -1:
+                raise ValueError('%s not in %s' % (key[1:-1], self.path))
+            start += len(key)
+            values.append(long(data[start:data.index('\n', start)].split()[0]))
+        return MemInfo(*values)
+
+# the counters of a block device since boot, see Documentation/iostats.txt
+# in the kernel sources.  sectors are 512 bytes, ioTicks are milliseconds
+# spent with I/O in progress.
+DiskStats = collections.namedtuple('DiskStats',
+                                   'reads readSectors writes writeSectors '
+                                   'ioTicks')
+
+class DiskstatsFile(ProcFile):
+    """/proc/diskstats"""
+    def __init__(self, path='/proc/diskstats'):
+        ProcFile.__init__(self, path)
+
+    def disks(self, names=None):
+        """return a dictionary device name -> DiskStats.
+
+        if names is given, only those devices are parsed.
+        """
+        data = self.read()
+        result = {}
+        if names is None:
+            lines = data.split('\n')
+        else:
+            lines = []
+            for name in names:
+                start = data.find(' %s ' % name)
+                if start != -1:
+                    lines.append(data[start:data.index('\n', start)])
+        for line in lines:
+            fields = line.split()
+            # the first two fields are the device numbers, the lines found
+            # by name start at the name.
+            if names is None:
+                fields = fields[2:]
+            # the name and at least the 10 counters of the oldest format.
+            if len(fields) < 11:
+                continue
+            result[fields[0]] = DiskStats(long(fields[1]), long(fields[3]),
+                                          long(fields[5]), long(fields[7]),
+                                          long(fields[10]))
+        return result
+
+# what happened on a block device between two samples: bytes per second,
+# I/O operations per second, and the percentage of the time it was busy.
+DiskRates = collections.namedtuple('DiskRates',
+                                   'readBytes writeBytes iops utilisation')
+
+class DiskSampler:
+    """compute DiskRates from consecutive reads of /proc/diskstats.
+    """
+    def __init__(self, path='/proc/diskstats'):
+        self._file = DiskstatsFile(path)
+        self._last = {}
+        self._lastTime = None
+
+    def sample(self, names=None):
+        """return a dictionary device name -> DiskRates since the previous
+        call.  devices seen for the first time are not in the result.
+        """
+        now = time.time()
+        current = self._file.disks(names)
+        result = {}
+        if self._lastTime is not None and now > self._lastTime:
+            elapsed = now - self._lastTime
+            for name, stats in current.items():
+                last = self._last.get(name)
+                if last is None:
+                    continue
+                busy = (stats.ioTicks - last.ioTicks) / (10.0 * elapsed)
+                result[name] = DiskRates(
+                    (stats.readSectors - last.readSectors) * 512 / elapsed,
+                    (stats.writeSectors - last.writeSectors) * 512 / elapsed,
+                    (stats.reads + stats.writes - last.reads - last.writes) /
+                    elapsed,
+                    min(max(busy, 0.0), 100.0))
+        self._last = current
+        self._lastTime = now
+        return result
+
+# a line of /proc/self/mountinfo.  device is 'major:minor', root is the
+# directory of the filesystem mounted on mountPoint, source is what was
+# mounted, usually a device file.
+Mount = collections.namedtuple('Mount',
+                               'device root mountPoint fsType source')
+
+def _unescape(field):
+    # the kernel writes blanks and backslashes in octal, '\040' and the like.
+    if '\\' in field:
+        return field.decode('string_escape')
+    return field
+
+class MountinfoFile(ProcFile):
+    """/proc/self/mountinfo
+
+    the kernel flags the file with POLLPRI when a filesystem is mounted or
+    unmounted, so that the mount table only needs to be read again when it
+    changed.  in select() terms, the file is in the exceptional set.
+    """
+    def __init__(self, path='/proc/self/mountinfo'):
+        ProcFile.__init__(self, path)
+        self._poll = select.poll()
+        self._poll.register(self._fd, select.POLLPRI)
+
+    def fileno(self):
+        return self._fd
+
+    def changed(self, timeout=0):
+        """return whether the mount table changed since the last call.
+
+        timeout is in seconds, None waits for a change.
+        """
+        if timeout is not None:
+            timeout = timeout * 1000
+        return bool(self._poll.poll(timeout))
+
+    def mounts(self):
+        """return a dictionary mount point -> Mount.
+
+        if something is mounted over something else, the top one is kept.
+        """
+        result = {}
+        for line in self.read().split('\n'):
+            fields = line.split()
+            if len(fields) < 10:
+                continue
+            # optional fields come after the mount options, up to a '-'.
+            separator = fields.index('-', 6)
+            mount = Mount(fields[2], _unescape(fields[3]),
+                          _unescape(fields[4]), fields[separator + 1],
+                          _unescape(fields[separator + 2]))
+            result[mount.mountPoint] = mount
+        return result
+
+def deviceName(number, source=None):
+    """return the name of the block device number ('major:minor'), as it
+    appears in /proc/diskstats, or None if it is not a block device.
+
+    filesystems like btrfs have an anonymous device number: if source, the
+    device file of the mount, is given, it is used instead.
+    """
+    try:
+        return os.path.basename(os.readlink('/sys/dev/block/' + number))
+    except OSError:
+        pass
+    if source is not None and source.startswith('/dev/'):
+        return os.path.basename(os.path.realpath(source))
+    return None
+
+def blockDevice(path):
+    """return the name of the block device holding path, as it appears in
+    /proc/diskstats, or None if it is not on a block device.
+
+    raise OSError if path can't be stat'ed.
+    """
+    dev = os.stat(path).st_dev
+    number = '%d:%d' % (os.major(dev), os.minor(dev))
+    name = deviceName(number)
+    if name is not None:
+        return name
+    # look for the source of the mount in the mount table.
+    try:
+        mounts = MountinfoFile()
+    except OSError:
+        return None
+    try:
+        for mount in mounts.mounts().values():
+            if mount.device == number:
+                return deviceName(number, mount.source)
+    finally:
+        mounts.close()
+    return None
@@ -31,16 +31,24 @@
 
 #include <Python.h>
 #include "structmember.h"
+#include "structseq.h"
 #include <stdlib.h>
 #include <stdio.h>
 #include <string.h>
 #include <unistd.h>
+#include <poll.h>
+#include <time.h>
 #include <ctype.h>
 #include <stdarg.h>
 
+#include <sys/ipc.h>
+#include <sys/shm.h>
+
 #include <X11/Xlib.h>
+#include <X11/Xutil.h>
 #include <X11/xpm.h>
 #include <X11/extensions/shape.h>
+#include <X11/extensions/XShm.h>
 
 #include "pywmgeneral.h"
 
@@ -48,28 +56,39 @@
  /* X11 Variables */
 /*****************/
 
+/* Shared by all the docks of the process, they live on the same display. */
 Window       Root;
 int          screen;
 int          x_fd;
 int          d_depth;
-XSizeHints   mysizehints;
-XWMHints     mywmhints;
 Pixel        back_pix, fore_pix;
 char        *Geometry = "";
-Window       iconwin, win;
-GC           NormalGC;
-XpmIcon      wmgen;
-Pixmap       pixmask;
 Atom         deleteAtom; /* Added 2003-06-24 for graceful shutdown. */
 
+static WMDock *docks;  /* The open docks, the display is closed with the last */
+
+/* Counts the connections opened, so that the resources of a closed one are
+ * not freed on the next: XIDs are reused.
+ */
+static unsigned long display_generation;
+
+#define ON_DISPLAY(generation) (display && (generation) == display_generation)
+
 /*****************************************************************************/
 /* The Python stuff                                                          */ 
 /*****************************************************************************/
-static char **pixmap;  /* Global pixmap, we only support one of these */
-static char *maskBits; /* Global maskbits, also only 1 supported */
+
+/* Xlib is initialized for threads, and the GIL is released while we wait on
+ * the X connection: flushing, round trips and waiting for events. The calls
+ * that only queue a request keep it, a release per glyph would hand it to
+ * the other threads over and over. Each Dock should be drawn by one thread
+ * at a time, and its events taken by one thread.
+ */
 
 char **pyListToStrs(PyObject *l) {
-    /* Convert a python list of strings to a char **. */
+    /* Convert a python list of strings to a char **. The strings belong to
+     * the list, keep it around as long as they are used.
+     */
     int size, i;
     char **target;
     PyObject *s;
@@ -78,12 +97,15 @@ char **pyListToStrs(PyObject *l) {
         return NULL;
     }
     size = PyList_Size(l);
-    target = (char **)malloc(size * sizeof(char *));
+    target = (char **)malloc((size ? size : 1) * sizeof(char *));
+    if (!target) {
+        PyErr_NoMemory();
+        return NULL;
+    }
     for (i = 0; i < size; i++) {
-        s = PySequence_GetItem(l, i);
-        if (s == NULL)
-            return NULL; /* Shouldn't happen. */
+        s = PyList_GET_ITEM(l, i);
         if (!PyString_Check(s)) {
+            free(target);
             PyErr_SetString(PyExc_TypeError, "String expected.");
             return NULL;
         }
@@ -92,80 +114,289 @@ char **pyListToStrs(PyObject *l) {
     return target;
 }
 
+int *pyRectsToInts(PyObject *o, int *count, int *allocated) {
+    /* Convert a flat buffer (e.g. array('i')) or sequence of integers
+     * holding (sx, sy, w, h, dx, dy) groups to an int array. Set count to
+     * the number of groups. If allocated is set the result must be freed.
+     */
+    const void *buffer;
+    Py_ssize_t len, i;
+    PyObject *seq, *item;
+    int *target;
+
+    *allocated = 0;
+    if (PyObject_CheckReadBuffer(o)) {
+        if (PyObject_AsReadBuffer(o, &buffer, &len) < 0)
+            return NULL;
+        if (len % (6 * sizeof(int))) {
+            PyErr_SetString(PyExc_ValueError,
+                            "buffer must hold groups of 6 ints.");
+            return NULL;
+        }
+        *count = len / (6 * sizeof(int));
+        return (int *)buffer;
+    }
+    if (!(seq = PySequence_Fast(o, "buffer or sequence of ints expected.")))
+        return NULL;
+    len = PySequence_Fast_GET_SIZE(seq);
+    if (len % 6) {
+        Py_DECREF(seq);
+        PyErr_SetString(PyExc_ValueError,
+                        "sequence must hold groups of 6 ints.");
+        return NULL;
+    }
+    target = (int *)malloc((len ? len : 1) * sizeof(int));
+    if (!target) {
+        Py_DECREF(seq);
+        PyErr_NoMemory();
+        return NULL;
+    }
+    for (i = 0; i < len; i++) {
+        item = PySequence_Fast_GET_ITEM(seq, i);
+        target[i] = PyInt_AsLong(item);
+        if (target[i] == -1 && PyErr_Occurred()) {
+            free(target);
+            Py_DECREF(seq);
+            return NULL;
+        }
+    }
+    Py_DECREF(seq);
+    *allocated = 1;
+    *count = len / 6;
+    return target;
+}
+
+/*
+ * here comes the definition of the class Dock
+ *
+ * a Dock is one dockapp window with its pixmap, its mask and its mouse
+ * regions.  the module level functions work on a default Dock; a process
+ * hosting several dockapps creates one Dock for each, and they all share
+ * the X connection.
+ */
+
+typedef struct {
+    PyObject_HEAD
+    /* Type-specific fields go here. */
+    WMDock dock;
+    PyObject *xpm;         /* the list holding the strings of dock.pixmap */
+    PyObject *weakreflist;
+} dock_DockObject;
+
+static PyTypeObject dock_DockType;
+static PyTypeObject drawable_DrawableType;
+static PyTypeObject image_ImageType;
+
+static dock_DockObject *default_dock;
+
+static dock_DockObject *
+defaultDock(void) {
+    /* The dock of the module level functions, created when first used. */
+    if (!default_dock)
+        default_dock = (dock_DockObject *)PyObject_CallObject(
+                                            (PyObject *)&dock_DockType, NULL);
+    return default_dock;
+}
+
+static int
+Dock_check(dock_DockObject *self) {
+    if (!self->dock.open) {
+        PyErr_SetString(PyExc_RuntimeError, "X client must be initialized first.");
+        return 0;
+    }
+    return 1;
+}
+
+/*
+ * The events a dock is told about.  Expose and StructureNotify are always
+ * selected, the rest only for the types of events the dockapp handles, so
+ * that the X server does not wake it up for nothing.
+ */
+
+#define ALWAYS_EVENT_MASK (ExposureMask | StructureNotifyMask | VisibilityChangeMask)
+
+static struct {
+    char *type;
+    long mask;
+} event_masks[] = {
+    /* the release goes to the window that got the press. */
+    {"buttonpress", ButtonPressMask},
+    {"buttonrelease", ButtonPressMask | ButtonReleaseMask},
+    /* the focus is taken when the pointer enters, see checkForEvents. */
+    {"keypress", KeyPressMask | EnterWindowMask | LeaveWindowMask | FocusChangeMask},
+    {"motionnotify", PointerMotionMask},
+    {"destroynotify", 0},
+    {NULL, 0}
+};
+
+static long
+eventMask(PyObject *types) {
+    /* The X event mask for a sequence of event types, all of them for
+     * None. Return -1 with an exception set on error.
+     */
+    PyObject *seq;
+    char *type;
+    long mask = ALWAYS_EVENT_MASK;
+    int i, j;
+
+    if (types == Py_None) {
+        for (j = 0; event_masks[j].type; j++)
+            mask |= event_masks[j].mask;
+        return mask;
+    }
+    if (!(seq = PySequence_Fast(types, "Sequence of event types expected.")))
+        return -1;
+    for (i = 0; i < PySequence_Fast_GET_SIZE(seq); i++) {
+        if (!(type = PyString_AsString(PySequence_Fast_GET_ITEM(seq, i)))) {
+            Py_DECREF(seq);
+            return -1;
+        }
+        for (j = 0; event_masks[j].type; j++)
+            if (!strcmp(type, event_masks[j].type))
+                break;
+        if (!event_masks[j].type) {
+            PyErr_Format(PyExc_ValueError, "Unknown event type: %s.", type);
+            Py_DECREF(seq);
+            return -1;
+        }
+        mask |= event_masks[j].mask;
+    }
+    Py_DECREF(seq);
+    return mask;
+}
+
+static void
+Dock_dealloc(dock_DockObject *self)
+{
+    if (self->weakreflist != NULL)
+        PyObject_ClearWeakRefs((PyObject *)self);
+    if (self->dock.open)
+        closeXwindow(&self->dock);
+    free(self->dock.pixmap);
+    Py_XDECREF(self->xpm);
+    self->ob_type->tp_free((PyObject *)self);
+}
 
 static PyObject *
-pywmgeneral_includePixmap(PyObject *self, PyObject *args) {
-    /* Set the global pixmap. */
+Dock_includePixmap(dock_DockObject *self, PyObject *args) {
+    /* Set the pixmap of the dock. */
     PyObject *arg;
+    char **strings;
     if (!PyArg_ParseTuple(args, "O", &arg))
         return NULL;
-    if(!(pixmap = pyListToStrs(arg)))
+    if (!(strings = pyListToStrs(arg)))
         return NULL;
+    free(self->dock.pixmap);
+    self->dock.pixmap = strings;
+    Py_INCREF(arg);
+    Py_XDECREF(self->xpm);
+    self->xpm = arg;
     Py_INCREF(Py_None);
     return Py_None;
 }
 
-
 static PyObject *
-pywmgeneral_openXwindow(PyObject *self, PyObject *args) {
-    /* This function now uses the global variable pixmap as xpm and creates the
+Dock_openXwindow(dock_DockObject *self, PyObject *args) {
+    /* This function now uses the pixmap of the dock as xpm and creates the
      * xbm mask of the given height and width from this one. IOW no other xbm
      * masks are supported at the moment. This shouldn't be needed except in
      * special cases (I think...)
+     *
+     * The first dock opens the display, named by the -display option, the
+     * others use the same.
+     *
+     * events is the sequence of the types of events to report, all of them
+     * by default, see setEventMask.
      */
     int argc, width, height;
-    PyObject *argvTmp;
+    long mask;
+    PyObject *argvTmp, *events = Py_None;
     char **argv;
-    if (!PyArg_ParseTuple(args, "iOii", &argc, &argvTmp, &width, &height))
+    if (!PyArg_ParseTuple(args, "iOii|O", &argc, &argvTmp, &width, &height,
+                          &events))
+        return NULL;
+    if (!self->dock.pixmap) {
+        PyErr_SetString(PyExc_RuntimeError, "includePixmap must be called first.");
+        return NULL;
+    }
+    if (self->dock.open) {
+        PyErr_SetString(PyExc_RuntimeError, "X window already open.");
+        return NULL;
+    }
+    if ((mask = eventMask(events)) == -1)
         return NULL;
     if (!(argv = pyListToStrs(argvTmp)))
         return NULL;
-    maskBits = (char *)malloc(width * height * sizeof(char));
-    createXBMfromXPM(maskBits, pixmap, width, height);
-    openXwindow(argc, argv, pixmap, maskBits, width, height);
+    self->dock.event_mask = mask;
+    if (argc > PyList_GET_SIZE(argvTmp))
+        argc = PyList_GET_SIZE(argvTmp);
+    self->dock.maskBits = (char *)malloc(width * height * sizeof(char));
+    if (!self->dock.maskBits) {
+        free(argv);
+        return PyErr_NoMemory();
+    }
+    createXBMfromXPM(self->dock.maskBits, self->dock.pixmap, width, height);
+    openXwindow(&self->dock, argc, argv, self->dock.pixmap,
+                self->dock.maskBits, width, height);
+    free(argv);
     Py_INCREF(Py_None);
     return Py_None;
 }
 
 static PyObject *
-pywmgeneral_redrawWindow(PyObject *self, PyObject *args) {
+Dock_close(dock_DockObject *self, PyObject *args) {
+    /* Destroy the window. Closing the last dock closes the display. */
     if (!PyArg_ParseTuple(args, ""))
         return NULL;
-    RedrawWindow();
+    if (self->dock.open)
+        closeXwindow(&self->dock);
     Py_INCREF(Py_None);
     return Py_None;
 }
 
 static PyObject *
-pywmgeneral_redrawWindowXY(PyObject *self, PyObject *args) {
+Dock_redrawWindow(dock_DockObject *self, PyObject *args) {
+    if (!PyArg_ParseTuple(args, ""))
+        return NULL;
+    if (!Dock_check(self))
+        return NULL;
+    RedrawWindow(&self->dock);
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
+static PyObject *
+Dock_redrawWindowXY(dock_DockObject *self, PyObject *args) {
     int x, y;
     if (!PyArg_ParseTuple(args, "ii",  &x, &y))
         return NULL;
-    RedrawWindowXY(x, y);
+    if (!Dock_check(self))
+        return NULL;
+    RedrawWindowXY(&self->dock, x, y);
     Py_INCREF(Py_None);
     return Py_None;
 }
 
 static PyObject *
-pywmgeneral_addMouseRegion(PyObject *self, PyObject *args) {
+Dock_addMouseRegion(dock_DockObject *self, PyObject *args) {
     int index, left, top, right, bottom;
     if (!PyArg_ParseTuple(args, "iiiii", &index, &left, &top, &right, &bottom))
         return NULL;
-    AddMouseRegion(index, left, top, right, bottom);
+    AddMouseRegion(&self->dock, index, left, top, right, bottom);
     Py_INCREF(Py_None);
     return Py_None;
 }
 
 static PyObject *
-pywmgeneral_checkMouseRegion(PyObject *self, PyObject *args) {
+Dock_checkMouseRegion(dock_DockObject *self, PyObject *args) {
     int x, y;
     if (!PyArg_ParseTuple(args, "ii", &x, &y))
         return NULL;
-    return Py_BuildValue("i", CheckMouseRegion(x, y));
+    return Py_BuildValue("i", CheckMouseRegion(&self->dock, x, y));
 }
 
 static PyObject *
-pywmgeneral_copyXPMArea(PyObject *self, PyObject *args) {
+Dock_copyXPMArea(dock_DockObject *self, PyObject *args) {
     /* sx - source x,      sy - source y
      * sw - width,         sw - height
      * dx - destination x, dy - destination y
@@ -175,43 +406,106 @@ pywmgeneral_copyXPMArea(PyObject *self, PyObject *args) {
     int sx, sy, sw, sh, dx, dy;
     if (!PyArg_ParseTuple(args, "iiiiii", &sx, &sy, &sw, &sh, &dx, &dy))
         return NULL;
-    copyXPMArea(sx, sy, sw, sh, dx, dy);
+    if (!Dock_check(self))
+        return NULL;
+    copyXPMArea(&self->dock, sx, sy, sw, sh, dx, dy);
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
+static PyObject *
+Dock_copyXPMAreas(dock_DockObject *self, PyObject *args) {
+    /* Same as copyXPMArea, for a whole batch of areas at once. The argument
+     * is an array('i') or a flat sequence of integers, six per area:
+     * sx, sy, sw, sh, dx, dy.
+     */
+    PyObject *arg;
+    int *areas, *area, count, allocated, i;
+    if (!PyArg_ParseTuple(args, "O", &arg))
+        return NULL;
+    if (!Dock_check(self))
+        return NULL;
+    if (!(areas = pyRectsToInts(arg, &count, &allocated)))
+        return NULL;
+    for (i = 0, area = areas; i < count; i++, area += 6)
+        if (area[2] > 0 && area[3] > 0)
+            copyXPMArea(&self->dock, area[0], area[1], area[2], area[3],
+                        area[4], area[5]);
+    if (allocated)
+        free(areas);
     Py_INCREF(Py_None);
     return Py_None;
 }
 
+static Bool
+isDockEvent(Display *d, XEvent *event, XPointer arg) {
+    /* Events of the dock passed as arg, and also those of windows no dock
+     * knows any more: nobody else would take them out of the queue.
+     */
+    WMDock *dock = (WMDock *)arg, *other;
+    Window w = event->xany.window;
+
+    if (w == dock->win || w == dock->iconwin)
+        return True;
+    for (other = docks; other; other = other->next)
+        if (w == other->win || w == other->iconwin)
+            return False;
+    return True;
+}
+
 static PyObject *
-pywmgeneral_checkForEvents(PyObject *self, PyObject *args) {
+Dock_checkForEvents(dock_DockObject *self, PyObject *args) {
     /* If we find an event we handle, return a dictionary containing some
      * information about it. Return None if there are no events we handle.
      * Ignore events we don't handle. Also we provide a handler for when the
      * window is exposed, redraw it.
+     *
+     * Events of the other docks stay in the queue for them.
      */
+    WMDock *dock = &self->dock;
     XEvent event;
     static char buffer[8];
     int bufsize = 8;
     XComposeStatus dummy;
     KeySym keysym;
-    int count;
+    int count, found;
 
     if (!PyArg_ParseTuple(args, ""))
         return NULL;
-    while (XPending(display)) {
-        XNextEvent(display, &event);
+    if (!Dock_check(self))
+        return NULL;
+    for (;;) {
+        /* this flushes the output and reads what the server sent. */
+        Py_BEGIN_ALLOW_THREADS
+        found = XCheckIfEvent(display, &event, isDockEvent, (XPointer)dock);
+        Py_END_ALLOW_THREADS
+        if (!found)
+            break;
+        if (event.xany.window != dock->win && event.xany.window != dock->iconwin)
+            continue;
         switch(event.type) {
 
         case Expose:
-          RedrawWindow();
+          AddDamage(dock, event.xexpose.x, event.xexpose.y,
+                    event.xexpose.width, event.xexpose.height);
+          RedrawWindow(dock);
+          break;
+
+        case MapNotify:
+        case UnmapNotify:
+        case VisibilityNotify:
+          TrackVisibility(dock, &event);
           break;
 
         case EnterNotify: 
         case LeaveNotify:
           /* needed by KeyPress/release, otherwise events go to parent. */
-          XSetInputFocus(display, PointerRoot, RevertToParent, CurrentTime);
+          if (dock->event_mask & KeyPressMask)
+              XSetInputFocus(display, PointerRoot, RevertToParent, CurrentTime);
           break; 
 
         case KeyPress:
-            count = XLookupString((XKeyEvent*)&event, buffer, bufsize, &keysym, &dummy);
+            count = XLookupString((XKeyEvent*)&event, buffer, bufsize - 1, &keysym, &dummy);
             buffer[count] = '\0';
             
             return Py_BuildValue("{s:s,s:i,s:i,s:s}", 
@@ -229,14 +523,16 @@ pywmgeneral_checkForEvents(PyObject *self, PyObject *args) {
 
         case ClientMessage:
           if((Atom)event.xclient.data.l[0] == deleteAtom) {
-            XCloseDisplay(display);
+            closeXwindow(dock);
             return Py_BuildValue("{s:s}", "type", "destroynotify");
           }
           break;
 
         case DestroyNotify:
           /* This seems to never happen, why? */
-          XCloseDisplay(display);
+          if (event.xdestroywindow.window == dock->win)
+              dock->win = None;
+          closeXwindow(dock);
           return Py_BuildValue("{s:s}", "type", "destroynotify");
 
         }
@@ -245,13 +541,472 @@ pywmgeneral_checkForEvents(PyObject *self, PyObject *args) {
     return Py_None;
 }
 
+/*
+ * Event records, as returned by getEvents: a struct sequence, with the
+ * type as one of a few interned strings.  fields that do not apply to the
+ * type of the event are None.  event['x'] works as event.x, like with the
+ * dictionaries of checkForEvents.
+ */
+
+#define EVENT_FIELDS 7
+#define EVENT_ITEM(op, i) (((PyStructSequence *)(op))->ob_item[i])
+
+static PyStructSequence_Field event_fields[] = {
+    {"type", "buttonpress, buttonrelease, keypress, motionnotify or destroynotify"},
+    {"button", "the mouse button, or the characters of a keypress"},
+    {"x", "horizontal pointer position in the window"},
+    {"y", "vertical pointer position in the window"},
+    {"state", "the modifier keys and mouse buttons held down"},
+    {"keycode", "the key of a keypress"},
+    {"count", "the number of motion events merged into this one"},
+    {NULL}
+};
+
+static PyStructSequence_Desc event_desc = {
+    "pywmgeneral.Event",
+    "An X event, see getEvents.",
+    event_fields,
+    EVENT_FIELDS,
+};
+
+static PyTypeObject EventType;
+static PyMappingMethods Event_as_mapping;
+static binaryfunc structseq_subscript;
+
+static PyObject *type_buttonpress, *type_buttonrelease, *type_keypress;
+static PyObject *type_motionnotify, *type_destroynotify;
+
+static PyObject *
+Event_subscript(PyObject *self, PyObject *key) {
+    /* the dictionary keys are the names of the fields. */
+    int i;
+    if (!PyString_Check(key))
+        return structseq_subscript(self, key);
+    for (i = 0; i < EVENT_FIELDS; i++)
+        if (!strcmp(PyString_AS_STRING(key), event_fields[i].name)) {
+            Py_INCREF(EVENT_ITEM(self, i));
+            return EVENT_ITEM(self, i);
+        }
+    PyErr_SetObject(PyExc_KeyError, key);
+    return NULL;
+}
+
+static PyObject *
+newEvent(PyObject *type) {
+    /* A record of the given type, all other fields None. */
+    PyObject *event;
+    int i;
+    if (!(event = PyStructSequence_New(&EventType)))
+        return NULL;
+    Py_INCREF(type);
+    PyStructSequence_SET_ITEM(event, 0, type);
+    for (i = 1; i < EVENT_FIELDS; i++) {
+        Py_INCREF(Py_None);
+        PyStructSequence_SET_ITEM(event, i, Py_None);
+    }
+    return event;
+}
+
+static int
+setEventField(PyObject *event, int i, PyObject *value) {
+    /* Steal value, a new reference, return -1 if it is NULL. Only for
+     * records not handed to Python code yet.
+     */
+    if (!value)
+        return -1;
+    Py_DECREF(EVENT_ITEM(event, i));
+    PyStructSequence_SET_ITEM(event, i, value);
+    return 0;
+}
+
+static PyObject *
+Dock_getEvents(dock_DockObject *self, PyObject *args) {
+    /* Take all pending events of the dock at once, return a list of Event
+     * records, empty if there are none. Exposures are handled here and
+     * events we don't report are skipped, as by checkForEvents. Motion
+     * events in a row come as one, the last, with their count.
+     */
+    WMDock *dock = &self->dock;
+    XEvent event;
+    char buffer[8];
+    int bufsize = 8;
+    XComposeStatus dummy;
+    KeySym keysym;
+    int count, found, failed;
+    PyObject *result, *record, *motion = NULL;
+
+    if (!PyArg_ParseTuple(args, ""))
+        return NULL;
+    if (!Dock_check(self))
+        return NULL;
+    if (!(result = PyList_New(0)))
+        return NULL;
+    while (dock->open) {
+        Py_BEGIN_ALLOW_THREADS
+        found = XCheckIfEvent(display, &event, isDockEvent, (XPointer)dock);
+        Py_END_ALLOW_THREADS
+        if (!found)
+            break;
+        if (event.xany.window != dock->win && event.xany.window != dock->iconwin)
+            continue;
+        record = NULL;
+        failed = 0;
+        switch(event.type) {
+
+        case Expose:
+          AddDamage(dock, event.xexpose.x, event.xexpose.y,
+                    event.xexpose.width, event.xexpose.height);
+          RedrawWindow(dock);
+          break;
+
+        case MapNotify:
+        case UnmapNotify:
+        case VisibilityNotify:
+          TrackVisibility(dock, &event);
+          break;
+
+        case EnterNotify: 
+        case LeaveNotify:
+          /* needed by KeyPress/release, otherwise events go to parent. */
+          if (dock->event_mask & KeyPressMask)
+              XSetInputFocus(display, PointerRoot, RevertToParent, CurrentTime);
+          break; 
+
+        case MotionNotify:
+          if (motion) {
+              /* not a new record: the pointer just moved further. */
+              failed = setEventField(motion, 2, PyInt_FromLong(event.xmotion.x)) ||
+                       setEventField(motion, 3, PyInt_FromLong(event.xmotion.y)) ||
+                       setEventField(motion, 4, PyInt_FromLong(event.xmotion.state)) ||
+                       setEventField(motion, 6, PyInt_FromLong(
+                                     PyInt_AS_LONG(EVENT_ITEM(motion, 6)) + 1));
+              break;
+          }
+          if (!(record = newEvent(type_motionnotify)))
+              break;
+          failed = setEventField(record, 2, PyInt_FromLong(event.xmotion.x)) ||
+                   setEventField(record, 3, PyInt_FromLong(event.xmotion.y)) ||
+                   setEventField(record, 4, PyInt_FromLong(event.xmotion.state)) ||
+                   setEventField(record, 6, PyInt_FromLong(1));
+          break;
+
+        case KeyPress:
+          count = XLookupString((XKeyEvent*)&event, buffer, bufsize - 1, &keysym, &dummy);
+          buffer[count] = '\0';
+          if (!(record = newEvent(type_keypress)))
+              break;
+          failed = setEventField(record, 1, PyString_FromString(buffer)) ||
+                   setEventField(record, 2, PyInt_FromLong(event.xkey.x)) ||
+                   setEventField(record, 3, PyInt_FromLong(event.xkey.y)) ||
+                   setEventField(record, 4, PyInt_FromLong(event.xkey.state)) ||
+                   setEventField(record, 5, PyInt_FromLong(event.xkey.keycode));
+          break;
+
+        case ButtonPress:
+        case ButtonRelease:
+          if (!(record = newEvent(event.type == ButtonPress ?
+                                  type_buttonpress : type_buttonrelease)))
+              break;
+          failed = setEventField(record, 1, PyInt_FromLong(event.xbutton.button)) ||
+                   setEventField(record, 2, PyInt_FromLong(event.xbutton.x)) ||
+                   setEventField(record, 3, PyInt_FromLong(event.xbutton.y)) ||
+                   setEventField(record, 4, PyInt_FromLong(event.xbutton.state));
+          break;
+
+        case ClientMessage:
+          if((Atom)event.xclient.data.l[0] == deleteAtom) {
+            closeXwindow(dock);
+            record = newEvent(type_destroynotify);
+          }
+          break;
+
+        case DestroyNotify:
+          if (event.xdestroywindow.window == dock->win)
+              dock->win = None;
+          closeXwindow(dock);
+          record = newEvent(type_destroynotify);
+          break;
+
+        }
+        if (record) {
+            if (!failed)
+                failed = PyList_Append(result, record);
+            Py_DECREF(record);
+            motion = event.type == MotionNotify ? record : NULL;
+        }
+        if (failed || PyErr_Occurred()) {
+            Py_DECREF(result);
+            return NULL;
+        }
+    }
+    return result;
+}
+
+static PyObject *
+Dock_isVisible(dock_DockObject *self, PyObject *args) {
+    /* As seen in the events handled so far. */
+    if (!PyArg_ParseTuple(args, ""))
+        return NULL;
+    return PyBool_FromLong(IsVisible(&self->dock));
+}
+
+static PyObject *
+Dock_setEventMask(dock_DockObject *self, PyObject *args) {
+    /* Report only the given types of events from now on, all for None.
+     * Events of other types that are queued already still come.
+     */
+    PyObject *events;
+    long mask;
+    if (!PyArg_ParseTuple(args, "O", &events))
+        return NULL;
+    if (!Dock_check(self))
+        return NULL;
+    if ((mask = eventMask(events)) == -1)
+        return NULL;
+    if (mask != self->dock.event_mask) {
+        self->dock.event_mask = mask;
+        if (self->dock.win != None)
+            XSelectInput(display, self->dock.win, mask);
+        XSelectInput(display, self->dock.iconwin, mask);
+    }
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
+static PyObject *
+Dock_connectionNumber(dock_DockObject *self, PyObject *args) {
+    /* The file descriptor of the X connection, to be used with select. It
+     * is the same for all docks.
+     */
+    if (!PyArg_ParseTuple(args, ""))
+        return NULL;
+    if (!display) {
+        PyErr_SetString(PyExc_RuntimeError, "X client must be initialized first.");
+        return NULL;
+    }
+    return Py_BuildValue("i", x_fd);
+}
+
+static PyObject *
+Dock_pendingEvents(dock_DockObject *self, PyObject *args) {
+    /* Flush the output buffer and return the number of events that can be
+     * read without blocking. Events already sitting in the Xlib queue are
+     * not visible on x_fd, so callers must check this before they select.
+     * The count is for the whole connection, all docks together.
+     */
+    int pending;
+    if (!PyArg_ParseTuple(args, ""))
+        return NULL;
+    if (!display) {
+        PyErr_SetString(PyExc_RuntimeError, "X client must be initialized first.");
+        return NULL;
+    }
+    Py_BEGIN_ALLOW_THREADS
+    pending = XPending(display);
+    Py_END_ALLOW_THREADS
+    return Py_BuildValue("i", pending);
+}
+
+static double
+monotonic(void) {
+    struct timespec now;
+    clock_gettime(CLOCK_MONOTONIC, &now);
+    return now.tv_sec + now.tv_nsec / 1e9;
+}
+
+static PyObject *
+Dock_waitForEvent(dock_DockObject *self, PyObject *args) {
+    /* Flush the output buffer and wait until there are events or timeout
+     * seconds passed, forever if timeout is None. Return the number of
+     * pending events, 0 if the time ran out or a signal arrived. Other
+     * threads run meanwhile. Like pendingEvents, this is for the whole
+     * connection.
+     */
+    PyObject *timeoutObj = Py_None;
+    double timeout = -1, deadline = 0;
+    struct pollfd pfd;
+    int pending, ms, ready;
+    if (!PyArg_ParseTuple(args, "|O", &timeoutObj))
+        return NULL;
+    if (timeoutObj != Py_None) {
+        timeout = PyFloat_AsDouble(timeoutObj);
+        if (timeout == -1 && PyErr_Occurred())
+            return NULL;
+        if (timeout < 0)
+            timeout = 0;
+    }
+    if (!display) {
+        PyErr_SetString(PyExc_RuntimeError, "X client must be initialized first.");
+        return NULL;
+    }
+    pfd.fd = x_fd;
+    pfd.events = POLLIN;
+    Py_BEGIN_ALLOW_THREADS
+    if (timeout >= 0)
+        deadline = monotonic() + timeout;
+    /* the connection may be readable with no whole event in it yet. */
+    while (!(pending = XPending(display))) {
+        ms = -1;
+        if (timeout >= 0) {
+            ms = (int)((deadline - monotonic()) * 1000 + 0.999);
+            if (ms <= 0)
+                break;
+        }
+        ready = poll(&pfd, 1, ms);
+        if (ready < 0 || (ready == 0 && ms != -1 && monotonic() >= deadline))
+            break;
+    }
+    Py_END_ALLOW_THREADS
+    if (PyErr_CheckSignals() < 0)
+        return NULL;
+    return Py_BuildValue("i", pending);
+}
+
+static PyObject *Dock_drawString(dock_DockObject *, PyObject *);
+
+static PyObject *
+Dock_Drawable(dock_DockObject *self, PyObject *args) {
+    /* Drawable(w, h) of this dock. */
+    int w, h;
+    if (!PyArg_ParseTuple(args, "ii", &w, &h))
+        return NULL;
+    return PyObject_CallFunction((PyObject *)&drawable_DrawableType, "iiO",
+                                 w, h, self);
+}
+
+static PyObject *
+Dock_Image(dock_DockObject *self, PyObject *args) {
+    /* Image(w, h) of this dock. */
+    int w, h;
+    if (!PyArg_ParseTuple(args, "ii", &w, &h))
+        return NULL;
+    return PyObject_CallFunction((PyObject *)&image_ImageType, "iiO",
+                                 w, h, self);
+}
+
+static PyMethodDef Dock_methods[] = {
+    {"openXwindow", (PyCFunction)Dock_openXwindow, METH_VARARGS,
+        "Open the X window containing everything."},
+    {"close", (PyCFunction)Dock_close, METH_VARARGS,
+        "Destroy the X window, the last dock also closes the display."},
+    {"includePixmap", (PyCFunction)Dock_includePixmap, METH_VARARGS,
+        "Set the pixmap that will be used as a mask and for everything else."},
+    {"redrawWindow", (PyCFunction)Dock_redrawWindow, METH_VARARGS,
+        "Redraw the parts of the window changed since the last redraw."},
+    {"redrawWindowXY", (PyCFunction)Dock_redrawWindowXY, METH_VARARGS,
+        "Redraw a give region of the window."},
+    {"addMouseRegion", (PyCFunction)Dock_addMouseRegion, METH_VARARGS,
+        "Add a mouse region with a given index."},
+    {"checkMouseRegion", (PyCFunction)Dock_checkMouseRegion, METH_VARARGS,
+        "Check if the given coordinates are in any mouse region."},
+    {"copyXPMArea", (PyCFunction)Dock_copyXPMArea, METH_VARARGS,
+        "Copy an area of the XPM."},
+    {"copyXPMAreas", (PyCFunction)Dock_copyXPMAreas, METH_VARARGS,
+        "Copy a batch of areas of the XPM."},
+    {"drawString", (PyCFunction)Dock_drawString, METH_VARARGS,
+        "Paint a string using a glyph table, return its width."},
+    {"checkForEvents", (PyCFunction)Dock_checkForEvents, METH_VARARGS,
+        "Check for some Xevents of this dock"},
+    {"getEvents", (PyCFunction)Dock_getEvents, METH_VARARGS,
+        "Return the list of all pending events of this dock."},
+    {"setEventMask", (PyCFunction)Dock_setEventMask, METH_VARARGS,
+        "Select the types of events to report for this dock."},
+    {"isVisible", (PyCFunction)Dock_isVisible, METH_VARARGS,
+        "Return whether the window of this dock can be seen."},
+    {"connectionNumber", (PyCFunction)Dock_connectionNumber, METH_VARARGS,
+        "Return the file descriptor of the X connection."},
+    {"pendingEvents", (PyCFunction)Dock_pendingEvents, METH_VARARGS,
+        "Flush the X connection and return the number of pending events."},
+    {"waitForEvent", (PyCFunction)Dock_waitForEvent, METH_VARARGS,
+        "Wait for X events, at most timeout seconds, releasing the GIL."},
+    {"Drawable", (PyCFunction)Dock_Drawable, METH_VARARGS,
+        "Create a Drawable of this dock."},
+    {"Image", (PyCFunction)Dock_Image, METH_VARARGS,
+        "Create an Image of this dock."},
+    {NULL}  /* Sentinel */
+};
+
+static PyTypeObject dock_DockType = {
+    PyObject_HEAD_INIT(NULL)
+    0,                         /*ob_size*/
+    "pywmgeneral.Dock",        /*tp_name*/
+    sizeof(dock_DockObject),   /*tp_basicsize*/
+    0,                         /*tp_itemsize*/
+    (destructor)Dock_dealloc,  /*tp_dealloc*/
+    0,                         /*tp_print*/
+    0,                         /*tp_getattr*/
+    0,                         /*tp_setattr*/
+    0,                         /*tp_compare*/
+    0,                         /*tp_repr*/
+    0,                         /*tp_as_number*/
+    0,                         /*tp_as_sequence*/
+    0,                         /*tp_as_mapping*/
+    0,                         /*tp_hash */
+    0,                         /*tp_call*/
+    0,                         /*tp_str*/
+    0,                         /*tp_getattro*/
+    0,                         /*tp_setattro*/
+    0,                         /*tp_as_buffer*/
+    Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE, /*tp_flags*/
+    "Dock objects",            /* tp_doc */
+    0,		               /* tp_traverse */
+    0,		               /* tp_clear */
+    0,		               /* tp_richcompare */
+    offsetof(dock_DockObject, weakreflist), /* tp_weaklistoffset */
+    0,		               /* tp_iter */
+    0,		               /* tp_iternext */
+    Dock_methods,              /* tp_methods */
+    0,                         /* tp_members */
+    0,                         /* tp_getset */
+    0,                         /* tp_base */
+    0,                         /* tp_dict */
+    0,                         /* tp_descr_get */
+    0,                         /* tp_descr_set */
+    0,                         /* tp_dictoffset */
+    0,                         /* tp_init */
+    0,                         /* tp_alloc */
+    PyType_GenericNew,         /* tp_new */
+};
+
+/*
+ * end of class Dock
+ *
+ */
+
+/* The module level functions are those of the default dock. */
+#define DEFAULT_DOCK_FUNCTION(name)                             \
+static PyObject *                                               \
+pywmgeneral_##name(PyObject *self, PyObject *args) {            \
+    dock_DockObject *dock = defaultDock();                      \
+    if (!dock)                                                  \
+        return NULL;                                            \
+    return Dock_##name(dock, args);                             \
+}
+
+DEFAULT_DOCK_FUNCTION(includePixmap)
+DEFAULT_DOCK_FUNCTION(openXwindow)
+DEFAULT_DOCK_FUNCTION(redrawWindow)
+DEFAULT_DOCK_FUNCTION(redrawWindowXY)
+DEFAULT_DOCK_FUNCTION(addMouseRegion)
+DEFAULT_DOCK_FUNCTION(checkMouseRegion)
+DEFAULT_DOCK_FUNCTION(copyXPMArea)
+DEFAULT_DOCK_FUNCTION(copyXPMAreas)
+DEFAULT_DOCK_FUNCTION(drawString)
+DEFAULT_DOCK_FUNCTION(checkForEvents)
+DEFAULT_DOCK_FUNCTION(getEvents)
+DEFAULT_DOCK_FUNCTION(setEventMask)
+DEFAULT_DOCK_FUNCTION(isVisible)
+DEFAULT_DOCK_FUNCTION(connectionNumber)
+DEFAULT_DOCK_FUNCTION(pendingEvents)
+DEFAULT_DOCK_FUNCTION(waitForEvent)
+
 static PyMethodDef PyWmgeneralMethods[] = {
     {"openXwindow", pywmgeneral_openXwindow, METH_VARARGS,
         "Open the X window containing everything."},
     {"includePixmap", pywmgeneral_includePixmap, METH_VARARGS,
         "Set the global pixmap that will be used as a mask and for everything else."},
     {"redrawWindow", pywmgeneral_redrawWindow, METH_VARARGS,
-        "Redraw the window."},
+        "Redraw the parts of the window changed since the last redraw."},
     {"redrawWindowXY", pywmgeneral_redrawWindowXY, METH_VARARGS,
         "Redraw a give region of the window."},
     {"addMouseRegion", pywmgeneral_addMouseRegion, METH_VARARGS,
@@ -260,8 +1015,24 @@ static PyMethodDef PyWmgeneralMethods[] = {
         "Check if the given coordinates are in any mouse region."},
     {"copyXPMArea", pywmgeneral_copyXPMArea, METH_VARARGS,
         "Copy an area of the global XPM."},
+    {"copyXPMAreas", pywmgeneral_copyXPMAreas, METH_VARARGS,
+        "Copy a batch of areas of the global XPM."},
+    {"drawString", pywmgeneral_drawString, METH_VARARGS,
+        "Paint a string using a glyph table, return its width."},
     {"checkForEvents", pywmgeneral_checkForEvents, METH_VARARGS,
         "Check for some Xevents"},
+    {"getEvents", pywmgeneral_getEvents, METH_VARARGS,
+        "Return the list of all pending events."},
+    {"setEventMask", pywmgeneral_setEventMask, METH_VARARGS,
+        "Select the types of events to report."},
+    {"isVisible", pywmgeneral_isVisible, METH_VARARGS,
+        "Return whether the window can be seen."},
+    {"connectionNumber", pywmgeneral_connectionNumber, METH_VARARGS,
+        "Return the file descriptor of the X connection."},
+    {"pendingEvents", pywmgeneral_pendingEvents, METH_VARARGS,
+        "Flush the X connection and return the number of pending events."},
+    {"waitForEvent", pywmgeneral_waitForEvent, METH_VARARGS,
+        "Wait for X events, at most timeout seconds, releasing the GIL."},
     {NULL, NULL, 0, NULL}
 };
 
@@ -276,6 +1047,8 @@ typedef struct {
     int has_drawable;
     Pixmap drawable;
     int width, height;
+    dock_DockObject *dock;
+    unsigned long generation;    /* of the display holding the pixmap */
 } drawable_DrawableObject;
 
 static PyObject *
@@ -288,29 +1061,49 @@ Drawable_new(PyTypeObject *type, PyObject *args, PyObject *kwds)
       self->has_drawable = 0;
       self->width = 0;
       self->height = 0;
+      self->dock = NULL;
   }
   
   return (PyObject *)self;
 }
 
+static dock_DockObject *
+dockArgument(PyObject *dock)
+{
+    /* The dock given to a Drawable or an Image, the default one for None. */
+    if (dock == NULL || dock == Py_None)
+        dock = (PyObject *)defaultDock();
+    else if (!PyObject_TypeCheck(dock, &dock_DockType)) {
+        PyErr_SetString(PyExc_TypeError, "Dock expected.");
+        return NULL;
+    }
+    if (dock == NULL || !Dock_check((dock_DockObject *)dock))
+        return NULL;
+    Py_INCREF(dock);
+    return (dock_DockObject *)dock;
+}
+
 static int
 Drawable_init(drawable_DrawableObject *self, PyObject *args, PyObject *kwds)
 {
     unsigned int w, h;
-    if (! PyArg_ParseTuple(args, "ii", &w, &h))
+    PyObject *dockArg = NULL;
+    dock_DockObject *dock;
+    if (! PyArg_ParseTuple(args, "ii|O", &w, &h, &dockArg))
         return -1; 
-    if (!wmgen.attributes.depth) {
-        PyErr_SetString(PyExc_RuntimeError, "X client must be initialized first.");
+    if (!(dock = dockArgument(dockArg)))
         return -1;
-    }
 
-    if (self->has_drawable)
+    if (self->has_drawable && ON_DISPLAY(self->generation))
         XFreePixmap(display, self->drawable);
+    Py_XDECREF(self->dock);
+    self->dock = dock;
     self->has_drawable = 1;
+    self->generation = display_generation;
     self->width = w;
     self->height = h;
-    self->drawable = XCreatePixmap(display, wmgen.pixmap, 
-                                   w, h, wmgen.attributes.depth);
+    self->drawable = XCreatePixmap(display, dock->dock.wmgen.pixmap, 
+                                   w, h, dock->dock.wmgen.attributes.depth);
 
     return 0;
 }
@@ -318,8 +1111,21 @@ Drawable_init(drawable_DrawableObject *self, PyObject *args, PyObject *kwds)
 static void
 Drawable_dealloc(drawable_DrawableObject *self)
 {
-    if (self->has_drawable)
+    /* the display outlives the dock while other docks are open. */
+    if (self->has_drawable && ON_DISPLAY(self->generation))
         XFreePixmap(display, self->drawable);
+    Py_XDECREF(self->dock);
+    self->ob_type->tp_free((PyObject *)self);
+}
+
+static int
+Drawable_check(drawable_DrawableObject *self)
+{
+    if (!self->has_drawable) {
+        PyErr_SetString(PyExc_RuntimeError, "Drawable not initialized.");
+        return 0;
+    }
+    return Dock_check(self->dock);
 }
 
 static PyObject *
@@ -328,9 +1134,13 @@ Drawable_xCopyAreaToWindow(drawable_DrawableObject *self, PyObject *args, PyObje
     unsigned int src_x, src_y, width, height, dst_x, dst_y;
     if (! PyArg_ParseTuple(args, "iiiiii", &src_x, &src_y, &width, &height, &dst_x, &dst_y))
         return NULL; 
+    if (!Drawable_check(self))
+        return NULL;
 
-    XCopyArea(display, self->drawable, wmgen.pixmap, NormalGC,
+    XCopyArea(display, self->drawable, self->dock->dock.wmgen.pixmap,
+              self->dock->dock.NormalGC,
               src_x, src_y, width, height, dst_x, dst_y);
+    AddDamage(&self->dock->dock, dst_x, dst_y, width, height);
 
     Py_INCREF(Py_None);
     return Py_None;
@@ -339,7 +1149,9 @@ Drawable_xCopyAreaToWindow(drawable_DrawableObject *self, PyObject *args, PyObje
 static PyObject *
 Drawable_xClear(drawable_DrawableObject *self, PyObject *args, PyObject *kwds)
 {
-    XFillRectangle(display, self->drawable, NormalGC, 
+    if (!Drawable_check(self))
+        return NULL;
+    XFillRectangle(display, self->drawable, self->dock->dock.NormalGC, 
                    0, 0, self->width, self->height);
 
     Py_INCREF(Py_None);
@@ -352,15 +1164,44 @@ Drawable_xCopyAreaFromWindow(drawable_DrawableObject *self, PyObject *args, PyOb
     unsigned int src_x, src_y, width, height, dst_x, dst_y;
     if (! PyArg_ParseTuple(args, "iiiiii", &src_x, &src_y, &width, &height, &dst_x, &dst_y))
         return NULL; 
+    if (!Drawable_check(self))
+        return NULL;
 
-    XCopyArea(display, wmgen.pixmap, self->drawable, NormalGC,
+    XCopyArea(display, self->dock->dock.wmgen.pixmap, self->drawable,
+              self->dock->dock.NormalGC,
               src_x, src_y, width, height, dst_x, dst_y);
 
     Py_INCREF(Py_None);
     return Py_None;
 }
 
+static PyObject *
+Drawable_xCopyAreasFromWindow(drawable_DrawableObject *self, PyObject *args, PyObject *kwds)
+{
+    PyObject *arg;
+    int *areas, *area, count, allocated, i;
+    if (! PyArg_ParseTuple(args, "O", &arg))
+        return NULL;
+    if (!Drawable_check(self))
+        return NULL;
+    if (!(areas = pyRectsToInts(arg, &count, &allocated)))
+        return NULL;
+
+    for (i = 0, area = areas; i < count; i++, area += 6)
+        if (area[2] > 0 && area[3] > 0)
+            XCopyArea(display, self->dock->dock.wmgen.pixmap, self->drawable,
+                      self->dock->dock.NormalGC,
+                      area[0], area[1], area[2], area[3], area[4], area[5]);
+    if (allocated)
+        free(areas);
+
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
 static PyMemberDef Drawable_members[] = {
+    {"dock", T_OBJECT, offsetof(drawable_DrawableObject, dock), READONLY,
+     "the Dock this drawable belongs to"},
     {NULL}  /* Sentinel */
 };
 
@@ -368,6 +1209,9 @@ static PyMethodDef Drawable_methods[] = {
     {"xCopyAreaFromWindow", (PyCFunction)Drawable_xCopyAreaFromWindow, METH_VARARGS,
      "copy from the drawable to the global pixmap"
     },
+    {"xCopyAreasFromWindow", (PyCFunction)Drawable_xCopyAreasFromWindow, METH_VARARGS,
+     "copy a batch of areas from the global pixmap into the drawable"
+    },
     {"xCopyAreaToWindow", (PyCFunction)Drawable_xCopyAreaToWindow, METH_VARARGS,
      "copy from the global pixmap into the drawable"
     },
@@ -380,7 +1224,7 @@ static PyMethodDef Drawable_methods[] = {
 static PyTypeObject drawable_DrawableType = {
     PyObject_HEAD_INIT(NULL)
     0,                         /*ob_size*/
-    "pyywmgeneral.Drawable",             /*tp_name*/
+    "pywmgeneral.Drawable",             /*tp_name*/
     sizeof(drawable_DrawableObject),             /*tp_basicsize*/
     0,                         /*tp_itemsize*/
     (destructor)Drawable_dealloc, /*tp_dealloc*/
@@ -424,23 +1268,474 @@ static PyTypeObject drawable_DrawableType = {
  *
  */
 
-/*****************************************************************************/
-/* Original C sources (With some modifications)                              */
-/*****************************************************************************/
-
-  /*****************/
- /* Mouse Regions */
-/*****************/
+/*
+ * here comes the definition of the class Image
+ *
+ * an Image is a client side array of pixels in the format of the screen.
+ * python code writes into it through the buffer interface (or its 'data'
+ * memoryview), and put() sends it to the global pixmap.  when the X server
+ * runs on the same machine and supports the MIT-SHM extension, the pixels
+ * live in shared memory and put() costs no copy through the socket;
+ * otherwise plain XPutImage is used.
+ */
 
 typedef struct {
-    int        enable;
-    int        top;
-    int        bottom;
-    int        left;
-    int        right;
-} MOUSE_REGION;
+    PyObject_HEAD
+    /* Type-specific fields go here. */
+    XImage *image;
+    XShmSegmentInfo shminfo;
+    int shared;
+    int width, height, bytes_per_line, bits_per_pixel;
+    dock_DockObject *dock;
+    unsigned long generation;    /* of the display the segment is attached to */
+} image_ImageObject;
+
+static int shmError;
+
+static int
+trapShmError(Display *d, XErrorEvent *e)
+{
+    shmError = 1;
+    return 0;
+}
+
+static int
+canUseShm(void)
+{
+    /* Shared memory only works if client and server share the machine,
+     * that is with display names like ":0" or "unix:0".
+     */
+    char *name = DisplayString(display);
+    if (name[0] != ':' && strncmp(name, "unix:", 5))
+        return 0;
+    return XShmQueryExtension(display);
+}
+
+static XImage *
+createShmImage(image_ImageObject *self, Visual *visual, int depth, int w, int h)
+{
+    XImage *image;
+    int (*oldHandler)(Display *, XErrorEvent *);
+
+    image = XShmCreateImage(display, visual, depth, ZPixmap,
+                            NULL, &self->shminfo, w, h);
+    if (!image)
+        return NULL;
+    self->shminfo.shmid = shmget(IPC_PRIVATE, image->bytes_per_line * h,
+                                 IPC_CREAT | 0600);
+    if (self->shminfo.shmid < 0) {
+        XDestroyImage(image);
+        return NULL;
+    }
+    self->shminfo.shmaddr = image->data = shmat(self->shminfo.shmid, NULL, 0);
+    self->shminfo.readOnly = False;
+    shmError = (self->shminfo.shmaddr == (char *)-1);
+    if (!shmError) {
+        /* the server may still refuse, e.g. through a forwarded socket. */
+        XSync(display, False);
+        oldHandler = XSetErrorHandler(trapShmError);
+        XShmAttach(display, &self->shminfo);
+        XSync(display, False);
+        XSetErrorHandler(oldHandler);
+    }
+    /* the segment goes away as soon as both sides detach from it. */
+    shmctl(self->shminfo.shmid, IPC_RMID, NULL);
+    if (shmError) {
+        if (self->shminfo.shmaddr != (char *)-1)
+            shmdt(self->shminfo.shmaddr);
+        image->data = NULL;
+        XDestroyImage(image);
+        return NULL;
+    }
+    return image;
+}
+
+static int
+Image_init(image_ImageObject *self, PyObject *args, PyObject *kwds)
+{
+    int w, h, depth;
+    Visual *visual;
+    char *data;
+    PyObject *dockArg = NULL;
+
+    if (!PyArg_ParseTuple(args, "ii|O", &w, &h, &dockArg))
+        return -1;
+    if (w <= 0 || h <= 0) {
+        PyErr_SetString(PyExc_ValueError, "Image size must be positive.");
+        return -1;
+    }
+    if (self->image) {
+        PyErr_SetString(PyExc_RuntimeError, "Image already initialized.");
+        return -1;
+    }
+    if (!(self->dock = dockArgument(dockArg)))
+        return -1;
+    self->generation = display_generation;
+
+    depth = self->dock->dock.wmgen.attributes.depth;
+    visual = DefaultVisual(display, screen);
+    if (canUseShm() && (self->image = createShmImage(self, visual, depth, w, h)))
+        self->shared = 1;
+    else {
+        self->image = XCreateImage(display, visual, depth,
+                                   ZPixmap, 0, NULL, w, h, 32, 0);
+        if (!self->image) {
+            PyErr_SetString(PyExc_RuntimeError, "can't create image.");
+            return -1;
+        }
+        if (!(data = calloc(self->image->bytes_per_line, h))) {
+            XDestroyImage(self->image);
+            self->image = NULL;
+            PyErr_NoMemory();
+            return -1;
+        }
+        self->image->data = data;
+    }
+    self->width = w;
+    self->height = h;
+    self->bytes_per_line = self->image->bytes_per_line;
+    self->bits_per_pixel = self->image->bits_per_pixel;
+    return 0;
+}
+
+static void
+Image_dealloc(image_ImageObject *self)
+{
+    if (self->image) {
+        if (self->shared) {
+            if (ON_DISPLAY(self->generation))
+                XShmDetach(display, &self->shminfo);
+            shmdt(self->shminfo.shmaddr);
+            self->image->data = NULL;
+        }
+        XDestroyImage(self->image);
+    }
+    Py_XDECREF(self->dock);
+    self->ob_type->tp_free((PyObject *)self);
+}
+
+static int
+Image_check(image_ImageObject *self)
+{
+    if (!self->image) {
+        PyErr_SetString(PyExc_RuntimeError, "Image not initialized.");
+        return 0;
+    }
+    return 1;
+}
+
+static int
+Image_checkDock(image_ImageObject *self)
+{
+    return Image_check(self) && Dock_check(self->dock);
+}
+
+static PyObject *
+Image_put(image_ImageObject *self, PyObject *args)
+{
+    /* sx, sy, w, h - area of the image
+     * dx, dy       - where to put it in the pixmap of the dock
+     */
+    WMDock *dock;
+    int sx, sy, w, h, dx, dy;
+    if (!PyArg_ParseTuple(args, "iiiiii", &sx, &sy, &w, &h, &dx, &dy))
+        return NULL;
+    if (!Image_checkDock(self))
+        return NULL;
+    dock = &self->dock->dock;
+    /* the server does not clip the source of a PutImage. */
+    if (sx < 0) { w += sx; dx -= sx; sx = 0; }
+    if (sy < 0) { h += sy; dy -= sy; sy = 0; }
+    if (w > self->width - sx) w = self->width - sx;
+    if (h > self->height - sy) h = self->height - sy;
+    if (w > 0 && h > 0) {
+        Py_BEGIN_ALLOW_THREADS
+        if (self->shared) {
+            XShmPutImage(display, dock->wmgen.pixmap, dock->NormalGC,
+                         self->image, sx, sy, dx, dy, w, h, False);
+            /* python may write into the buffer as soon as we return. */
+            XSync(display, False);
+        } else
+            XPutImage(display, dock->wmgen.pixmap, dock->NormalGC,
+                      self->image, sx, sy, dx, dy, w, h);
+        Py_END_ALLOW_THREADS
+        AddDamage(dock, dx, dy, w, h);
+    }
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
+static PyObject *
+Image_get(image_ImageObject *self, PyObject *args)
+{
+    /* fill the whole image from the pixmap of the dock, starting at x, y. */
+    XpmIcon *wmgen;
+    int x, y;
+    if (!PyArg_ParseTuple(args, "ii", &x, &y))
+        return NULL;
+    if (!Image_checkDock(self))
+        return NULL;
+    wmgen = &self->dock->dock.wmgen;
+    if (x < 0 || y < 0 ||
+        x + self->width > wmgen->attributes.width ||
+        y + self->height > wmgen->attributes.height) {
+        PyErr_SetString(PyExc_ValueError, "area outside of the pixmap.");
+        return NULL;
+    }
+    Py_BEGIN_ALLOW_THREADS
+    if (self->shared)
+        XShmGetImage(display, wmgen->pixmap, self->image, x, y, AllPlanes);
+    else
+        XGetSubImage(display, wmgen->pixmap, x, y, self->width, self->height,
+                     AllPlanes, ZPixmap, self->image, 0, 0);
+    Py_END_ALLOW_THREADS
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
+static PyObject *
+Image_pixel(image_ImageObject *self, PyObject *args)
+{
+    /* return the bytes to store in the buffer for the named color. */
+    char *name;
+    XColor color;
+    XWindowAttributes attributes;
+    unsigned long saved;
+    int size, found;
+    PyObject *result;
+
+    if (!PyArg_ParseTuple(args, "s", &name))
+        return NULL;
+    if (!Image_checkDock(self))
+        return NULL;
+    if (self->bits_per_pixel % 8) {
+        PyErr_SetString(PyExc_ValueError, "pixels are not a whole number of bytes.");
+        return NULL;
+    }
+    Py_BEGIN_ALLOW_THREADS
+    XGetWindowAttributes(display, Root, &attributes);
+    found = XParseColor(display, attributes.colormap, name, &color) &&
+            XAllocColor(display, attributes.colormap, &color);
+    Py_END_ALLOW_THREADS
+    if (!found) {
+        PyErr_Format(PyExc_ValueError, "can't allocate color %s.", name);
+        return NULL;
+    }
+    /* let Xlib encode the pixel, in the first position of the image. */
+    size = self->bits_per_pixel / 8;
+    saved = XGetPixel(self->image, 0, 0);
+    XPutPixel(self->image, 0, 0, color.pixel);
+    result = PyString_FromStringAndSize(self->image->data, size);
+    XPutPixel(self->image, 0, 0, saved);
+    return result;
+}
+
+static PyObject *
+Image_getData(image_ImageObject *self, void *closure)
+{
+    if (!Image_check(self))
+        return NULL;
+    return PyMemoryView_FromObject((PyObject *)self);
+}
+
+static Py_ssize_t
+Image_getreadbuffer(image_ImageObject *self, Py_ssize_t segment, void **ptr)
+{
+    if (segment != 0) {
+        PyErr_SetString(PyExc_SystemError, "accessing non-existent segment");
+        return -1;
+    }
+    if (!Image_check(self))
+        return -1;
+    *ptr = self->image->data;
+    return self->bytes_per_line * self->height;
+}
+
+static Py_ssize_t
+Image_getsegcount(image_ImageObject *self, Py_ssize_t *lenp)
+{
+    if (lenp)
+        *lenp = self->image ? self->bytes_per_line * self->height : 0;
+    return 1;
+}
+
+static int
+Image_getbuffer(image_ImageObject *self, Py_buffer *view, int flags)
+{
+    if (!Image_check(self))
+        return -1;
+    return PyBuffer_FillInfo(view, (PyObject *)self, self->image->data,
+                             self->bytes_per_line * self->height, 0, flags);
+}
+
+static PyBufferProcs Image_as_buffer = {
+    (readbufferproc)Image_getreadbuffer,
+    (writebufferproc)Image_getreadbuffer,
+    (segcountproc)Image_getsegcount,
+    (charbufferproc)NULL,
+    (getbufferproc)Image_getbuffer,
+    (releasebufferproc)NULL,
+};
+
+static PyMethodDef Image_methods[] = {
+    {"put", (PyCFunction)Image_put, METH_VARARGS,
+     "copy an area of the image into the pixmap of its dock"
+    },
+    {"get", (PyCFunction)Image_get, METH_VARARGS,
+     "fill the image from the pixmap of its dock"
+    },
+    {"pixel", (PyCFunction)Image_pixel, METH_VARARGS,
+     "the bytes encoding a named color in the image"
+    },
+    {NULL}  /* Sentinel */
+};
+
+static PyMemberDef Image_members[] = {
+    {"width", T_INT, offsetof(image_ImageObject, width), READONLY,
+     "width in pixels"},
+    {"height", T_INT, offsetof(image_ImageObject, height), READONLY,
+     "height in pixels"},
+    {"bytes_per_line", T_INT, offsetof(image_ImageObject, bytes_per_line),
+     READONLY, "distance in bytes between the start of two rows"},
+    {"bits_per_pixel", T_INT, offsetof(image_ImageObject, bits_per_pixel),
+     READONLY, "size of a pixel"},
+    {"shared", T_INT, offsetof(image_ImageObject, shared), READONLY,
+     "whether the pixels live in memory shared with the X server"},
+    {"dock", T_OBJECT, offsetof(image_ImageObject, dock), READONLY,
+     "the Dock this image belongs to"},
+    {NULL}  /* Sentinel */
+};
+
+static PyGetSetDef Image_getset[] = {
+    {"data", (getter)Image_getData, NULL,
+     "writable memoryview of the pixels", NULL},
+    {NULL}  /* Sentinel */
+};
+
+static PyTypeObject image_ImageType = {
+    PyObject_HEAD_INIT(NULL)
+    0,                         /*ob_size*/
+    "pywmgeneral.Image",       /*tp_name*/
+    sizeof(image_ImageObject), /*tp_basicsize*/
+    0,                         /*tp_itemsize*/
+    (destructor)Image_dealloc, /*tp_dealloc*/
+    0,                         /*tp_print*/
+    0,                         /*tp_getattr*/
+    0,                         /*tp_setattr*/
+    0,                         /*tp_compare*/
+    0,                         /*tp_repr*/
+    0,                         /*tp_as_number*/
+    0,                         /*tp_as_sequence*/
+    0,                         /*tp_as_mapping*/
+    0,                         /*tp_hash */
+    0,                         /*tp_call*/
+    0,                         /*tp_str*/
+    0,                         /*tp_getattro*/
+    0,                         /*tp_setattro*/
+    &Image_as_buffer,          /*tp_as_buffer*/
+    Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE | Py_TPFLAGS_HAVE_NEWBUFFER, /*tp_flags*/
+    "Image objects",           /* tp_doc */
+    0,		               /* tp_traverse */
+    0,		               /* tp_clear */
+    0,		               /* tp_richcompare */
+    0,		               /* tp_weaklistoffset */
+    0,		               /* tp_iter */
+    0,		               /* tp_iternext */
+    Image_methods,             /* tp_methods */
+    Image_members,             /* tp_members */
+    Image_getset,              /* tp_getset */
+    0,                         /* tp_base */
+    0,                         /* tp_dict */
+    0,                         /* tp_descr_get */
+    0,                         /* tp_descr_set */
+    0,                         /* tp_dictoffset */
+    (initproc)Image_init,      /* tp_init */
+    0,                         /* tp_alloc */
+    PyType_GenericNew,         /* tp_new */
+};
+
+/*
+ * end of class Image
+ *
+ */
+
+static PyObject *
+Dock_drawString(dock_DockObject *self, PyObject *args) {
+    /* glyphs - buffer of ints, (x, y, width) of each glyph in the pixmap
+     * first  - character code of the first glyph
+     * height - height of all glyphs
+     * text   - str or unicode to paint
+     * x, y   - where to paint it
+     * target - optional Drawable to paint into instead of the pixmap
+     *
+     * the glyphs are taken from the pixmap of the dock.
+     * characters without a glyph are painted as the first one. return the
+     * width of the painted string.
+     */
+    PyObject *glyphsObj, *text, *target = NULL;
+    const void *buffer;
+    Py_ssize_t len, count, length, i;
+    const int *glyphs, *glyph;
+    int first, height, x, y, dx;
+    long code;
+    Drawable dest;
+    WMDock *dock = &self->dock;
+
+    if (!PyArg_ParseTuple(args, "OiiOii|O", &glyphsObj, &first, &height,
+                          &text, &x, &y, &target))
+        return NULL;
+    if (!Dock_check(self))
+        return NULL;
+    if (PyObject_AsReadBuffer(glyphsObj, &buffer, &len) < 0)
+        return NULL;
+    count = len / (3 * sizeof(int));
+    if (!count || len % (3 * sizeof(int))) {
+        PyErr_SetString(PyExc_ValueError,
+                        "glyph table must hold groups of 3 ints.");
+        return NULL;
+    }
+    glyphs = (const int *)buffer;
+
+    if (target == NULL || target == Py_None)
+        dest = dock->wmgen.pixmap;
+    else if (PyObject_TypeCheck(target, &drawable_DrawableType))
+        dest = ((drawable_DrawableObject *)target)->drawable;
+    else {
+        PyErr_SetString(PyExc_TypeError, "Drawable expected.");
+        return NULL;
+    }
+
+    if (PyUnicode_Check(text))
+        length = PyUnicode_GET_SIZE(text);
+    else if (PyString_Check(text))
+        length = PyString_GET_SIZE(text);
+    else {
+        PyErr_SetString(PyExc_TypeError, "String expected.");
+        return NULL;
+    }
+
+    for (i = 0, dx = x; i < length; i++) {
+        if (PyUnicode_Check(text))
+            code = PyUnicode_AS_UNICODE(text)[i];
+        else
+            code = (unsigned char)PyString_AS_STRING(text)[i];
+        code -= first;
+        if (code < 0 || code >= count)
+            code = 0;
+        glyph = glyphs + 3 * code;
+        XCopyArea(display, dock->wmgen.pixmap, dest, dock->NormalGC,
+                  glyph[0], glyph[1], glyph[2], height, dx, y);
+        dx += glyph[2];
+    }
+    if (dest == dock->wmgen.pixmap)
+        AddDamage(dock, x, y, dx - x, height);
+
+    return Py_BuildValue("i", dx - x);
+}
 
-MOUSE_REGION    mouse_region[MAX_MOUSE_REGION];
+/*****************************************************************************/
+/* Original C sources (With some modifications)                              */
+/*****************************************************************************/
 
   /***********************/
  /* Function Prototypes */
@@ -448,9 +1743,10 @@ MOUSE_REGION    mouse_region[MAX_MOUSE_REGION];
 
 static void GetXPM(XpmIcon *, char **);
 static Pixel GetColor(char *);
-void RedrawWindow(void);
-void AddMouseRegion(int, int, int, int, int);
-int CheckMouseRegion(int, int);
+void AddDamage(WMDock *, int, int, int, int);
+void RedrawWindow(WMDock *);
+void AddMouseRegion(WMDock *, int, int, int, int, int);
+int CheckMouseRegion(WMDock *, int, int);
 
 /*******************************************************************************\
 |* GetXPM                                                                      *|
@@ -511,41 +1807,151 @@ static int flush_expose(Window w) {
     return i;
 }
 
+/* Whether the window, win or iconwin, is mapped and not fully obscured. */
+#define WINDOW_VISIBLE(dock, window) \
+    ((dock)->window##_mapped && (dock)->window##_visibility != VisibilityFullyObscured)
+
+/*******************************************************************************\
+|* AddDamage                                                                   *|
+\*******************************************************************************/
+
+void AddDamage(WMDock *dock, int x, int y, int width, int height) {
+    /* Only the upper left area of the pixmap is ever shown, the rest holds
+     * patterns and fonts and changes there need not be pushed.
+     */
+    int x2 = x + width, y2 = y + height;
+
+    if (x < 0) x = 0;
+    if (y < 0) y = 0;
+    if (x2 > dock->mysizehints.width) x2 = dock->mysizehints.width;
+    if (y2 > dock->mysizehints.height) y2 = dock->mysizehints.height;
+    if (x2 <= x || y2 <= y)
+        return;
+
+    if (dock->dirty_x2 <= dock->dirty_x1) {
+        dock->dirty_x1 = x; dock->dirty_y1 = y;
+        dock->dirty_x2 = x2; dock->dirty_y2 = y2;
+        return;
+    }
+    if (x < dock->dirty_x1) dock->dirty_x1 = x;
+    if (y < dock->dirty_y1) dock->dirty_y1 = y;
+    if (x2 > dock->dirty_x2) dock->dirty_x2 = x2;
+    if (y2 > dock->dirty_y2) dock->dirty_y2 = y2;
+}
+
 /*******************************************************************************\
 |* RedrawWindow                                                                *|
 \*******************************************************************************/
 
-void RedrawWindow(void) {
-    
-    flush_expose(iconwin);
-    XCopyArea(display, wmgen.pixmap, iconwin, NormalGC, 
-              0,0, wmgen.attributes.width, wmgen.attributes.height, 0,0);
-    flush_expose(win);
-    XCopyArea(display, wmgen.pixmap, win, NormalGC,
-              0,0, wmgen.attributes.width, wmgen.attributes.height, 0,0);
+void RedrawWindow(WMDock *dock) {
+    /* Push the damaged area to the windows, nothing at all if nothing
+     * changed since the last time.  Windows that can't be seen are left
+     * alone: under WindowMaker only iconwin is ever mapped.  If no window
+     * can be seen, the damage waits for one to show up.
+     */
+    int x = dock->dirty_x1, y = dock->dirty_y1;
+    int w = dock->dirty_x2 - dock->dirty_x1, h = dock->dirty_y2 - dock->dirty_y1;
+    int toWin = WINDOW_VISIBLE(dock, win), toIconwin = WINDOW_VISIBLE(dock, iconwin);
+
+    if (w <= 0 || h <= 0 || !(toWin || toIconwin))
+        return;
+    dock->dirty_x1 = dock->dirty_y1 = dock->dirty_x2 = dock->dirty_y2 = 0;
+
+    /* send it right away, without holding the GIL. */
+    Py_BEGIN_ALLOW_THREADS
+    if (toIconwin)
+        XCopyArea(display, dock->wmgen.pixmap, dock->iconwin, dock->NormalGC,
+                  x, y, w, h, x, y);
+    if (toWin)
+        XCopyArea(display, dock->wmgen.pixmap, dock->win, dock->NormalGC,
+                  x, y, w, h, x, y);
+    XFlush(display);
+    Py_END_ALLOW_THREADS
 }
 
 /*******************************************************************************\
 |* RedrawWindowXY                                                              *|
 \*******************************************************************************/
 
-void RedrawWindowXY(int x, int y) {
+void RedrawWindowXY(WMDock *dock, int x, int y) {
+    int toWin = WINDOW_VISIBLE(dock, win), toIconwin = WINDOW_VISIBLE(dock, iconwin);
     
-    flush_expose(iconwin);
-    XCopyArea(display, wmgen.pixmap, iconwin, NormalGC, 
-                x,y, wmgen.attributes.width, wmgen.attributes.height, 0,0);
-    flush_expose(win);
-    XCopyArea(display, wmgen.pixmap, win, NormalGC,
-                x,y, wmgen.attributes.width, wmgen.attributes.height, 0,0);
+    Py_BEGIN_ALLOW_THREADS
+    if (toIconwin) {
+        flush_expose(dock->iconwin);
+        XCopyArea(display, dock->wmgen.pixmap, dock->iconwin, dock->NormalGC, 
+                    x,y, dock->wmgen.attributes.width, dock->wmgen.attributes.height, 0,0);
+    }
+    if (toWin) {
+        flush_expose(dock->win);
+        XCopyArea(display, dock->wmgen.pixmap, dock->win, dock->NormalGC,
+                    x,y, dock->wmgen.attributes.width, dock->wmgen.attributes.height, 0,0);
+    }
+    XFlush(display);
+    Py_END_ALLOW_THREADS
+}
+
+/*******************************************************************************\
+|* TrackVisibility                                                             *|
+\*******************************************************************************/
+
+void TrackVisibility(WMDock *dock, XEvent *event) {
+    /* Keep up with a MapNotify, UnmapNotify or VisibilityNotify of one of
+     * the windows, and paint a window that just became visible: what was
+     * drawn while nobody could see it is still only in the pixmap.
+     *
+     * No event comes when an ancestor is unmapped, then the window just
+     * looks visible still.
+     */
+    int *mapped, *visibility, before;
+
+    if (event->xany.window == dock->win) {
+        mapped = &dock->win_mapped;
+        visibility = &dock->win_visibility;
+    } else if (event->xany.window == dock->iconwin) {
+        mapped = &dock->iconwin_mapped;
+        visibility = &dock->iconwin_visibility;
+    } else
+        return;
+    before = *mapped && *visibility != VisibilityFullyObscured;
+    switch (event->type) {
+    case MapNotify:
+        *mapped = 1;
+        break;
+    case UnmapNotify:
+        /* a VisibilityNotify follows the next MapNotify. */
+        *mapped = 0;
+        *visibility = VisibilityUnobscured;
+        break;
+    case VisibilityNotify:
+        *visibility = event->xvisibility.state;
+        break;
+    }
+    if (!before && *mapped && *visibility != VisibilityFullyObscured) {
+        AddDamage(dock, 0, 0, dock->mysizehints.width, dock->mysizehints.height);
+        RedrawWindow(dock);
+    }
+}
+
+/*******************************************************************************\
+|* IsVisible                                                                   *|
+\*******************************************************************************/
+
+int IsVisible(WMDock *dock) {
+    /* Whether anybody can see the dock. */
+    return dock->open &&
+        (WINDOW_VISIBLE(dock, win) || WINDOW_VISIBLE(dock, iconwin));
 }
 
 /*******************************************************************************\
 |* AddMouseRegion                                                              *|
 \*******************************************************************************/
 
-void AddMouseRegion(int index, int left, int top, int right, int bottom) {
+void AddMouseRegion(WMDock *dock, int index, int left, int top, int right, int bottom) {
+
+    MOUSE_REGION *mouse_region = dock->mouse_region;
 
-    if (index < MAX_MOUSE_REGION) {
+    if (index >= 0 && index < MAX_MOUSE_REGION) {
         mouse_region[index].enable = 1;
         mouse_region[index].top = top;
         mouse_region[index].left = left;
@@ -558,8 +1964,9 @@ void AddMouseRegion(int index, int left, int top, int right, int bottom) {
 |* CheckMouseRegion                                                            *|
 \*******************************************************************************/
 
-int CheckMouseRegion(int x, int y) {
+int CheckMouseRegion(WMDock *dock, int x, int y) {
 
+    MOUSE_REGION *mouse_region = dock->mouse_region;
     int        i;
     int        found;
 
@@ -629,21 +2036,24 @@ void createXBMfromXPM(char *xbm, char **xpm, int sx, int sy) {
 |* copyXPMArea                                                                 *|
 \*******************************************************************************/
 
-void copyXPMArea(int x, int y, int sx, int sy, int dx, int dy) {
-    /* in pywmgeneral_copyXPMArea variables are named differently.
+void copyXPMArea(WMDock *dock, int x, int y, int sx, int sy, int dx, int dy) {
+    /* in Dock_copyXPMArea variables are named differently.
      */
 
-    XCopyArea(display, wmgen.pixmap, wmgen.pixmap, NormalGC, x, y, sx, sy, dx, dy);
-
+    XCopyArea(display, dock->wmgen.pixmap, dock->wmgen.pixmap, dock->NormalGC,
+              x, y, sx, sy, dx, dy);
+    AddDamage(dock, dx, dy, sx, sy);
 }
 
 /*******************************************************************************\
 |* copyXBMArea                                                                 *|
 \*******************************************************************************/
 
-void copyXBMArea(int x, int y, int sx, int sy, int dx, int dy) {
+void copyXBMArea(WMDock *dock, int x, int y, int sx, int sy, int dx, int dy) {
 
-    XCopyArea(display, wmgen.mask, wmgen.pixmap, NormalGC, x, y, sx, sy, dx, dy);
+    XCopyArea(display, dock->wmgen.mask, dock->wmgen.pixmap, dock->NormalGC,
+              x, y, sx, sy, dx, dy);
+    AddDamage(dock, dx, dy, sx, sy);
 }
 
 
@@ -651,16 +2061,16 @@ void copyXBMArea(int x, int y, int sx, int sy, int dx, int dy) {
 |* setMaskXY                                                                   *|
 \*******************************************************************************/
 
-void setMaskXY(int x, int y) {
+void setMaskXY(WMDock *dock, int x, int y) {
 
-     XShapeCombineMask(display, win, ShapeBounding, x, y, pixmask, ShapeSet);
-     XShapeCombineMask(display, iconwin, ShapeBounding, x, y, pixmask, ShapeSet);
+     XShapeCombineMask(display, dock->win, ShapeBounding, x, y, dock->pixmask, ShapeSet);
+     XShapeCombineMask(display, dock->iconwin, ShapeBounding, x, y, dock->pixmask, ShapeSet);
 }
 
 /*******************************************************************************\
 |* openXwindow                                                                 *|
 \*******************************************************************************/
-void openXwindow(int argc, char *argv[], char *pixmap_bytes[], char *pixmask_bits, int pixmask_width, int pixmask_height) {
+void openXwindow(WMDock *dock, int argc, char *argv[], char *pixmap_bytes[], char *pixmask_bits, int pixmask_width, int pixmask_height) {
 
     unsigned int   borderwidth = 1;
     XClassHint     classHint;
@@ -676,6 +2086,10 @@ void openXwindow(int argc, char *argv[], char *pixmap_bytes[], char *pixmask_bit
     int            dummy=0;
     int            i, wx, wy;
 
+    XSizeHints    *mysizehints = &dock->mysizehints;
+    XWMHints      *mywmhints = &dock->mywmhints;
+    Window         win, iconwin;
+
     /* Changed to work better with Python. Changed check in for loop to control
      * argc instead of argv.
      */
@@ -690,77 +2104,65 @@ void openXwindow(int argc, char *argv[], char *pixmap_bytes[], char *pixmask_bit
         }
     }
 
-    if (!(display = XOpenDisplay(display_name))) {
-        fprintf(stderr, "%s: can't open display %s\n", 
-                wname, XDisplayName(display_name));
-        exit(1);
+    /* The display is opened by the first dock, the others share it. */
+    if (!display) {
+        if (!(display = XOpenDisplay(display_name))) {
+            fprintf(stderr, "%s: can't open display %s\n", 
+                    wname, XDisplayName(display_name));
+            exit(1);
+        }
+        display_generation++;
+        screen  = DefaultScreen(display);
+        Root    = RootWindow(display, screen);
+        d_depth = DefaultDepth(display, screen);
+        x_fd    = XConnectionNumber(display);
+
+        /* Added 2003-06-24 for graceful shutdown. */
+        deleteAtom = XInternAtom(display, "WM_DELETE_WINDOW", 0);
     }
-    screen  = DefaultScreen(display);
-    Root    = RootWindow(display, screen);
-    d_depth = DefaultDepth(display, screen);
-    x_fd    = XConnectionNumber(display);
 
     /* Convert XPM to XImage */
-    GetXPM(&wmgen, pixmap_bytes);
+    GetXPM(&dock->wmgen, pixmap_bytes);
 
     /* Create a window to hold the stuff */
-    mysizehints.flags = USSize | USPosition;
-    mysizehints.x = 0;
-    mysizehints.y = 0;
+    mysizehints->flags = USSize | USPosition;
+    mysizehints->x = 0;
+    mysizehints->y = 0;
 
     back_pix = GetColor("white");
     fore_pix = GetColor("black");
 
-    XWMGeometry(display, screen, Geometry, NULL, borderwidth, &mysizehints,
-                &mysizehints.x, &mysizehints.y,&mysizehints.width,&mysizehints.height, &dummy);
+    XWMGeometry(display, screen, Geometry, NULL, borderwidth, mysizehints,
+                &mysizehints->x, &mysizehints->y,&mysizehints->width,&mysizehints->height, &dummy);
 
-    mysizehints.width = 64;
-    mysizehints.height = 64;
+    mysizehints->width = 64;
+    mysizehints->height = 64;
         
-    win = XCreateSimpleWindow(display, Root, mysizehints.x, mysizehints.y,
-                              mysizehints.width, mysizehints.height, borderwidth, 
+    win = XCreateSimpleWindow(display, Root, mysizehints->x, mysizehints->y,
+                              mysizehints->width, mysizehints->height, borderwidth, 
                               fore_pix, back_pix);
     
-    iconwin = XCreateSimpleWindow(display, win, mysizehints.x, mysizehints.y,
-                                  mysizehints.width, mysizehints.height, borderwidth, 
+    iconwin = XCreateSimpleWindow(display, win, mysizehints->x, mysizehints->y,
+                                  mysizehints->width, mysizehints->height, borderwidth, 
                                   fore_pix, back_pix);
 
+    dock->win = win;
+    dock->iconwin = iconwin;
+    /* nothing is mapped yet, the first MapNotify paints the window. */
+    dock->win_mapped = dock->iconwin_mapped = 0;
+    dock->win_visibility = dock->iconwin_visibility = VisibilityUnobscured;
 
-    /* Added 2003-06-24 for graceful shutdown. */
-    deleteAtom = XInternAtom(display, "WM_DELETE_WINDOW", 0);
     XSetWMProtocols(display, win, &deleteAtom, 1);
 
 
     /* Activate hints */
-    XSetWMNormalHints(display, win, &mysizehints);
+    XSetWMNormalHints(display, win, mysizehints);
     classHint.res_name = wname;
     classHint.res_class = wname;
     XSetClassHint(display, win, &classHint);
 
-    XSelectInput(display, win,
-                 ExposureMask | 
-                 ButtonPressMask | 
-                 ButtonReleaseMask |	/* added ButtonReleaseMask *charkins*/
-                 KeyPressMask |           /* Try this to get keyboard working */
-                 PointerMotionMask |
-                 FocusChangeMask |
-                 LeaveWindowMask |
-                 StructureNotifyMask |
-                 EnterWindowMask );
-    XSelectInput(display, iconwin, 
-                 ExposureMask | 
-                 ButtonPressMask | 
-                 ButtonReleaseMask |	/* added ButtonReleaseMask *charkins*/
-                 KeyPressMask |           /* Try this to get keyboard working */
-                 PointerMotionMask |
-                 FocusChangeMask |
-                 LeaveWindowMask |
-                 StructureNotifyMask |
-                 EnterWindowMask );
-                 //ButtonPressMask | ButtonReleaseMask | KeyPressMask | KeyReleaseMask | 
-                 //ExposureMask | 
-                 //FocusChangeMask | EnterWindowMask |
-                 //PointerMotionMask | StructureNotifyMask);
+    XSelectInput(display, win, dock->event_mask);
+    XSelectInput(display, iconwin, dock->event_mask);
 
     if (XStringListToTextProperty(&wname, 1, &name) == 0) {
         fprintf(stderr, "%s: can't allocate window name\n", wname);
@@ -775,25 +2177,25 @@ void openXwindow(int argc, char *argv[], char *pixmap_bytes[], char *pixmask_bit
     gcv.foreground = fore_pix;
     gcv.background = back_pix;
     gcv.graphics_exposures = 0;
-    NormalGC = XCreateGC(display, Root, gcm, &gcv);
+    dock->NormalGC = XCreateGC(display, Root, gcm, &gcv);
 
     /* ONLYSHAPE ON */
 
-    pixmask = XCreateBitmapFromData(display, win, pixmask_bits, pixmask_width, pixmask_height);
+    dock->pixmask = XCreateBitmapFromData(display, win, pixmask_bits, pixmask_width, pixmask_height);
 
-    XShapeCombineMask(display, win, ShapeBounding, 0, 0, pixmask, ShapeSet);
-    XShapeCombineMask(display, iconwin, ShapeBounding, 0, 0, pixmask, ShapeSet);
+    XShapeCombineMask(display, win, ShapeBounding, 0, 0, dock->pixmask, ShapeSet);
+    XShapeCombineMask(display, iconwin, ShapeBounding, 0, 0, dock->pixmask, ShapeSet);
 
     /* ONLYSHAPE OFF */
 
-    mywmhints.initial_state = WithdrawnState;
-    mywmhints.icon_window = iconwin;
-    mywmhints.icon_x = mysizehints.x;
-    mywmhints.icon_y = mysizehints.y;
-    mywmhints.window_group = win;
-    mywmhints.flags = StateHint | IconWindowHint | IconPositionHint | WindowGroupHint;
+    mywmhints->initial_state = WithdrawnState;
+    mywmhints->icon_window = iconwin;
+    mywmhints->icon_x = mysizehints->x;
+    mywmhints->icon_y = mysizehints->y;
+    mywmhints->window_group = win;
+    mywmhints->flags = StateHint | IconWindowHint | IconPositionHint | WindowGroupHint;
 
-    XSetWMHints(display, win, &mywmhints);
+    XSetWMHints(display, win, mywmhints);
 
     XSetCommand(display, win, argv, argc);
     XMapWindow(display, win);
@@ -805,8 +2207,56 @@ void openXwindow(int argc, char *argv[], char *pixmap_bytes[], char *pixmask_bit
         }
         XMoveWindow(display, win, wx, wy);
     }
+
+    /* isDockEvent looks at the list with the display locked. */
+    XLockDisplay(display);
+    dock->open = 1;
+    dock->next = docks;
+    docks = dock;
+    XUnlockDisplay(display);
 }
 
+/*******************************************************************************\
+|* closeXwindow                                                                *|
+\*******************************************************************************/
+void closeXwindow(WMDock *dock) {
+    /* Free what openXwindow created. The display goes with the last dock. */
+
+    WMDock       **p;
+
+    XLockDisplay(display);
+    for (p = &docks; *p; p = &(*p)->next)
+        if (*p == dock) {
+            *p = dock->next;
+            break;
+        }
+    dock->next = NULL;
+    dock->open = 0;
+    XUnlockDisplay(display);
+
+    XFreeGC(display, dock->NormalGC);
+    XFreePixmap(display, dock->pixmask);
+    XFreePixmap(display, dock->wmgen.pixmap);
+    if (dock->wmgen.mask)
+        XFreePixmap(display, dock->wmgen.mask);
+    XpmFreeAttributes(&dock->wmgen.attributes);
+    /* iconwin is a child of win and goes with it. */
+    if (dock->win != None)
+        XDestroyWindow(display, dock->win);
+    dock->win = dock->iconwin = None;
+    free(dock->maskBits);
+    dock->maskBits = NULL;
+    memset(&dock->wmgen, 0, sizeof(dock->wmgen));
+    dock->dirty_x1 = dock->dirty_y1 = dock->dirty_x2 = dock->dirty_y2 = 0;
+
+    if (!docks) {
+        XCloseDisplay(display);
+        display = NULL;
+    } else
+        XFlush(display);
+}
+
+
 #ifndef PyMODINIT_FUNC	/* declarations for DLL import/export */
 #define PyMODINIT_FUNC void
 #endif
@@ -814,16 +2264,47 @@ void openXwindow(int argc, char *argv[], char *pixmap_bytes[], char *pixmask_bit
 PyMODINIT_FUNC
 initpywmgeneral(void) {
     PyObject* m;
+
+    /* before any other Xlib call: the GIL is released around X I/O, so
+     * threads may use the connection concurrently.
+     */
+    XInitThreads();
   
     drawable_DrawableType.tp_new = PyType_GenericNew;
     if (PyType_Ready(&drawable_DrawableType) < 0)
         return;
+    if (PyType_Ready(&dock_DockType) < 0)
+        return;
+    if (PyType_Ready(&image_ImageType) < 0)
+        return;
+    PyStructSequence_InitType(&EventType, &event_desc);
+    /* a mapping of its own, the one of the struct sequences is shared. */
+    Event_as_mapping = *EventType.tp_as_mapping;
+    structseq_subscript = Event_as_mapping.mp_subscript;
+    Event_as_mapping.mp_subscript = Event_subscript;
+    EventType.tp_as_mapping = &Event_as_mapping;
+
+    if (!(type_buttonpress = PyString_InternFromString("buttonpress")) ||
+        !(type_buttonrelease = PyString_InternFromString("buttonrelease")) ||
+        !(type_keypress = PyString_InternFromString("keypress")) ||
+        !(type_motionnotify = PyString_InternFromString("motionnotify")) ||
+        !(type_destroynotify = PyString_InternFromString("destroynotify")))
+        return;
   
     m = Py_InitModule3("pywmgeneral", PyWmgeneralMethods,
                        "base C module for wmdocklib");
     if (m == NULL)
         return;
 
+    Py_INCREF(&dock_DockType);
+    PyModule_AddObject(m, "Dock", (PyObject *)&dock_DockType);
+
     Py_INCREF(&drawable_DrawableType);
     PyModule_AddObject(m, "Drawable", (PyObject *)&drawable_DrawableType);
+
+    Py_INCREF(&image_ImageType);
+    PyModule_AddObject(m, "Image", (PyObject *)&image_ImageType);
+
+    Py_INCREF(&EventType);
+    PyModule_AddObject(m, "Event", (PyObject *)&EventType);
 }
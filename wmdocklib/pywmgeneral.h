@@ -41,6 +41,46 @@ typedef struct {
 	XpmAttributes	attributes;
 } XpmIcon;
 
+typedef struct {
+	int		enable;
+	int		top;
+	int		bottom;
+	int		left;
+	int		right;
+} MOUSE_REGION;
+
+/* Everything wmgeneral.c kept in globals about its one window. Several
+ * docks share the X connection.
+ */
+typedef struct _WMDock WMDock;
+
+struct _WMDock {
+	Window			win, iconwin;
+	GC				NormalGC;
+	XpmIcon			wmgen;
+	Pixmap			pixmask;
+	XSizeHints		mysizehints;
+	XWMHints		mywmhints;
+	char			**pixmap;
+	char			*maskBits;
+	/* Bounding box of the part of the visible area of wmgen.pixmap that
+	 * changed since the last RedrawWindow. Nothing is dirty while
+	 * dirty_x2 <= dirty_x1.
+	 */
+	int				dirty_x1, dirty_y1, dirty_x2, dirty_y2;
+	MOUSE_REGION	mouse_region[MAX_MOUSE_REGION];
+	/* What the windows select, see setEventMask. */
+	long			event_mask;
+	/* What the X server told about the windows: whether they are mapped,
+	 * and their VisibilityNotify state. Only the windows that can be seen
+	 * are drawn to.
+	 */
+	int				win_mapped, iconwin_mapped;
+	int				win_visibility, iconwin_visibility;
+	int				open;
+	WMDock			*next;
+};
+
   /*******************/
  /* Global variable */
 /*******************/
@@ -51,16 +91,20 @@ Display		*display;
  /* Function Prototypes */
 /***********************/
 
-void AddMouseRegion(int index, int left, int top, int right, int bottom);
-int CheckMouseRegion(int x, int y);
+void AddMouseRegion(WMDock *, int index, int left, int top, int right, int bottom);
+int CheckMouseRegion(WMDock *, int x, int y);
 
-void openXwindow(int argc, char *argv[], char **, char *, int, int);
-void RedrawWindow(void);
-void RedrawWindowXY(int x, int y);
+void openXwindow(WMDock *, int argc, char *argv[], char **, char *, int, int);
+void closeXwindow(WMDock *);
+void AddDamage(WMDock *, int x, int y, int width, int height);
+void RedrawWindow(WMDock *);
+void RedrawWindowXY(WMDock *, int x, int y);
+void TrackVisibility(WMDock *, XEvent *);
+int IsVisible(WMDock *);
 
 void createXBMfromXPM(char *, char **, int, int);
-void copyXPMArea(int, int, int, int, int, int);
-void copyXBMArea(int, int, int, int, int, int);
-void setMaskXY(int, int);
+void copyXPMArea(WMDock *, int, int, int, int, int, int);
+void copyXBMArea(WMDock *, int, int, int, int, int, int);
+void setMaskXY(WMDock *, int, int);
 
 #endif
@@ -0,0 +1,616 @@
+"""pywmheadless.py
+
+in-memory replacement for the pywmgeneral C module.
+
+this module offers the same functions and the same Drawable class as
+pywmgeneral, but instead of talking to an X server it draws into byte
+buffers holding one xpm character code per pixel.  it lets dockapps, the
+library and its benchmarks run where there is no display, and it makes the
+window contents available for pixel exact comparisons.
+
+select it by setting the environment variable WMDOCKLIB_BACKEND to
+'headless' before importing wmdocklib, or with pywmhelpers.setBackend.
+
+events are not generated by anybody, push them with pushEvent.  there is
+no window manager either: a window is mapped as soon as it is open, until
+an 'unmapnotify' event is pushed.
+
+as in the C module, every Dock is a window of its own, the module level
+functions use a default one, and all Docks share one 'connection': a pipe
+that is readable while any of them has events.
+
+Licensed under the GNU General Public License.
+"""
+
+import os, fcntl, select, errno, string, collections
+
+__all__ = ['includePixmap', 'openXwindow', 'redrawWindow', 'redrawWindowXY',
+           'addMouseRegion', 'checkMouseRegion', 'copyXPMArea',
+           'copyXPMAreas', 'drawString', 'checkForEvents', 'connectionNumber',
+           'getEvents', 'setEventMask', 'isVisible', 'pendingEvents', 'waitForEvent', 'pushEvent',
+           'getWindowXPM', 'getPixel', 'Dock', 'Drawable', 'Image', 'Event']
+
+MAX_MOUSE_REGION = 16
+
+# the types of events reported when asked for each type, as by the event
+# masks of the C module: a buttonrelease needs the buttonpress selected too.
+# expose and destroynotify always come.
+_selectedTypes = {
+    'buttonpress': ('buttonpress',),
+    'buttonrelease': ('buttonpress', 'buttonrelease'),
+    'keypress': ('keypress',),
+    'motionnotify': ('motionnotify',),
+    'destroynotify': (),
+    }
+_alwaysSelected = ('expose', 'destroynotify', 'mapnotify', 'unmapnotify',
+                   'visibilitynotify')
+
+# the states of a visibilitynotify event, as in X.h.
+VisibilityUnobscured, VisibilityPartiallyObscured, VisibilityFullyObscured = \
+    range(3)
+
+def _eventTypes(types):
+    """the set of event types selected for types, all of them for None."""
+    result = set(_alwaysSelected)
+    if types is None:
+        types = _selectedTypes.keys()
+    for name in types:
+        if name not in _selectedTypes:
+            raise ValueError('Unknown event type: %s.' % name)
+        result.update(_selectedTypes[name])
+    return result
+
+def _checkStrings(l):
+    if not isinstance(l, list):
+        raise TypeError('List expected.')
+    for s in l:
+        if not isinstance(s, str):
+            raise TypeError('String expected.')
+
+class Event(collections.namedtuple('Event',
+                                   'type button x y state keycode count')):
+    """an event as returned by getEvents, fields that do not apply are None.
+
+    event['x'] works as event.x, as with the dictionaries of checkForEvents.
+    """
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        return tuple.__getitem__(self, key)
+
+def _toEvent(event):
+    """the Event for a dictionary given to pushEvent."""
+    fields = dict.fromkeys(Event._fields)
+    fields.update([(name, value) for name, value in event.items()
+                   if name in fields])
+    if fields['type'] == 'motionnotify':
+        fields['count'] = 1
+    return Event(**fields)
+
+class _Image:
+    """a rectangle of pixels, cpp bytes each, stored row by row.
+    """
+    def __init__(self, width, height, cpp, fill=None):
+        self.width = width
+        self.height = height
+        self.cpp = cpp
+        if fill is None:
+            fill = ' ' * cpp
+        self.pixels = bytearray(fill * (width * height))
+
+    def copyArea(self, source, sx, sy, w, h, dx, dy):
+        """copy a rectangle of source into self, as XCopyArea does.
+
+        parts falling outside of either image are not copied, source and
+        self may be the same image and the rectangles may overlap.  return
+        the rectangle actually written, as (x, y, w, h).
+        """
+        if sx < 0:
+            w += sx; dx -= sx; sx = 0
+        if sy < 0:
+            h += sy; dy -= sy; sy = 0
+        if dx < 0:
+            w += dx; sx -= dx; dx = 0
+        if dy < 0:
+            h += dy; sy -= dy; dy = 0
+        w = min(w, source.width - sx, self.width - dx)
+        h = min(h, source.height - sy, self.height - dy)
+        if w <= 0 or h <= 0:
+            return (dx, dy, 0, 0)
+        cpp = self.cpp
+        srcPixels, srcStride = source.pixels, source.width * cpp
+        dstPixels, dstStride = self.pixels, self.width * cpp
+        rows = range(h)
+        if source is self and dy > sy:
+            rows.reverse()
+        for i in rows:
+            s = (sy + i) * srcStride + sx * cpp
+            d = (dy + i) * dstStride + dx * cpp
+            dstPixels[d:d + w * cpp] = srcPixels[s:s + w * cpp]
+        return (dx, dy, w, h)
+
+    def fill(self, code):
+        self.pixels[:] = code * (self.width * self.height)
+
+    def getPixel(self, x, y):
+        i = (y * self.width + x) * self.cpp
+        return str(self.pixels[i:i + self.cpp])
+
+    def rows(self):
+        stride = self.width * self.cpp
+        return [str(self.pixels[i:i + stride])
+                for i in range(0, len(self.pixels), stride)]
+
+# the pipe standing for the X connection, and the open docks sharing it.
+_pipe = None
+_docks = []
+
+class Dock:
+    """one dockapp window, with all the state pywmgeneral keeps in its
+    WMDock structure.
+    """
+    def __init__(self):
+        self.xpm = None
+        self.colors = None
+        self.pixmap = None
+        self.window = None
+        self.mask = None
+        self.width = self.height = 0
+        self.damage = None
+        self.mouseRegions = [None] * MAX_MOUSE_REGION
+        self.events = collections.deque()
+        self.eventTypes = None
+        self.mapped = False
+        self.visibility = VisibilityUnobscured
+
+    def checkOpen(self):
+        if self not in _docks:
+            raise RuntimeError('X client must be initialized first.')
+
+    def includePixmap(self, xpm):
+        _checkStrings(xpm)
+        self.xpm = xpm
+
+    def openXwindow(self, argc, argv, width, height, events=None):
+        global _pipe
+        _checkStrings(argv)
+        if self.xpm is None:
+            raise RuntimeError('includePixmap must be called first.')
+        if self in _docks:
+            raise RuntimeError('X window already open.')
+        self.eventTypes = _eventTypes(events)
+        w, h, ncolors, cpp = [int(i) for i in self.xpm[0].split()[:4]]
+        self.colors = {}
+        for line in self.xpm[1:ncolors + 1]:
+            self.colors[line[:cpp]] = line[cpp:].split()[-1]
+        self.pixmap = _Image(w, h, cpp)
+        rows = self.xpm[ncolors + 1:ncolors + 1 + h]
+        rows += [''] * (h - len(rows))
+        self.pixmap.pixels[:] = ''.join([row[:w * cpp].ljust(w * cpp)
+                                         for row in rows])
+        # the first color is the transparent one, as in createXBMfromXPM.
+        transparent = self.xpm[1][:cpp]
+        self.mask = [[self.pixmap.getPixel(x, y) != transparent
+                      for x in range(min(width, w))]
+                     for y in range(min(height, h))]
+        # the window always is 64x64, whatever is asked.
+        self.width = self.height = 64
+        self.window = _Image(self.width, self.height, cpp, transparent)
+        self.damage = None
+        self.mapped = True
+        self.visibility = VisibilityUnobscured
+        if _pipe is None:
+            _pipe = os.pipe()
+            for fd in _pipe:
+                fcntl.fcntl(fd, fcntl.F_SETFL,
+                            fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        _docks.append(self)
+        self.addDamage(0, 0, self.width, self.height)
+
+    def close(self):
+        """destroy the window, the last dock also closes the connection.
+
+        the contents stay available to getWindowXPM and getPixel.
+        """
+        global _pipe
+        if self not in _docks:
+            return
+        _docks.remove(self)
+        self._discardEvents()
+        if not _docks:
+            for fd in _pipe:
+                os.close(fd)
+            _pipe = None
+
+    def _discardEvents(self):
+        while self.events:
+            self.events.popleft()
+            try:
+                os.read(_pipe[0], 1)
+            except OSError:
+                pass
+
+    def addDamage(self, x, y, w, h):
+        x2, y2 = min(x + w, self.width), min(y + h, self.height)
+        x, y = max(x, 0), max(y, 0)
+        if x2 <= x or y2 <= y:
+            return
+        if self.damage is None:
+            self.damage = [x, y, x2, y2]
+            return
+        d = self.damage
+        d[:] = [min(x, d[0]), min(y, d[1]), max(x2, d[2]), max(y2, d[3])]
+
+    def isVisible(self):
+        """whether the window is mapped and not fully obscured."""
+        return (self in _docks and self.mapped and
+                self.visibility != VisibilityFullyObscured)
+
+    def _trackVisibility(self, event):
+        visible = self.isVisible()
+        if event['type'] == 'mapnotify':
+            self.mapped = True
+        elif event['type'] == 'unmapnotify':
+            self.mapped = False
+            self.visibility = VisibilityUnobscured
+        else:
+            self.visibility = event['state']
+        if not visible and self.isVisible():
+            self.addDamage(0, 0, self.width, self.height)
+            self.redrawWindow()
+
+    def redrawWindow(self):
+        """as long as the window can't be seen, the damage waits."""
+        self.checkOpen()
+        if self.damage is None or not self.isVisible():
+            return
+        x1, y1, x2, y2 = self.damage
+        self.damage = None
+        self.window.copyArea(self.pixmap, x1, y1, x2 - x1, y2 - y1, x1, y1)
+
+    def redrawWindowXY(self, x, y):
+        self.checkOpen()
+        if not self.isVisible():
+            return
+        self.window.copyArea(self.pixmap, x, y,
+                             self.pixmap.width, self.pixmap.height, 0, 0)
+
+    def addMouseRegion(self, index, left, top, right, bottom):
+        if 0 <= index < MAX_MOUSE_REGION:
+            self.mouseRegions[index] = (left, top, right, bottom)
+
+    def checkMouseRegion(self, x, y):
+        for i, region in enumerate(self.mouseRegions):
+            if region is None:
+                continue
+            left, top, right, bottom = region
+            if left <= x <= right and top <= y <= bottom:
+                return i
+        return -1
+
+    def copyXPMArea(self, sx, sy, w, h, dx, dy):
+        self.checkOpen()
+        self.pixmap.copyArea(self.pixmap, sx, sy, w, h, dx, dy)
+        self.addDamage(dx, dy, w, h)
+
+    def copyXPMAreas(self, areas):
+        self.checkOpen()
+        for sx, sy, w, h, dx, dy in _toInts(areas):
+            if w > 0 and h > 0:
+                self.copyXPMArea(sx, sy, w, h, dx, dy)
+
+    def drawString(self, glyphs, first, height, text, x, y, target=None):
+        self.checkOpen()
+        count = len(glyphs) / 3
+        if not count or len(glyphs) % 3:
+            raise ValueError('glyph table must hold groups of 3 ints.')
+        if target is None:
+            dest = self.pixmap
+        elif isinstance(target, Drawable):
+            dest = target._image
+        else:
+            raise TypeError('Drawable expected.')
+        if not isinstance(text, basestring):
+            raise TypeError('String expected.')
+        dx = x
+        for ch in text:
+            code = ord(ch) - first
+            if code < 0 or code >= count:
+                code = 0
+            gx, gy, gw = glyphs[3 * code:3 * code + 3]
+            dest.copyArea(self.pixmap, gx, gy, gw, height, dx, y)
+            dx += gw
+        if dest is self.pixmap:
+            self.addDamage(x, y, dx - x, height)
+        return dx - x
+
+    def colorCode(self, *names):
+        """the code of a color in the pixmap, given any of its names.
+
+        a color that is not part of the xpm gets an unused code, as the X
+        server would allocate it.
+        """
+        names = [name.lower() for name in names]
+        for code, color in self.colors.items():
+            if color.lower() in names:
+                return code
+        for ch in string.printable:
+            code = ch * self.pixmap.cpp
+            if code not in self.colors:
+                self.colors[code] = names[0]
+                return code
+        raise RuntimeError('no free color code for %s.' % names[0])
+
+    def setEventMask(self, events):
+        """report only these types of events, as pushed from now on."""
+        self.checkOpen()
+        self.eventTypes = _eventTypes(events)
+
+    def pushEvent(self, event):
+        """events of types not selected are dropped, as by the X server."""
+        self.checkOpen()
+        if event['type'] not in self.eventTypes:
+            return
+        self.events.append(event)
+        os.write(_pipe[1], 'e')
+
+    def checkForEvents(self):
+        self.checkOpen()
+        while self.events:
+            event = self.events.popleft()
+            try:
+                os.read(_pipe[0], 1)
+            except OSError:
+                pass
+            if event['type'] == 'expose':
+                self.addDamage(event.get('x', 0), event.get('y', 0),
+                               event.get('width', self.width),
+                               event.get('height', self.height))
+                self.redrawWindow()
+                continue
+            if event['type'] in ('mapnotify', 'unmapnotify',
+                                 'visibilitynotify'):
+                self._trackVisibility(event)
+                continue
+            if event['type'] == 'destroynotify':
+                self.close()
+            return event
+        return None
+
+    def getEvents(self):
+        """all pending events as a list of Event, motions in a row merged."""
+        self.checkOpen()
+        result = []
+        motion = False
+        # a destroynotify closes the dock, as in the C module.
+        while self in _docks:
+            event = self.checkForEvents()
+            if event is None:
+                break
+            event = _toEvent(event)
+            if event.type == 'motionnotify' and motion:
+                event = event._replace(count=result[-1].count + 1)
+                result[-1] = event
+            else:
+                result.append(event)
+            motion = event.type == 'motionnotify'
+        return result
+
+    def connectionNumber(self):
+        """the same for all docks."""
+        if _pipe is None:
+            raise RuntimeError('X client must be initialized first.')
+        return _pipe[0]
+
+    def pendingEvents(self):
+        """the events of all docks together."""
+        if _pipe is None:
+            raise RuntimeError('X client must be initialized first.')
+        return sum([len(dock.events) for dock in _docks])
+
+    def waitForEvent(self, timeout=None):
+        """wait until any dock has events, at most timeout seconds."""
+        pending = self.pendingEvents()
+        if not pending:
+            if timeout is not None:
+                timeout = max(timeout, 0)
+            try:
+                select.select([_pipe[0]], [], [], timeout)
+            except select.error, e:
+                if e.args[0] != errno.EINTR:
+                    raise
+            pending = self.pendingEvents()
+        return pending
+
+    def getWindowXPM(self):
+        if self.pixmap is None:
+            raise RuntimeError('X client must be initialized first.')
+        colors = ['%s c %s' % item for item in sorted(self.colors.items())]
+        header = '%d %d %d %d' % (self.width, self.height,
+                                  len(colors), self.pixmap.cpp)
+        return [header] + colors + self.window.rows()
+
+    def getPixel(self, x, y, window=True):
+        if self.pixmap is None:
+            raise RuntimeError('X client must be initialized first.')
+        if window:
+            return self.colors.get(self.window.getPixel(x, y))
+        return self.colors.get(self.pixmap.getPixel(x, y))
+
+    def Drawable(self, w, h):
+        """a Drawable of this dock."""
+        return Drawable(w, h, self)
+
+    def Image(self, w, h):
+        """an Image of this dock."""
+        return Image(w, h, self)
+
+_dock = Dock()
+
+def _toInts(areas):
+    """a flat sequence of integers, six per area, as a list of tuples."""
+    areas = list(areas)
+    if len(areas) % 6:
+        raise ValueError('sequence must hold groups of 6 ints.')
+    return [tuple(areas[i:i + 6]) for i in range(0, len(areas), 6)]
+
+def includePixmap(xpm):
+    """Set the global pixmap that will be used as a mask and for everything else."""
+    _dock.includePixmap(xpm)
+
+def openXwindow(argc, argv, width, height, events=None):
+    """Open the X window containing everything."""
+    _dock.openXwindow(argc, argv, width, height, events)
+
+def redrawWindow():
+    """Redraw the parts of the window changed since the last redraw."""
+    _dock.redrawWindow()
+
+def redrawWindowXY(x, y):
+    """Redraw a give region of the window."""
+    _dock.redrawWindowXY(x, y)
+
+def addMouseRegion(index, left, top, right, bottom):
+    """Add a mouse region with a given index."""
+    _dock.addMouseRegion(index, left, top, right, bottom)
+
+def checkMouseRegion(x, y):
+    """Check if the given coordinates are in any mouse region."""
+    return _dock.checkMouseRegion(x, y)
+
+def copyXPMArea(sx, sy, w, h, dx, dy):
+    """Copy an area of the global XPM."""
+    _dock.copyXPMArea(sx, sy, w, h, dx, dy)
+
+def copyXPMAreas(areas):
+    """Copy a batch of areas of the global XPM."""
+    _dock.copyXPMAreas(areas)
+
+def drawString(glyphs, first, height, text, x, y, target=None):
+    """Paint a string using a glyph table, return its width."""
+    return _dock.drawString(glyphs, first, height, text, x, y, target)
+
+def checkForEvents():
+    """Check for some Xevents"""
+    return _dock.checkForEvents()
+
+def getEvents():
+    """Return the list of all pending events."""
+    return _dock.getEvents()
+
+def setEventMask(events):
+    """Select the types of events to report."""
+    _dock.setEventMask(events)
+
+def isVisible():
+    """Return whether the window can be seen."""
+    return _dock.isVisible()
+
+def connectionNumber():
+    """Return the file descriptor of the X connection."""
+    return _dock.connectionNumber()
+
+def pendingEvents():
+    """Flush the X connection and return the number of pending events."""
+    return _dock.pendingEvents()
+
+def waitForEvent(timeout=None):
+    """Wait for X events, at most timeout seconds, releasing the GIL."""
+    return _dock.waitForEvent(timeout)
+
+def pushEvent(event):
+    """queue an event, a dictionary as returned by checkForEvents.
+
+    an event of type 'expose' is handled by checkForEvents itself, as the C
+    module does: the given area, or the whole window, is redrawn.  so are
+    'mapnotify', 'unmapnotify' and 'visibilitynotify', with its 'state'.
+    events of types not selected with openXwindow or setEventMask are
+    dropped.
+    """
+    _dock.pushEvent(event)
+
+def getWindowXPM():
+    """return the contents of the window as a list of xpm strings."""
+    return _dock.getWindowXPM()
+
+def getPixel(x, y, window=True):
+    """return the color of a pixel of the window, or of the pixmap."""
+    return _dock.getPixel(x, y, window)
+
+def _dockArgument(dock):
+    """the dock given to a Drawable or an Image, the default one for None."""
+    if dock is None:
+        dock = _dock
+    elif not isinstance(dock, Dock):
+        raise TypeError('Dock expected.')
+    dock.checkOpen()
+    return dock
+
+class Drawable:
+    """Drawable objects"""
+    def __init__(self, w, h, dock=None):
+        dock = _dockArgument(dock)
+        self.dock = dock
+        self.width = w
+        self.height = h
+        self._image = _Image(w, h, dock.pixmap.cpp)
+
+    def xCopyAreaFromWindow(self, sx, sy, w, h, dx, dy):
+        """copy from the pixmap of the dock into the drawable"""
+        self._image.copyArea(self.dock.pixmap, sx, sy, w, h, dx, dy)
+
+    def xCopyAreasFromWindow(self, areas):
+        """copy a batch of areas from the pixmap of the dock into the drawable"""
+        for sx, sy, w, h, dx, dy in _toInts(areas):
+            if w > 0 and h > 0:
+                self._image.copyArea(self.dock.pixmap, sx, sy, w, h, dx, dy)
+
+    def xCopyAreaToWindow(self, sx, sy, w, h, dx, dy):
+        """copy from the drawable to the pixmap of the dock"""
+        self.dock.pixmap.copyArea(self._image, sx, sy, w, h, dx, dy)
+        self.dock.addDamage(dx, dy, w, h)
+
+    def xClear(self):
+        """clears the pixmap"""
+        # the C module clears with the black foreground of its GC.
+        self._image.fill(self.dock.colorCode('black', '#000000', '#000000000000'))
+
+class Image:
+    """Image objects
+
+    here the pixels are xpm character codes, cpp bytes each, and data is a
+    bytearray.  there is no X server to share memory with.
+    """
+    def __init__(self, w, h, dock=None):
+        if w <= 0 or h <= 0:
+            raise ValueError('Image size must be positive.')
+        dock = _dockArgument(dock)
+        self.dock = dock
+        self.width = w
+        self.height = h
+        self._image = _Image(w, h, dock.pixmap.cpp)
+        self.bytes_per_line = w * self._image.cpp
+        self.bits_per_pixel = 8 * self._image.cpp
+        self.shared = 0
+        self.data = self._image.pixels
+
+    def put(self, sx, sy, w, h, dx, dy):
+        """copy an area of the image into the pixmap of its dock"""
+        x, y, w, h = self.dock.pixmap.copyArea(self._image, sx, sy, w, h, dx, dy)
+        self.dock.addDamage(x, y, w, h)
+
+    def get(self, x, y):
+        """fill the image from the pixmap of its dock"""
+        if (x < 0 or y < 0 or x + self.width > self.dock.pixmap.width or
+            y + self.height > self.dock.pixmap.height):
+            raise ValueError('area outside of the pixmap.')
+        self._image.copyArea(self.dock.pixmap, x, y, self.width, self.height, 0, 0)
+
+    def pixel(self, name):
+        """the bytes encoding a named color in the image"""
+        return self.dock.colorCode(name)
@@ -26,14 +26,94 @@ Some changes to handle the additional event handling in pywmgeneral
 First workingish version
 """
 
-import os, re, types
+import os, re, types, string, time
+import array, marshal, weakref
 import ConfigParser
 
 charset_start = None
 charset_width = None
 pattern_start = None
+font = None
+
+def _importBackend(name):
+    if name == 'x11':
+        import pywmgeneral
+        return pywmgeneral
+    if name == 'headless':
+        import pywmheadless
+        return pywmheadless
+    raise ValueError('unknown backend %r' % name)
+
+# the module doing the real drawing, the C one talking to the X server
+# unless the environment asks for the in-memory one.
+pywmgeneral = _importBackend(os.environ.get('WMDOCKLIB_BACKEND', 'x11'))
+
+# the dock the functions below work on.  the backend module itself stands
+# for its default dock.
+_dock = pywmgeneral
+
+def setBackend(name):
+    """select the module doing the drawing.
+
+    name is 'x11', the default, or 'headless', which draws into memory and
+    needs no display.  call this before initPixmap.  the names exported by
+    the wmdocklib package are bound at import time, so prefer setting the
+    WMDOCKLIB_BACKEND environment variable when using those.
+    """
+    global pywmgeneral, _dock
+    pywmgeneral = _dock = _importBackend(name)
+    _dockStates.clear()
+
+# the module globals describing the pixmap of the current dock, and their
+# values for the docks that are not current.
+_dockGlobals = ('tile_width', 'tile_height', 'pattern_start', 'char_width',
+                'char_height', 'char_twidth', 'charset_start',
+                'charset_width', 'font')
+_dockStates = weakref.WeakKeyDictionary()
+
+class _DefaultDockKey:
+    pass
+_defaultDockKey = _DefaultDockKey()
+
+def newDock():
+    """Return a new dock, a window of its own.
+
+    A process may host several dockapps: all their docks share one
+    connection to the X server, and so one event loop.  Make a dock
+    current with useDock before initializing or drawing into it.
+    """
+    return pywmgeneral.Dock()
+
+def useDock(dock=None):
+    """Make dock the one all functions of this module work on.
+
+    None stands for the default dock, the one used by programs hosting one
+    dockapp only.  The character set and the pattern positions set by
+    initPixmap follow the dock.  Return the previously current dock.
+    """
+    global _dock
+    if dock is None:
+        dock = pywmgeneral
+    previous = _dock
+    if dock is previous:
+        return previous
+    g = globals()
+    # modules can't be weakly referenced, see _stateKey.
+    _dockStates[_stateKey(previous)] = dict([(name, g.get(name))
+                                             for name in _dockGlobals])
+    g.update(_dockStates.get(_stateKey(dock), dict.fromkeys(_dockGlobals)))
+    _dock = dock
+    return previous
+
+def _stateKey(dock):
+    if dock is pywmgeneral:
+        return _defaultDockKey
+    return dock
+
+def currentDock():
+    """Return the dock the functions of this module work on."""
+    return _dock
 
-import pywmgeneral
 defaultRGBFileList = [
     '/etc/X11/rgb.txt',
     '/usr/lib/X11/rgb.txt',
@@ -42,6 +122,13 @@ defaultRGBFileList = [
     '/usr/lib/X11/rgb.txt',
     ]
 
+# where parsed files are kept between runs; set to None to disable.
+cacheDir = os.path.join(os.environ.get('XDG_CACHE_HOME') or
+                        os.path.expanduser('~/.cache'), 'wmdocklib')
+
+# rgb file name -> dictionary normalized color name -> '#rrggbb'
+_rgbTables = {}
+
 def readConfigFile(fileName, errOut):
     """Read the config file fileName.
 
@@ -77,6 +164,55 @@ def getCenterStartPos(s, areaWidth, offset):
     textArea = areaWidth - offset * 2 - 1
     return (textArea - w) / 2
 
+class Font:
+    """a character set as laid out in the global pixmap by initPixmap.
+
+    the position and width of every glyph is computed once and kept in the
+    glyphs array, three integers (x, y, width) per character starting at
+    the character code first.  painting a string is then one single call
+    to the C module.
+    """
+
+    thinChars = u"',.:;"
+
+    def __init__(self, width, height, thinwidth, top, rowwidth, rowcount,
+                 first=32):
+        self.width = width
+        self.height = height
+        self.thinwidth = thinwidth
+        self.top = top
+        self.rowwidth = rowwidth
+        self.first = first
+        # the character set is a grid of width x height cells, starting at
+        # row top, column 0, with as many cells per row as fit in rowwidth.
+        columns = rowwidth / width
+        self.glyphs = array.array('i')
+        for i in range(columns * (rowcount / height)):
+            w = width
+            if unichr(first + i) in self.thinChars:
+                w = thinwidth
+            self.glyphs.extend(((i % columns) * width,
+                                top + (i / columns) * height,
+                                w))
+
+    def glyph(self, ch):
+        """Return (x, y, width) of the cell holding ch in the global pixmap.
+
+        characters not in the set get the first glyph.
+        """
+        index = ord(ch) - self.first
+        if not 0 <= index < len(self.glyphs) / 3:
+            index = 0
+        return tuple(self.glyphs[index*3:index*3+3])
+
+    def render(self, s, x, y, drawable=None):
+        """Paint s at x, y, in the global pixmap or in drawable.
+
+        Return the painted width.
+        """
+        return _dock.drawString(self.glyphs, self.first, self.height,
+                                      s, x, y, drawable)
+
 def addChar(ch, x, y, xOffset, yOffset, width, height, drawable=None):
     """Paint the character ch at position x, y in the window.
 
@@ -91,26 +227,11 @@ def addChar(ch, x, y, xOffset, yOffset, width, height, drawable=None):
     character starts out of the boundary.
     """
 
-    if not (32 <= ord(ch) <= 127):
-        #print ord(ch)
-        #raise ValueError, "Unsupported Char: '%s'(%d)" % (ch, ord(ch))
-        pass
-    
-    # linelength is the amount of bits the character set uses on each row.
-    linelength = charset_width - (charset_width % char_width)
-    # pos is the horizontal index of the box containing ch.
-    pos = (ord(ch)-32) * char_width
-    # translate pos into chX, chY, rolling back and down each linelength
-    # bits.  character definition start at row 64, column 0.
-    chY = (pos / linelength) * char_height + charset_start
-    chX = pos % linelength
+    chX, chY, chW = font.glyph(ch)
     targX = x + xOffset
     targY = y + yOffset
-    chW = char_width
-    if ch in "',.:;":
-        chW = char_twidth
     if drawable is None:
-        pywmgeneral.copyXPMArea(chX, chY, chW, char_height, targX, targY)
+        _dock.copyXPMArea(chX, chY, chW, char_height, targX, targY)
     else:
         drawable.xCopyAreaFromWindow(chX, chY, chW, char_height, targX, targY)
     return (chW, char_height)
@@ -118,14 +239,9 @@ def addChar(ch, x, y, xOffset, yOffset, width, height, drawable=None):
 def addString(s, x, y, xOffset=0, yOffset=0, width=None, height=None, drawable=None):
     """Add a string at the given x and y positions.
     
-    Call addChar repeatedely, so the same exception rules apply."""
-    lastW = 0
-    for letter in s:
-        w, h = addChar(letter, x + lastW, y, 
-                       xOffset, yOffset, width, height,
-                       drawable)
-        lastW += w
-    return lastW
+    The same rules as in addChar apply, but the whole string is painted by
+    one single call to the C module.  Return the painted width."""
+    return font.render(s, x + xOffset, y + yOffset, drawable)
 
 def getVertSpacing(numLines, margin, height, yOffset):
     """Return the optimal spacing between a number of lines.
@@ -135,6 +251,8 @@ def getVertSpacing(numLines, margin, height, yOffset):
     return h / (numLines - 1)
 
 
+_xpmString = re.compile(r'"([^"]*)"')
+
 def readXPM(fileName):
     """Read the xpm in filename.
 
@@ -147,18 +265,11 @@ def readXPM(fileName):
     function has not been tested extensively.  do not try to use more than 
     """
     f = file(fileName, 'r')
-    lines = [l.rstrip('\n') for l in f.readlines()]
-    s = ''.join(lines)
-    res = []
-    while 1:
-        nextStrStart = s.find('"')
-        if nextStrStart != -1:
-            nextStrEnd = s.find('"', nextStrStart + 1)
-            if nextStrEnd != -1:
-                res.append(s[nextStrStart+1:nextStrEnd])
-                s = s[nextStrEnd+1:]
-                continue
-        break
+    try:
+        # xpm strings never span lines, scan the file line by line.
+        res = [item for line in f for item in _xpmString.findall(line)]
+    finally:
+        f.close()
 
     palette = {}
     colorCount = int(res[0].split(' ')[2])
@@ -171,36 +282,96 @@ def readXPM(fileName):
     res = res[1 + int(res[0].split(' ')[2]):]
     return palette, res
 
-def initPixmap(background=None,
+_fontSize = re.compile(r'.*?(?P<w>[0-9]+)(?:\((?P<t>[0-9]+)\))?x(?P<h>[0-9]+).*')
+
+def readFont(font_name):
+    """Read the character set font_name from the library directory.
+
+    Return (width, height, thinwidth, rows, palette).  The cell size is
+    inferred from the name, like 6x8, thinwidth is the width of the
+    punctuation characters, like the 3 in 6(3)x8.  rows and palette are as
+    returned by readXPM.
+
+    The parsed font is kept in the disk cache until the xpm file changes.
+    """
+    fileName = os.path.join(os.path.dirname(__file__), font_name + '.xpm')
+    cached = loadCache('font', fileName)
+    if cached is not None:
+        return cached
+
+    m = _fontSize.match(font_name)
+    if not m:
+        raise ValueError("can't infer font size from name (does not contain wxh)")
+    width = int(m.groupdict().get('w'))
+    height = int(m.groupdict().get('h'))
+    thinwidth = int(m.groupdict().get('t') or width)
+
+    font_palette, fontdef = readXPM(fileName)
+    result = (width, height, thinwidth, fontdef, font_palette)
+    storeCache('font', fileName, result)
+    return result
+
+def calibrateFontPalette(font_palette, fg, bg):
+    """computes modified font_palette
+
+    takes into account only intensity of original value.
+
+    fg, bg must be of the form #xxxxxx
+
+    the corresponding calibrated color lies at a specific percentage of
+    the vector going from background to foreground."""
+
+    bg_point = [int(bg[i*2+1:i*2+3],16) for i in range(3)]
+    fg_point = [int(fg[i*2+1:i*2+3],16) for i in range(3)]
+
+    fg_vec = [f-b for (f,b) in zip(fg_point,bg_point)]
+
+    new_font_palette = {}
+    for k, colorName in font_palette.items():
+        if colorName == 'None':
+            continue
+        origColor = getColorCode(colorName)[1:]
+        origRgb = [int(origColor[i*2:i*2+2],16)/256. for i in range(3)]
+        intensity = sum(origRgb) / 3
+        newRgb = [i * intensity + base for i,base in zip(fg_vec, bg_point)]
+        new_font_palette[k] = '#'+''.join(["%02x"%i for i in newRgb])
+
+    return new_font_palette
+
+class _PhaseClock:
+    """records in timings the seconds spent between successive calls."""
+    def __init__(self, timings):
+        self.timings = timings
+        self.last = time.time()
+
+    def __call__(self, phase):
+        if self.timings is None:
+            return
+        now = time.time()
+        self.timings[phase] = self.timings.get(phase, 0) + now - self.last
+        self.last = now
+
+def makePixmap(background=None,
                patterns=None,
                style='3d',
                width=64, height=64,
                margin=3,
                font_name='6x8',
                bg=0, fg=7,
-               palette=None, debug = 0):
-    """builds and sets the pixmap of the program. 
-
-    the (width)x(height) upper left area is the work area in which we put
-    what we want to be displayed.
-
-    the remaining upper right area contains patterns that can be used for
-    blanking/resetting portions of the displayed area.
+               palette=None, debug = 0,
+               timings=None):
+    """builds the pixmap of the program, see initPixmap.
 
-    the remaining lower area defines the character set.  this is initialized
-    using the corresponding named character set.  a file with this name must
-    be found somewhere in the path.  
+    return the pair (xpm, font): xpm is the list of strings to pass to
+    includePixmap, font the Font describing the character set in it.
 
-    palette is a dictionary
-    1: of integers <- [0..15] to colors.
-    2: of single chars to colors.
-
-    a default palette is provided, and can be silently overwritten with the
-    one passed as parameter.
-
-    The XBM mask is created out of the XPM.
+    if timings is a dictionary, the seconds spent in each phase are added
+    to it, under the keys 'colors', 'readFont', 'remapFont', 'calibrate'
+    and 'assemble'.
     """
 
+    clock = _PhaseClock(timings)
+
     # initially all characters 32-126 are available...
     available = dict([(chr(ch), True) for ch in range(32,127)])
 
@@ -237,6 +408,7 @@ def initPixmap(background=None,
                 v = getColorCode(v)
             palette[k] = v
             available[k] = False
+    clock('colors')
 
     if isinstance(bg, int):
         bg = '%x' % bg
@@ -273,76 +445,37 @@ def initPixmap(background=None,
                 nbackground[bottom][x] = ex
         background = [ ''.join(item) for item in nbackground ]
 
-    global tile_width, tile_height
-    tile_width = width
-    tile_height = height
-
-    global pattern_start
-    pattern_start = height
-
-    def readFont(font_name):
-        # read xpm, return cell_size, definition and palette.
-        font_palette, fontdef = readXPM(__file__[:__file__.rfind(os.sep) + 1] + font_name + '.xpm')
-
-        import re
-        m = re.match(r'.*?(?P<w>[0-9]+)(?:\((?P<t>[0-9]+)\))?x(?P<h>[0-9]+).*', font_name)
-        if not m:
-            raise ValueError("can't infer font size from name (does not contain wxh)")
-        width = int(m.groupdict().get('w'))
-        height = int(m.groupdict().get('h'))
-        thinwidth = int(m.groupdict().get('t') or width)
-
-        replace = []
+    def remapFont(fontdef, font_palette):
+        # give the font colors that clash with the palette a free code,
+        # rewriting all rows in one pass.
+        replace = {}
         for code, value in font_palette.items():
             if available[code]:
                 continue
-            if palette[code] != font_palette[code]:
+            if palette[code] != value:
                 newcode = [k for k in available if available[k] and not k in font_palette][0]
                 available[newcode] = False
-                replace.append((code, newcode))
-        for code, newcode in replace:
-            for row, i in zip(fontdef,range(len(fontdef))):
-                fontdef[i] = row.replace(code, newcode)
-            font_palette[newcode] = font_palette[code]
-            del font_palette[code]
-        return width, height, thinwidth, fontdef, font_palette
-
-    def calibrateFontPalette(font_palette, fg, bg):
-        """computes modified font_palette
-
-        takes into account only intensity of original value.
-
-        fg, bg must be of the form #xxxxxx
-
-        the corresponding calibrated color lies at a specific percentage of
-        the vector going from background to foreground."""
-
-        bg_point = [int(bg[i*2+1:i*2+3],16) for i in range(3)]
-        fg_point = [int(fg[i*2+1:i*2+3],16) for i in range(3)]
-
-        fg_vec = [f-b for (f,b) in zip(fg_point,bg_point)]
-
-        new_font_palette = {}
-        for k, colorName in font_palette.items():
-            if colorName == 'None':
-                continue
-            origColor = getColorCode(colorName)[1:]
-            origRgb = [int(origColor[i*2:i*2+2],16)/256. for i in range(3)]
-            intensity = sum(origRgb) / 3
-            newRgb = [i * intensity + base for i,base in zip(fg_vec, bg_point)]
-            new_font_palette[k] = '#'+''.join(["%02x"%i for i in newRgb])
-        
-        return new_font_palette
-        
-    global char_width, char_height, char_twidth
-    char_width, char_height, char_twidth, fontdef, font_palette = readFont(font_name)
+                replace[code] = newcode
+        if replace:
+            table = string.maketrans(''.join(replace.keys()),
+                                     ''.join(replace.values()))
+            fontdef = [row.translate(table) for row in fontdef]
+            for code, newcode in replace.items():
+                font_palette[newcode] = font_palette.pop(code)
+        return fontdef, font_palette
+
+    clock('assemble')
+    cwidth, cheight, ctwidth, fontdef, font_palette = readFont(font_name)
+    clock('readFont')
+    fontdef, font_palette = remapFont(fontdef, font_palette)
+    clock('remapFont')
     font_palette = calibrateFontPalette(font_palette, palette[fg], palette[bg])
+    clock('calibrate')
     
     palette.update(font_palette)
 
-    global charset_start, charset_width
-    charset_start = height + len(patterns)
-    charset_width = len(fontdef[0])
+    newFont = Font(cwidth, cheight, ctwidth,
+                   height + len(patterns), len(fontdef[0]), len(fontdef))
 
     xpmwidth = max(len(background[0]), len(patterns[0]), len(fontdef[0]))
     xpmheight = len(background)+len(patterns)+len(fontdef)
@@ -369,41 +502,138 @@ def initPixmap(background=None,
         for item in xpm:
             print '"%s",' % item
         print '};'
-    pywmgeneral.includePixmap(xpm)
+    clock('assemble')
+    return xpm, newFont
+
+def initPixmap(background=None,
+               patterns=None,
+               style='3d',
+               width=64, height=64,
+               margin=3,
+               font_name='6x8',
+               bg=0, fg=7,
+               palette=None, debug = 0):
+    """builds and sets the pixmap of the program. 
+
+    the (width)x(height) upper left area is the work area in which we put
+    what we want to be displayed.
+
+    the remaining upper right area contains patterns that can be used for
+    blanking/resetting portions of the displayed area.
+
+    the remaining lower area defines the character set.  this is initialized
+    using the corresponding named character set.  a file with this name must
+    be found somewhere in the path.  
+
+    palette is a dictionary
+    1: of integers <- [0..15] to colors.
+    2: of single chars to colors.
+
+    a default palette is provided, and can be silently overwritten with the
+    one passed as parameter.
+
+    The XBM mask is created out of the XPM.
+    """
+
+    xpm, newFont = makePixmap(background, patterns, style, width, height,
+                              margin, font_name, bg, fg, palette, debug)
+
+    global tile_width, tile_height
+    tile_width = width
+    tile_height = height
+
+    global pattern_start
+    pattern_start = height
+
+    global char_width, char_height, char_twidth
+    char_width = newFont.width
+    char_height = newFont.height
+    char_twidth = newFont.thinwidth
+
+    global charset_start, charset_width
+    charset_start = newFont.top
+    charset_width = newFont.rowwidth
+
+    global font
+    font = newFont
+
+    _dock.includePixmap(xpm)
     return char_width, char_height
 
-def openXwindow(argv, w, h):
+def openXwindow(argv, w, h, events=None):
     """Open the X window of given width and height.
     
     The XBM mask is here created from the upper left rectangle of the
-    XPM using the given width and height."""
-    pywmgeneral.openXwindow(len(argv), argv, w, h)
+    XPM using the given width and height.
+
+    events is the list of the types of events the dockapp handles, see
+    setEventMask; by default all of them are reported."""
+    _dock.openXwindow(len(argv), argv, w, h, events)
+
+def setEventMask(events):
+    """Report only the given types of events from now on.
+
+    events is a list of 'buttonpress', 'buttonrelease', 'keypress' and
+    'motionnotify', or None for all of them; 'destroynotify' always comes.
+    The X server does not even send the others, so a dockapp that ignores
+    the pointer is not woken up whenever it moves over the window.  A
+    'buttonrelease' also brings the 'buttonpress' events.
+    """
+    _dock.setEventMask(events)
 
 def redraw():
-    """Redraw the window."""
-    pywmgeneral.redrawWindow()
+    """Redraw the window.
+
+    Only the area touched by copyXPMArea, addString and the Drawable copies
+    since the previous call is sent to the X server, and nothing at all if
+    nothing changed, so calling this often is cheap.
+    """
+    _dock.redrawWindow()
+
+def isVisible():
+    """Return whether the window can be seen: it is mapped and not hidden
+    behind other windows altogether.
+
+    This is what the X server told in the events handled so far, by
+    getEvent or getEvents.  While the window can't be seen, redraw sends
+    nothing to the X server, the changes are pushed when it shows again.
+    A dock that is not open is not visible.
+    """
+    return _dock.isVisible()
 
 def redrawXY(x, y):
     """Redraw a given region of the window."""
-    pywmgeneral.redrawWindowXY(x, y)
+    _dock.redrawWindowXY(x, y)
 
 def copyXPMArea(sourceX, sourceY, width, height, targetX, targetY):
     """Copy an area of the global XPM."""
     if width > 0 or height > 0:
-        pywmgeneral.copyXPMArea(sourceX, sourceY, width, height,
+        _dock.copyXPMArea(sourceX, sourceY, width, height,
                                 targetX, targetY)
 
+def copyXPMAreas(areas):
+    """Copy a batch of areas of the global XPM.
+
+    areas is either an array('i') or a flat sequence of integers holding
+    six values per area, in the order copyXPMArea takes them, or a sequence
+    of such 6-tuples.  All areas are copied in one call to the C module,
+    empty areas are skipped.
+    """
+    if len(areas) and isinstance(areas[0], (types.TupleType, types.ListType)):
+        areas = [value for area in areas for value in area]
+    _dock.copyXPMAreas(areas)
+
 def addMouseRegion(index, left, top, right=None, bottom=None, width=None, height=None):
     """Add a mouse region in the window."""
     if right is bottom is None:
         right = left + width
         bottom = top + height
-    pywmgeneral.addMouseRegion(index, left, top, right, bottom)
+    _dock.addMouseRegion(index, left, top, right, bottom)
 
 def checkMouseRegion(x, y):
     """Check if x,y is in any mouse region. Return that region, otherwise -1.
     """
-    return pywmgeneral.checkMouseRegion(x, y)
+    return _dock.checkMouseRegion(x, y)
 
 def getEvent():
     """Check for XEvents and return one if found.
@@ -417,43 +647,148 @@ def getEvent():
         x, y, button
     'destroynotify':
     """
-    return pywmgeneral.checkForEvents()
+    return _dock.checkForEvents()
+
+def getEvents():
+    """Take all pending XEvents at once, return a list, maybe empty.
+
+    The events are records with the fields type, button, x, y, state,
+    keycode and count, None where they do not apply to the type; the
+    types are those of getEvent.  Pointer motions in a row are merged
+    into the last one, count tells how many there were.  Fields can be
+    read as attributes, event.x, or as in the dictionaries of getEvent,
+    event['x'].
+    """
+    return _dock.getEvents()
+
+def getConnectionNumber():
+    """Return the file descriptor of the X connection.
+
+    Use it to wait for X events with select() together with other file
+    descriptors, instead of polling getEvent() at regular intervals.
+    """
+    return _dock.connectionNumber()
+
+def pendingEvents():
+    """Flush the X connection and return the number of pending events.
+
+    Xlib may have read events from the connection into its own queue
+    already, in which case select() on getConnectionNumber() would not
+    return.  Check this before going to sleep.
+    """
+    return _dock.pendingEvents()
+
+def waitForEvent(timeout=None):
+    """Wait for X events, at most timeout seconds, forever if None.
+
+    Return the number of pending events, 0 if the time ran out.  Other
+    threads keep running while this waits, as they do while the C module
+    talks to the X server: data can be collected in worker threads.
+    """
+    return _dock.waitForEvent(timeout)
+
+def _cacheFileName(kind, sourceName):
+    """Return the name of the cache file for sourceName, or None."""
+    if cacheDir is None:
+        return None
+    sourceName = os.path.abspath(sourceName)
+    return os.path.join(cacheDir, kind + sourceName.replace(os.sep, '%'))
+
+def loadCache(kind, sourceName):
+    """Return what was stored with storeCache for sourceName.
+
+    Return None if there is nothing, or if sourceName changed since.
+    """
+    cacheName = _cacheFileName(kind, sourceName)
+    if cacheName is None:
+        return None
+    try:
+        stat = os.stat(sourceName)
+        f = file(cacheName, 'rb')
+        try:
+            mtime, size, data = marshal.load(f)
+        finally:
+            f.close()
+    except (IOError, OSError, EOFError, ValueError, TypeError):
+        return None
+    if (mtime, size) != (stat.st_mtime, stat.st_size):
+        return None
+    return data
+
+def storeCache(kind, sourceName, data):
+    """Store data, derived from the file sourceName, in the disk cache.
+
+    data must be marshallable.  Failures are silently ignored, the cache is
+    only an optimization.
+    """
+    cacheName = _cacheFileName(kind, sourceName)
+    if cacheName is None:
+        return
+    try:
+        stat = os.stat(sourceName)
+        if not os.path.isdir(cacheDir):
+            os.makedirs(cacheDir)
+        tmpName = '%s.%d' % (cacheName, os.getpid())
+        f = file(tmpName, 'wb')
+        try:
+            marshal.dump((stat.st_mtime, stat.st_size, data), f)
+        finally:
+            f.close()
+        os.rename(tmpName, cacheName)
+    except (IOError, OSError, ValueError):
+        pass
+
+def _normalizeColorName(colorName):
+    return ''.join(colorName.split()).lower()
+
+def readRGBFile(rgbFileName):
+    """Return the colors defined in rgbFileName as a dictionary.
+
+    Keys are the color names, lower case and without spaces, values are
+    '#rrggbb' strings.  The file is parsed only once per process, and the
+    result is kept in the disk cache until the file changes.
+    """
+    table = _rgbTables.get(rgbFileName)
+    if table is not None:
+        return table
+    table = loadCache('rgb', rgbFileName)
+    if table is None:
+        table = {}
+        f = file(rgbFileName, 'r')
+        for l in f:
+            if l[0] == '!':
+                continue
+            words = l.split()
+            if len(words) > 3:
+                try:
+                    r, g, b = [int(i) for i in words[:3]]
+                except ValueError:
+                    continue
+                # the first definition of a name wins.
+                table.setdefault(_normalizeColorName(''.join(words[3:])),
+                                 '#%02x%02x%02x' % (r,g,b))
+        f.close()
+        storeCache('rgb', rgbFileName, table)
+    _rgbTables[rgbFileName] = table
+    return table
 
 def getColorCode(colorName, rgbFileName=None):
     """Convert a color to rgb code usable in an xpm.
     
     We use the file rgbFileName for looking up the colors. Return None
     if we find no match. The rgbFileName should be like the one found in
-    /usr/lib/X11R6/rgb.txt on most sytems.
+    /usr/lib/X11R6/rgb.txt on most sytems.  Names are compared ignoring
+    case and spaces.
     """
     if colorName.startswith('#'):
         return colorName
 
     if rgbFileName is None:
         for fn in defaultRGBFileList:
-            if os.access(fn, os.R_OK):
+            if fn in _rgbTables or os.access(fn, os.R_OK):
                 rgbFileName = fn
                 break
     if rgbFileName is None:
         raise ValueError('cannot find rgb file')
 
-    f = file(rgbFileName, 'r')
-    lines = f.readlines()
-    f.close()
-    for l in lines:
-        if l[0] != '!':
-            words = l.split()
-            if len(words) > 3:
-                name = ' '.join(words[3:])
-                if colorName.lower() == name.lower():
-                    # Found the right color, get it's code
-                    try:
-                        r = int(words[0])
-                        g = int(words[1])
-                        b = int(words[2])
-                    except ValueError:
-                        continue
-                    rgbstr = '#%02x%02x%02x' % (r,g,b)
-                    return rgbstr
-    return None
- 
+    return readRGBFile(rgbFileName).get(_normalizeColorName(colorName))
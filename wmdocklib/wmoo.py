@@ -1,5 +1,6 @@
 import sys, time
 import pywmhelpers
+import eventloop
 
 debug = 0
 
@@ -7,18 +8,30 @@ LEFT = 0
 CENTRE = 1
 RIGHT = 2
 
+# the interval of a widget updated with the application, see Widget.
+REFRESH = 'refresh'
+
 class Widget:
     """
     a widget is a graphical object able to display itself.
 
     a wiget stores its graphical representation in a Drawable.  it gets the
     chance to update its Drawable periodically, since the application will
-    scan all its widgets and call their 'update' method.
+    call its 'update' method every 'interval' seconds.
 
     a callback can be associated to a widget during its creation.  all that
     happens behind the scenes is that the callback is registered on the area
     of the widget, but it is not really directly associated to it.
+
+    interval is how many seconds the application waits between two calls to
+    'update'.  REFRESH, the default, means at every refresh of the
+    application, see Application.setRefreshInterval.  None means the widget
+    only changes when told so and 'update' is never called periodically.  a
+    widget changing its interval must tell its container, calling
+    scheduleWidget.
     """
+    interval = REFRESH
+
     def __init__(self):
         '''do not call ancestor constructor in derived classes!'''
         raise NotImplementedError('Widget is not instantiable')
@@ -27,7 +40,12 @@ class Widget:
     pass
 
 class Label(Widget):
-        
+
+    # seconds per pixel when the text does not fit and scrolls.
+    scrollInterval = 0.1
+    # a label that fits needs no updates, see setText.
+    interval = None
+
     def __init__(self, container, orig, size=None, text='', align=LEFT):
         """a label is a tuple with...
         text: string; mutable
@@ -41,8 +59,7 @@ class Label(Widget):
         if size is None:
             size = (container._char_width * len(text), container._char_height)
         pixmapwidth = max(container._char_width * len(text), size[0])
-        import pywmgeneral
-        labelPixmap = pywmgeneral.Drawable(pixmapwidth, container._char_height)
+        labelPixmap = container._dock.Drawable(pixmapwidth, container._char_height)
         self.orig = orig
         self.size = size
         self.pixw = pixmapwidth
@@ -50,6 +67,7 @@ class Label(Widget):
         self.pixmap = labelPixmap
         self.align = align
         self.container = container
+        self.text = None
         self.setText(text)
 
     def update(self):
@@ -63,16 +81,19 @@ class Label(Widget):
                 self.offset += 1
 
     def setText(self, text):
+        if text == self.text:
+            return
+        self.text = text
         (orig_x,orig_y) = self.orig
         (size_x, size_y) = self.size
         newwidth = self.container._char_width * len(text)
         if newwidth > self.pixw:
-            import pywmgeneral
-            self.pixmap = pywmgeneral.Drawable(newwidth, self.container._char_height)
+            self.pixmap = self.container._dock.Drawable(newwidth, self.container._char_height)
         self.pixw = newwidth
         self.offset = 0
         self.pixmap.xClear()
         self.pixmap.xCopyAreaToWindow(0, 0, size_x, size_y, orig_x, orig_y)
+        self.container._activate()
         w = pywmhelpers.addString(text, 0, 0, drawable=self.pixmap)
         dx = 0
         if w < size_x:
@@ -84,6 +105,13 @@ class Label(Widget):
         else:
             w = size_x
         self.pixmap.xCopyAreaToWindow(0, 0, w, size_y, orig_x+dx, orig_y)
+        # only a scrolling label needs updating.
+        interval = None
+        if size_x < self.pixw:
+            interval = self.scrollInterval
+        if interval != self.interval:
+            self.interval = interval
+            self.container.scheduleWidget(self)
 
 class Button(Widget):
 
@@ -107,6 +135,7 @@ class Button(Widget):
         if callback3 is not None:
             container.addCallback(callback3, 'buttonrelease', area=area)
         self.area = (orig_x, orig_y, dx, dy)
+        self.container = container
         if pattern is not None:
             self.setPattern(pattern)
 
@@ -115,7 +144,7 @@ class Button(Widget):
         """
 
         (x, y, w, h) = self.area
-        pywmhelpers.copyXPMArea(patternOrig[0], patternOrig[1] + 64, w, h, x, y)
+        self.container.putPattern(patternOrig[0], patternOrig[1], w, h, x, y)
     pass
 
 BOUNCE = 0
@@ -171,38 +200,186 @@ class ProgressBar(Widget):
                     self.putPattern(54, 0, 5, 1, 54, 51-i)
 
 class Application:
+    # the open applications, to know when the last one on a loop is gone.
+    _open = []
+
     def __init__(self, *args, **kwargs):
         """initializes the object
 
+        the arguments are those of pywmhelpers.initPixmap, plus:
+        loop: an eventloop.EventLoop shared with other applications.  all
+          the applications of a process then live in one event loop and
+          share one X connection, each in a dock of its own.  by default the
+          application has a loop of its own.
+        argv: the command line for the window manager, sys.argv by default.
+
         _events is a list of tuples (type, key, area, callback)
-          'type' <- ['buttonpress', 'buttonrelease', 'keypress'],
+          'type' <- ['buttonpress', 'buttonrelease', 'keypress',
+                     'motionnotify'],
           'callback': the function to which the event should be passed.
           'key': the utf-8 character or the mouse button number,
           'area': if the pointer is here, the event is considered,
         
         """
+        loop = kwargs.pop('loop', None)
+        argv = kwargs.pop('argv', sys.argv)
         self._widgets = {}
+        self._widgetTimers = {}
+        # the widgets updated by _refresh.
+        self._refreshWidgets = []
+        self._timers = []
         self._events = []
+        self._visible = True
+        self._pauseHidden = False
         self._sleep = 0.1
         self._cycle = 0
         self._offset_x = self._offset_y = 3
 
+        # the helper functions work on the current dock: every entry point
+        # of the application makes its own dock current first.
+        self._dock = pywmhelpers.newDock()
+        self._activate()
         self._char_width, self._char_height = pywmhelpers.initPixmap(*args, **kwargs)
-        pywmhelpers.openXwindow(sys.argv, 64, 64)
+        # no callbacks yet: only the window manager talks to us.
+        pywmhelpers.openXwindow(argv, 64, 64, events=[])
+        self._eventTypes = []
+
+        self._ownLoop = loop is None
+        if loop is None:
+            loop = eventloop.EventLoop()
+        self._loop = loop
+        self._loop.addXHandler(self._processEvents)
+        self._refreshTimer = None
+        self.setRefreshInterval(self._sleep)
+        Application._open.append(self)
         pass
 
+    def _activate(self):
+        pywmhelpers.useDock(self._dock)
+
+    def _activated(self, callback):
+        """callback, called with the dock of the application current."""
+        def activated(*args):
+            self._activate()
+            return callback(*args)
+        return activated
+
+    def setRefreshInterval(self, seconds):
+        """sets how often the application gets updated.
+
+        so are the widgets with the REFRESH interval, the others are
+        updated according to their own interval instead.
+
+        None disables periodic updates altogether: the window is then only
+        redrawn after handling an event or a timer, which is all a static
+        dockapp needs.
+        """
+        if self._refreshTimer is not None:
+            self._refreshTimer.cancel()
+            self._refreshTimer = None
+        self._sleep = seconds
+        if seconds is not None:
+            # on the same grid as the widgets, to share their redraws.
+            delay = seconds - time.time() % seconds
+            self._refreshTimer = self._loop.addTimer(
+                delay, self._activated(self._refresh), seconds)
+
+    def setPauseWhenHidden(self, pause=True):
+        """whether to stop updating the widgets and calling update while
+        nobody can see the window.
+
+        the window is never drawn to while it can't be seen, whatever this
+        setting; pausing also stops the sampling done in update and in the
+        widgets.  leave it off if they keep a history, as graphs do.  on
+        showing again, everything is updated at once.  the timers of
+        addTimer keep running.
+        """
+        self._pauseHidden = pause
+
+    def isVisible(self):
+        """whether the window can be seen, see pywmhelpers.isVisible."""
+        return self._visible
+
+    def _paused(self):
+        return self._pauseHidden and not self._visible
+
+    def addTimer(self, delay, callback, interval=None):
+        """callback() will be called after delay seconds, and then every
+        interval seconds if interval is given.  return an object with a
+        cancel method.
+        """
+        timer = self._loop.addTimer(delay, self._activated(callback), interval)
+        self._timers.append(timer)
+        return timer
+
+    def addReader(self, fd, callback):
+        """callback(fd) will be called during the eventLoop whenever fd has
+        data to be read.
+        """
+        self._loop.addReader(fd, self._activated(callback))
+
+    def removeReader(self, fd):
+        self._loop.removeReader(fd)
+
     def putString(self, x, y, string):
+        self._activate()
         pywmhelpers.addString(string, x, y,
                               self._offset_x, self._offset_y,
                               self._char_width, self._char_height)
 
     def putPattern(self, sourceX, sourceY, width, height, targetX, targetY):
+        self._activate()
         pywmhelpers.copyXPMArea(sourceX, sourceY+64, width, height,
                                 targetX, targetY)
 
+    def putPatterns(self, areas):
+        """paints a batch of patterns in one call.
+
+        areas is a sequence of (sourceX, sourceY, width, height, targetX,
+        targetY) tuples, interpreted as in putPattern.
+        """
+        self._activate()
+        pywmhelpers.copyXPMAreas([(sx, sy+64, w, h, tx, ty)
+                                  for (sx, sy, w, h, tx, ty) in areas])
+
     def addWidget(self, widgetId, widgetClass, *args, **kwargs):
         # print widgetId, widgetClass, args, kwargs
-        self._widgets[widgetId] = widgetClass(self, *args, **kwargs)
+        if widgetId in self._widgets:
+            self._unscheduleWidget(self._widgets[widgetId])
+        widget = widgetClass(self, *args, **kwargs)
+        self._widgets[widgetId] = widget
+        self.scheduleWidget(widget)
+
+    def scheduleWidget(self, widget):
+        """(re)starts calling widget.update every widget.interval seconds.
+
+        widgets with the same interval are updated in the same iteration of
+        the loop, so that they cause one redraw, not one each.
+        """
+        self._unscheduleWidget(widget)
+        interval = widget.interval
+        if interval is None:
+            return
+        if interval == REFRESH:
+            self._refreshWidgets.append(widget)
+            return
+        delay = interval - time.time() % interval
+        self._widgetTimers[widget] = self._loop.addTimer(
+            delay, self._activated(lambda: self._updateWidget(widget)),
+            interval)
+
+    def _unscheduleWidget(self, widget):
+        if widget in self._refreshWidgets:
+            self._refreshWidgets.remove(widget)
+        timer = self._widgetTimers.pop(widget, None)
+        if timer is not None:
+            timer.cancel()
+
+    def _updateWidget(self, widget):
+        if self._paused():
+            return
+        widget.update()
+        self._loop.addIdleCallback(self._flush)
 
     def widget(self, name):
         return self._widgets[name]
@@ -214,11 +391,22 @@ class Application:
         pass
 
     def redraw(self):
+        """updates everything, whatever its interval, and redraws.
+        """
+        self._activate()
         for item in self._widgets.values():
             item.update()
         self.update()
         pywmhelpers.redraw()
 
+    def _refresh(self):
+        if self._paused():
+            return
+        for widget in self._refreshWidgets:
+            widget.update()
+        self.update()
+        self._loop.addIdleCallback(self._flush)
+
     def addHandler(self):
         """adds a signal handler.
 
@@ -242,30 +430,103 @@ class Application:
         if area is not None and len(area) is not 4:
             area = None
         self._events.append( (type, key, area, callback,) )
-        pass
+        self._updateEventMask()
+
+    def removeCallback(self, callback):
+        """the callback will not be called any more, for no event."""
+        self._events = [item for item in self._events if item[3] != callback]
+        self._updateEventMask()
+
+    def _updateEventMask(self):
+        """have the X server send only the events we have callbacks for.
+        """
+        types = [item[0] for item in self._events]
+        if None in types:
+            types = None
+        else:
+            types = sorted(set(types))
+        if types != self._eventTypes:
+            self._eventTypes = types
+            self._activate()
+            pywmhelpers.setEventMask(types)
     
+    def _processEvents(self):
+        """examines pending events and if a callback has been registered,
+        it is called, passing it the event as argument.
+        """
+        self._activate()
+        events = pywmhelpers.getEvents()
+        # the events changing the visibility are handled by getEvents.
+        visible = pywmhelpers.isVisible()
+        if visible != self._visible:
+            self._visible = visible
+            if visible and self._pauseHidden:
+                # catch up with what was not sampled.
+                self.redraw()
+        for event in events:
+            if event.type == 'destroynotify':
+                self._closed()
+                return
+
+            for evtype, key, area, callback in self._events:
+                if evtype is not None and evtype != event.type: continue
+                if key is not None and key != event.button: continue
+                if area is not None and event.x is not None:
+                    if not area[0] <= event.x <= area[2]: continue
+                    if not area[1] <= event.y <= area[3]: continue
+
+                callback(event)
+                # show the effect of the callback without waiting for the
+                # next refresh.
+                self._loop.addIdleCallback(self._flush)
+                self._activate()
+
+            # a callback may have closed the application.
+            if self not in Application._open:
+                return
+
+    def _flush(self):
+        self._loop.removeIdleCallback(self._flush)
+        self._activate()
+        pywmhelpers.redraw()
+
+    def close(self):
+        """destroys the window and stops everything the application
+        scheduled in the loop.  when the last application of the loop is
+        closed, the loop stops.
+        """
+        if self not in Application._open:
+            return
+        self._dock.close()
+        self._closed()
+
+    def _closed(self):
+        # the window is gone already.
+        if self not in Application._open:
+            return
+        Application._open.remove(self)
+        self._loop.removeXHandler(self._processEvents)
+        self._loop.removeIdleCallback(self._flush)
+        for timer in ([self._refreshTimer] + self._widgetTimers.values() +
+                      self._timers):
+            if timer is not None:
+                timer.cancel()
+        self._refreshTimer = None
+        self._widgetTimers.clear()
+        self._refreshWidgets = []
+        self._timers = []
+        for app in Application._open:
+            if app._loop is self._loop:
+                return
+        if self._ownLoop:
+            sys.exit(0)
+        self._loop.stop()
+
     def run(self):
-        """this contains the eventLoop.  events are examined and if a
-        callback has been registered, it is called, passing it the event as
-        argument.
+        """this contains the eventLoop.  it sleeps until an X event arrives,
+        a timer expires or a registered file descriptor becomes readable.
         """
-        while 1:
-            event = pywmhelpers.getEvent()
-            while not event is None:
-                if event['type'] == 'destroynotify':
-                    sys.exit(0)
-
-                for evtype, key, area, callback in self._events:
-                    if evtype is not None and evtype != event['type']: continue
-                    if key is not None and key != event['button']: continue
-                    if area is not None and 'x' in event:
-                        if not area[0] <= event['x'] <= area[2]: continue
-                        if not area[1] <= event['y'] <= area[3]: continue
-
-                    callback(event)
-                    
-                event = pywmhelpers.getEvent()
-            self.redraw()
-            time.sleep(self._sleep)
+        self.redraw()
+        self._loop.run()
             
     pass